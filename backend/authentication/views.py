@@ -6,7 +6,7 @@ from django.contrib.auth import get_user_model, update_session_auth_hash
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.utils.encoding import force_bytes, force_str
-from django.core.mail import send_mail
+from core.mail import queue_mail
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 from .serializers import (
@@ -24,21 +24,15 @@ def register(request):
         user = serializer.save()
         refresh = RefreshToken.for_user(user)
         
-        # Send welcome email
-        try:
-            send_mail(
-                'Welcome to Library Management System',
-                f'Hello {user.username},\n\nWelcome to our Library Management System! '
-                f'Your account has been successfully created.\n\n'
-                f'You can now login and start exploring our library resources.\n\n'
-                f'Best regards,\nLibrary Team',
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=True,
-            )
-        except Exception:
-            # Email sending failed, but registration should still succeed
-            pass
+        # Queue welcome email; the outbox sender delivers it
+        queue_mail(
+            'Welcome to Library Management System',
+            f'Hello {user.username},\n\nWelcome to our Library Management System! '
+            f'Your account has been successfully created.\n\n'
+            f'You can now login and start exploring our library resources.\n\n'
+            f'Best regards,\nLibrary Team',
+            [user.email],
+        )
         
         return Response({
             'user': UserProfileSerializer(user).data,
@@ -131,23 +125,15 @@ def password_reset(request):
         # Send password reset email
         reset_url = f"{settings.FRONTEND_URL}/reset-password/{uid}/{token}/"
         
-        try:
-            send_mail(
-                'Password Reset Request',
-                f'Hello {user.username},\n\n'
-                f'You requested a password reset for your account.\n\n'
-                f'Please click the following link to reset your password:\n{reset_url}\n\n'
-                f'If you did not request this, please ignore this email.\n\n'
-                f'Best regards,\nLibrary Team',
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=True,
-            )
-        except Exception:
-            return Response(
-                {'error': 'Failed to send email. Please try again later.'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        queue_mail(
+            'Password Reset Request',
+            f'Hello {user.username},\n\n'
+            f'You requested a password reset for your account.\n\n'
+            f'Please click the following link to reset your password:\n{reset_url}\n\n'
+            f'If you did not request this, please ignore this email.\n\n'
+            f'Best regards,\nLibrary Team',
+            [user.email],
+        )
         
         return Response({'message': 'Password reset email sent.'})
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
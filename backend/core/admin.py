@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Category, Book, BorrowRecord, Reservation, Fine, Notification
+from .models import User, Category, Book, BorrowRecord, Reservation, Fine, Notification, ScheduledRun
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -70,4 +70,10 @@ class NotificationAdmin(admin.ModelAdmin):
     list_display = ('user', 'title', 'is_read', 'notification_type', 'created_at')
     list_filter = ('is_read', 'notification_type', 'created_at')
     search_fields = ('user__username', 'title')
-    readonly_fields = ('created_at',)
\ No newline at end of file
+    readonly_fields = ('created_at',)
+
+@admin.register(ScheduledRun)
+class ScheduledRunAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'scheduled_for', 'started_at', 'duration_ms', 'missed_runs', 'worker')
+    list_filter = ('name', 'status')
+    readonly_fields = ('name', 'status', 'scheduled_for', 'started_at', 'duration_ms', 'missed_runs', 'worker', 'result', 'error')
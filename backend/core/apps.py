@@ -1,8 +1,21 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def ensure_search_index(sender, using, **kwargs):
+    from django.db import connections
+    from .search import BOOK_TABLE, install_search_index
+    connection = connections[using]
+    if BOOK_TABLE in connection.introspection.table_names():
+        install_search_index(connection)
+
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
     
     def ready(self):
-        import core.signals
\ No newline at end of file
+        import core.signals
+        import core.tasks
+        import core.jobs
+        post_migrate.connect(ensure_search_index, sender=self)
@@ -0,0 +1,272 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+
+GENERATION_KEY = 'books:autocomplete:generation'
+LEADING_ARTICLES = ('the ', 'a ', 'an ')
+KEY_SEPARATOR = '\x00'
+NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+MIN_SIMILARITY = 0.3
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NON_WORD_RE.sub(' ', text.lower()).strip()
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def index_keys(title, author):
+    """Normalized strings a book can be found under by prefix"""
+    keys = set()
+    title = normalize(title)
+    author = normalize(author)
+    if title:
+        keys.add(title)
+        for article in LEADING_ARTICLES:
+            if title.startswith(article):
+                keys.add(title[len(article):])
+    if author:
+        keys.add(author)
+    return keys
+
+
+class AutocompleteIndex:
+    """
+    In-process prefix index over book titles and authors.
+
+    Keys are kept in one sorted list (``"<normalized text>\\0<book id>"``) so a
+    prefix lookup is a bisect plus a short scan. When the prefix finds too few
+    books, each query word is corrected against the indexed vocabulary by
+    trigram similarity and the lookup is retried.
+
+    Every worker holds its own copy. Local saves are applied via signals
+    once their transaction commits; saves in other workers bump a generation
+    counter in the shared cache, which triggers a background rebuild here.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+        self._generation = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._rebuilding = False
+
+    def _reset(self):
+        self._keys = []
+        self._books = {}
+        self._vocabulary = Counter()
+        self._trigram_words = defaultdict(set)
+
+    # Building
+
+    def load(self):
+        """(Re)build the index from the database"""
+        from .models import Book
+
+        cache.add(GENERATION_KEY, 0, timeout=None)
+        generation = cache.get(GENERATION_KEY)
+        books = {}
+        keys = []
+        vocabulary = Counter()
+        for book_id, title, author in Book.objects.values_list('id', 'title', 'author').iterator(chunk_size=10000):
+            books[book_id] = (title, author)
+            for key in index_keys(title, author):
+                keys.append(f'{key}{KEY_SEPARATOR}{book_id}')
+            vocabulary.update(set(normalize(f'{title} {author}').split()))
+        keys.sort()
+
+        trigram_words = defaultdict(set)
+        for word in vocabulary:
+            for trigram in trigrams(word):
+                trigram_words[trigram].add(word)
+
+        with self._lock:
+            self._keys = keys
+            self._books = books
+            self._vocabulary = vocabulary
+            self._trigram_words = trigram_words
+            self._generation = generation
+            self._checked_at = time.monotonic()
+            self._loaded = True
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            from django.db import connection
+            try:
+                self.load()
+            finally:
+                self._rebuilding = False
+                connection.close()
+
+        threading.Thread(target=run, name='autocomplete-rebuild', daemon=True).start()
+
+    def _sync(self):
+        if not self._loaded:
+            self.load()
+            return
+        interval = getattr(settings, 'AUTOCOMPLETE_SYNC_SECONDS', 5)
+        now = time.monotonic()
+        if now - self._checked_at < interval:
+            return
+        self._checked_at = now
+        if cache.get(GENERATION_KEY) != self._generation:
+            self._rebuild_in_background()
+
+    # Incremental maintenance
+
+    def _bump_generation(self):
+        """
+        Tell other workers this index changed. If the counter moved by more
+        than our own bump, another worker's change was missed here too, so
+        the index is marked stale and the next lookup rebuilds it.
+        """
+        try:
+            generation = cache.incr(GENERATION_KEY)
+        except ValueError:
+            generation = 1
+            cache.set(GENERATION_KEY, generation, timeout=None)
+        if self._generation is not None and generation == self._generation + 1:
+            self._generation = generation
+        else:
+            self._generation = None
+            self._checked_at = 0.0
+
+    def _add(self, book_id, title, author):
+        self._books[book_id] = (title, author)
+        for key in index_keys(title, author):
+            bisect.insort(self._keys, f'{key}{KEY_SEPARATOR}{book_id}')
+        for word in set(normalize(f'{title} {author}').split()):
+            if not self._vocabulary[word]:
+                for trigram in trigrams(word):
+                    self._trigram_words[trigram].add(word)
+            self._vocabulary[word] += 1
+
+    def _remove(self, book_id):
+        title, author = self._books.pop(book_id)
+        for key in index_keys(title, author):
+            entry = f'{key}{KEY_SEPARATOR}{book_id}'
+            position = bisect.bisect_left(self._keys, entry)
+            if position < len(self._keys) and self._keys[position] == entry:
+                del self._keys[position]
+        for word in set(normalize(f'{title} {author}').split()):
+            self._vocabulary[word] -= 1
+            if self._vocabulary[word] <= 0:
+                del self._vocabulary[word]
+                for trigram in trigrams(word):
+                    self._trigram_words[trigram].discard(word)
+
+    def update_book(self, book_id, title, author):
+        if not self._loaded:
+            return
+        with self._lock:
+            if self._books.get(book_id) == (title, author):
+                return
+            if book_id in self._books:
+                self._remove(book_id)
+            self._add(book_id, title, author)
+            self._bump_generation()
+
+    def remove_book(self, book_id):
+        if not self._loaded:
+            return
+        with self._lock:
+            if book_id in self._books:
+                self._remove(book_id)
+                self._bump_generation()
+
+    def invalidate(self):
+        """Have every worker rebuild, e.g. after books changed without signals"""
+        with self._lock:
+            self._bump_generation()
+            self._generation = None
+            self._checked_at = 0.0
+
+    # Querying
+
+    def _prefix_ids(self, prefix, limit, exclude=()):
+        ids = []
+        position = bisect.bisect_left(self._keys, prefix)
+        while position < len(self._keys) and len(ids) < limit:
+            key = self._keys[position]
+            if not key.startswith(prefix):
+                break
+            book_id = int(key.rsplit(KEY_SEPARATOR, 1)[1])
+            if book_id not in ids and book_id not in exclude:
+                ids.append(book_id)
+            position += 1
+        return ids
+
+    def _closest_word(self, word):
+        shared = Counter()
+        word_trigrams = trigrams(word)
+        for trigram in word_trigrams:
+            shared.update(self._trigram_words.get(trigram, ()))
+
+        best, best_score = None, MIN_SIMILARITY
+        for candidate, common in shared.items():
+            # A padded word of n characters has n + 1 trigrams (ignoring repeats)
+            score = common / (len(word_trigrams) + len(candidate) + 1 - common)
+            # Ties go to the alphabetically first word so results are stable
+            if score > best_score or (score == best_score and best is not None and candidate < best):
+                best, best_score = candidate, score
+        return best
+
+    def _correct(self, query):
+        words = query.split()
+        corrected = []
+        for word in words:
+            if word in self._vocabulary:
+                corrected.append(word)
+            else:
+                corrected.append(self._closest_word(word) or word)
+        return ' '.join(corrected)
+
+    def search(self, query, limit=10):
+        """Return up to `limit` suggestions for a partially typed title or author"""
+        self._sync()
+        query = normalize(query)
+        if not query:
+            return []
+
+        with self._lock:
+            ids = self._prefix_ids(query, limit)
+            if len(ids) < limit:
+                corrected = self._correct(query)
+                if corrected != query:
+                    ids += self._prefix_ids(corrected, limit - len(ids), exclude=ids)
+
+            results = []
+            for book_id in ids:
+                title, author = self._books[book_id]
+                by_author = (
+                    normalize(author).startswith(query)
+                    and not normalize(title).startswith(query)
+                )
+                results.append({
+                    'id': book_id,
+                    'title': title,
+                    'author': author,
+                    'match': 'author' if by_author else 'title',
+                })
+        return results
+
+
+book_index = AutocompleteIndex()
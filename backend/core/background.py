@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+METRIC_KEY = 'tasks:metrics:{}:{}'
+METRIC_FIELDS = ('runs', 'failures', 'total_ms', 'max_ms', 'last_run_at', 'last_error')
+
+registry = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'TASK_THREAD_WORKERS', 4),
+                thread_name_prefix='lms-task'
+            )
+        return _executor
+
+
+def record_run(name, elapsed_ms, error=None):
+    """Add one run to the task's counters in the shared cache"""
+    def key(field):
+        return METRIC_KEY.format(name, field)
+
+    for field, amount in (('runs', 1), ('failures', 1 if error else 0), ('total_ms', elapsed_ms)):
+        cache.add(key(field), 0, timeout=None)
+        if amount:
+            cache.incr(key(field), amount)
+    if elapsed_ms > (cache.get(key('max_ms')) or 0):
+        cache.set(key('max_ms'), elapsed_ms, timeout=None)
+    cache.set(key('last_run_at'), timezone.now().isoformat(), timeout=None)
+    if error:
+        cache.set(key('last_error'), error, timeout=None)
+
+
+def task_metrics():
+    """Runs, failures and timings of every registered task"""
+    keys = [METRIC_KEY.format(name, field) for name in registry for field in METRIC_FIELDS]
+    values = cache.get_many(keys)
+    metrics = {}
+    for name in sorted(registry):
+        row = {field: values.get(METRIC_KEY.format(name, field)) for field in METRIC_FIELDS}
+        runs = row['runs'] or 0
+        metrics[name] = {
+            'runs': runs,
+            'failures': row['failures'] or 0,
+            'avg_ms': round((row['total_ms'] or 0) / runs, 1) if runs else None,
+            'max_ms': row['max_ms'],
+            'last_run_at': row['last_run_at'],
+            'last_error': row['last_error'],
+        }
+    return metrics
+
+
+class Task:
+    """
+    A function that can run in the background via `.delay()`.
+
+    Where it runs depends on settings.TASK_BACKEND: 'celery' sends it to the
+    Celery workers, 'thread' to an in-process thread pool (development),
+    'immediate' runs it inline (tests). Calling the task directly always
+    runs it inline. Every run is timed into task_metrics().
+    """
+
+    def __init__(self, func, name):
+        self.func = func
+        self.name = name
+        self.__doc__ = func.__doc__
+        self.celery_task = None
+        try:
+            from lms_api.celery import app
+        except ImportError:
+            return
+        self.celery_task = app.task(name=name)(self.run)
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def __repr__(self):
+        return f'<Task {self.name}>'
+
+    def run(self, *args, **kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            return self.func(*args, **kwargs)
+        except Exception as exc:
+            error = f'{type(exc).__name__}: {exc}'
+            raise
+        finally:
+            record_run(self.name, int((time.perf_counter() - started) * 1000), error)
+
+    def _run_in_thread(self, *args, **kwargs):
+        close_old_connections()
+        try:
+            return self.run(*args, **kwargs)
+        except Exception:
+            logger.exception('Background task %s failed', self.name)
+            raise
+        finally:
+            close_old_connections()
+
+    def delay(self, *args, **kwargs):
+        """
+        Queue the task. Returns a Celery AsyncResult, a Future, or the result
+        itself, depending on the backend.
+        """
+        backend = getattr(settings, 'TASK_BACKEND', 'thread')
+        if backend == 'celery' and self.celery_task is not None:
+            return self.celery_task.apply_async(args=args, kwargs=kwargs)
+        if backend == 'immediate':
+            return self.run(*args, **kwargs)
+        return get_executor().submit(self._run_in_thread, *args, **kwargs)
+
+    def delay_on_commit(self, *args, **kwargs):
+        """Queue the task once the current transaction commits, so it sees its writes"""
+        transaction.on_commit(lambda: self.delay(*args, **kwargs))
+
+
+def task(name=None):
+    """Register a function as a background task named `<module>.<function>`"""
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        registry[task_name] = Task(func, task_name)
+        return registry[task_name]
+    return decorator
@@ -0,0 +1,40 @@
+import time
+
+from django.core.cache import cache
+
+LOCK_SUFFIX = ':refreshing'
+
+
+def cached(key, compute, ttl, stale_ttl=None, lock_timeout=30, wait=5.0):
+    """
+    `compute()`'s result, shared through the cache for `ttl` seconds.
+
+    Only one caller at a time recomputes an expired value: the first takes
+    a lock with cache.add() and the others keep serving the previous value
+    for up to `stale_ttl` seconds (10 x `ttl` by default). When there is no
+    previous value at all, they wait up to `wait` seconds for the lock
+    holder's result before computing it themselves.
+    """
+    stale_ttl = stale_ttl or ttl * 10
+    entry = cache.get(key)
+    if entry is not None and entry['fresh_until'] > time.time():
+        return entry['value']
+
+    lock = key + LOCK_SUFFIX
+    if cache.add(lock, 1, timeout=lock_timeout):
+        try:
+            value = compute()
+            cache.set(key, {'value': value, 'fresh_until': time.time() + ttl}, timeout=stale_ttl)
+        finally:
+            cache.delete(lock)
+        return value
+
+    if entry is not None:
+        return entry['value']
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+    return compute()
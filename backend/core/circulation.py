@@ -0,0 +1,350 @@
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, Exists, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .events import publish_availability
+from .models import Book, BorrowRecord, Fine, Reservation, User
+from .notifications import build, notify_many
+from .reservations import leave_queue, return_copies
+
+MAX_ACTIVE_LOANS = 5  # Maximum books a user can borrow
+LOAN_PERIOD_DAYS = 14  # 2 weeks
+FINE_PER_DAY = Decimal('1.00')  # Same rate as BorrowRecord.calculate_fine
+
+MESSAGES = {
+    'not_found': ('Book not found.', 'Book not found.'),
+    'unavailable': ('No copies available for borrowing.', 'No copies available for borrowing.'),
+    'duplicate': ('You have already borrowed this book.', 'This user has already borrowed this book.'),
+    'limit': (
+        f'You can only borrow {MAX_ACTIVE_LOANS} books at a time.',
+        f'User can only borrow {MAX_ACTIVE_LOANS} books at a time.'
+    ),
+    'overdue': (
+        'You have overdue books. Please return them before borrowing new ones.',
+        'User has overdue books. Please return them before borrowing new ones.'
+    ),
+    'record_not_found': ('Borrow record not found.', 'Borrow record not found.'),
+    'returned': ('This book has already been returned.', 'This book has already been returned.'),
+}
+
+
+class CirculationError(Exception):
+    """A checkout or return that the library rules don't allow"""
+
+    def __init__(self, code, on_behalf=False):
+        self.code = code
+        super().__init__(MESSAGES[code][1 if on_behalf else 0])
+
+
+def lock_borrower(borrower):
+    """Serialize a borrower's checkouts; always taken before any Book lock"""
+    list(User.objects.select_for_update().filter(pk=borrower.pk).values_list('pk', flat=True))
+
+
+def default_due_date():
+    return timezone.now().date() + timedelta(days=LOAN_PERIOD_DAYS)
+
+
+def checkout(book_id, borrower, due_date=None, notes='', on_behalf=False):
+    """
+    Lend one copy of a book, in at most four queries:
+
+    1. lock the borrower row and the book row in one SELECT (the borrower
+       through a subquery, so still before the book) and read the borrower's
+       hold or pending reservation on the book,
+    2. take the copy in an UPDATE whose WHERE clause checks every rule (no
+       loan of this book, no overdue loan, under the loan limit, a copy
+       still there) against data read after the locks; it decrements
+       `available_copies` unless the borrower has a copy on hold (see
+       core.reservations),
+    3. insert the BorrowRecord,
+    4. mark the borrower's hold or pending reservation fulfilled, if there
+       was one, closing its place in the queue.
+
+    Statement 1 may have waited on either lock, so what it read can be out
+    of date; when step 2 takes nothing, everything is read again to find
+    out why.
+
+    Raises Book.DoesNotExist for an unknown book and CirculationError when
+    the loan isn't allowed; nothing is written in either case.
+    """
+    today = timezone.now().date()
+    loans = BorrowRecord.objects.filter(borrower=borrower, is_returned=False)
+    active_loans = (
+        loans.order_by().values('borrower_id')
+        .annotate(total=Count('pk')).values('total')[:1]
+    )
+    reservations = Reservation.objects.filter(book=OuterRef('pk'), user=borrower)
+    holds = reservations.filter(status='ready')
+    eligibility = {
+        'active_loans': Coalesce(Subquery(active_loans), Value(0), output_field=IntegerField()),
+        'has_overdue': Exists(loans.filter(due_date__lt=today)),
+        'has_this_book': Exists(loans.filter(book=OuterRef('pk'))),
+    }
+    queue = {
+        'pending_reservation_id': Subquery(reservations.filter(status='pending').values('pk')[:1]),
+        'hold_id': Subquery(holds.values('pk')[:1]),
+    }
+
+    with transaction.atomic():
+        book = Book.objects.select_for_update(of=('self',)).annotate(
+            borrower_lock=Subquery(User.objects.select_for_update().filter(pk=borrower.pk).values('pk')),
+            **queue,
+        ).get(pk=book_id)
+
+        eligible = Book.objects.filter(pk=book.pk).alias(**eligibility).filter(
+            has_this_book=False, has_overdue=False, active_loans__lt=MAX_ACTIVE_LOANS
+        )
+        if book.hold_id:
+            taken = eligible.filter(Exists(holds.filter(pk=book.hold_id))).update(
+                available_copies=F('available_copies')
+            )
+        else:
+            taken = eligible.filter(~Exists(holds), available_copies__gt=0).update(
+                available_copies=F('available_copies') - 1, updated_at=timezone.now()
+            )
+
+        if not taken:
+            # Both rows are locked now, so this read is the final word.
+            book = Book.objects.annotate(**eligibility, **queue).get(pk=book.pk)
+            if book.available_copies <= 0 and not book.hold_id:
+                raise CirculationError('unavailable', on_behalf)
+            if book.has_this_book:
+                raise CirculationError('duplicate', on_behalf)
+            if book.active_loans >= MAX_ACTIVE_LOANS:
+                raise CirculationError('limit', on_behalf)
+            if book.has_overdue:
+                raise CirculationError('overdue', on_behalf)
+            if not book.hold_id:
+                Book.objects.filter(pk=book.pk).update(
+                    available_copies=F('available_copies') - 1, updated_at=timezone.now()
+                )
+
+        if not book.hold_id:
+            book.available_copies -= 1
+            publish_availability({book.pk: book.available_copies})
+
+        borrow_record = BorrowRecord(
+            book=book,
+            borrower=borrower,
+            due_date=due_date or default_due_date(),
+            notes=notes
+        )
+        borrow_record.save()
+
+        if book.hold_id:
+            Reservation.objects.filter(pk=book.hold_id).update(status='fulfilled')
+        elif book.pending_reservation_id:
+            leave_queue(book.pending_reservation_id, book.pk, 'fulfilled')
+
+    return borrow_record
+
+
+def checkout_many(borrower, book_ids, due_date=None):
+    """
+    Lend several books to one borrower at the circulation desk.
+
+    The borrower row is locked and their loans read once, the requested
+    books are locked with a single SELECT ... FOR UPDATE, the records are
+    bulk-inserted and availability drops in one UPDATE (copies on hold for
+    the borrower are handed over instead). Returns one result per requested
+    id, in request order, as dicts with `book`, `status` ('borrowed' or 'failed')
+    and either `borrow_record` or `error`, so one unavailable book doesn't
+    fail the whole batch. An overdue loan refuses the whole batch with
+    CirculationError.
+    """
+    today = timezone.now().date()
+    due_date = due_date or default_due_date()
+    reservations = Reservation.objects.filter(book=OuterRef('pk'), user=borrower)
+    pending_reservation = reservations.filter(status='pending')
+
+    results = []
+    with transaction.atomic():
+        lock_borrower(borrower)
+        active_loans = list(
+            BorrowRecord.objects.filter(borrower=borrower, is_returned=False)
+            .values_list('book_id', 'due_date')
+        )
+        if any(loan_due < today for _, loan_due in active_loans):
+            raise CirculationError('overdue', on_behalf=True)
+        borrowed_book_ids = {book_id for book_id, _ in active_loans}
+        remaining = MAX_ACTIVE_LOANS - len(active_loans)
+
+        books = Book.objects.select_for_update(of=('self',)).annotate(
+            pending_reservation_id=Subquery(pending_reservation.values('pk')[:1]),
+            hold_id=Subquery(reservations.filter(status='ready').values('pk')[:1]),
+        ).in_bulk(set(book_ids))
+
+        accepted = []
+        for book_id in book_ids:
+            book = books.get(book_id)
+            if book is None:
+                code = 'not_found'
+            elif book.pk in borrowed_book_ids:
+                code = 'duplicate'
+            elif book.available_copies <= 0 and not book.hold_id:
+                code = 'unavailable'
+            elif remaining <= 0:
+                code = 'limit'
+            else:
+                code = None
+
+            if code:
+                results.append({'book': book_id, 'status': 'failed', 'error': MESSAGES[code][1]})
+                continue
+
+            borrowed_book_ids.add(book.pk)
+            remaining -= 1
+            if not book.hold_id:
+                book.available_copies -= 1
+            record = BorrowRecord(book=book, borrower=borrower, due_date=due_date)
+            accepted.append(record)
+            results.append({'book': book_id, 'status': 'borrowed', 'borrow_record': record})
+
+        if accepted:
+            BorrowRecord.objects.bulk_create(accepted)
+            taken = [record.book for record in accepted if not record.book.hold_id]
+            if taken:
+                Book.objects.filter(pk__in=[book.pk for book in taken]).update(
+                    available_copies=F('available_copies') - 1, updated_at=timezone.now()
+                )
+            holds = [record.book.hold_id for record in accepted if record.book.hold_id]
+            if holds:
+                Reservation.objects.filter(pk__in=holds).update(status='fulfilled')
+            for book in taken:
+                if book.pending_reservation_id:
+                    leave_queue(book.pending_reservation_id, book.pk, 'fulfilled')
+
+            publish_availability({book.pk: book.available_copies for book in taken})
+
+    return results
+
+
+def overdue_fine(due_date, today):
+    """Fine owed on a loan due on `due_date` if it were settled `today`"""
+    if due_date >= today:
+        return Decimal('0.00')
+    return (today - due_date).days * FINE_PER_DAY
+
+
+def return_many(record_ids):
+    """
+    Check in several borrow records at once, with the same fines as
+    BorrowRecord.calculate_fine() but set-based:
+
+    1. lock the records,
+    2. read the existing Fine rows for the overdue ones,
+    3. upsert those fines in one INSERT ... ON CONFLICT (a paid fine stays
+       paid unless its amount changed),
+    4. mark every record returned with its fine in one UPDATE,
+    5. lock the books, hold returned copies for the heads of their
+       reservation queues, and put the rest back with one UPDATE per
+       distinct number of copies (usually just one); see
+       core.reservations.return_copies(),
+    6. notify the borrowers who were fined.
+
+    Returns one result per requested id, in request order, as dicts with
+    `borrow_record` (the id), `status` ('returned' or 'failed') and either
+    `record` (the updated instance) or `error`.
+    """
+    today = timezone.now().date()
+    now = timezone.now()
+
+    with transaction.atomic():
+        records = BorrowRecord.objects.select_for_update(of=('self',)).select_related(
+            'book', 'borrower'
+        ).in_bulk(set(record_ids))
+
+        results = []
+        returning = {}
+        for record_id in record_ids:
+            record = records.get(record_id)
+            if record is None:
+                code = 'record_not_found'
+            elif record.is_returned or record_id in returning:
+                code = 'returned'
+            else:
+                code = None
+
+            if code:
+                results.append({'borrow_record': record_id, 'status': 'failed', 'error': MESSAGES[code][1]})
+                continue
+            returning[record_id] = record
+            results.append({'borrow_record': record_id, 'status': 'returned', 'record': record})
+
+        if not returning:
+            return results
+
+        fined = [
+            record for record in returning.values()
+            if overdue_fine(record.due_date, today)
+        ]
+        if fined:
+            existing = {
+                fine['borrow_record_id']: fine
+                for fine in Fine.objects.filter(borrow_record__in=fined).values(
+                    'borrow_record_id', 'amount', 'is_paid'
+                )
+            }
+            fines = []
+            for record in fined:
+                amount = overdue_fine(record.due_date, today)
+                previous = existing.get(record.pk)
+                fines.append(Fine(
+                    user_id=record.borrower_id,
+                    borrow_record=record,
+                    amount=amount,
+                    # Reset paid status only if the amount changed
+                    is_paid=bool(previous and previous['is_paid'] and previous['amount'] == amount),
+                ))
+            Fine.objects.bulk_create(
+                fines,
+                update_conflicts=True,
+                unique_fields=['borrow_record'],
+                update_fields=['amount', 'is_paid', 'updated_at'],
+            )
+
+        # Fines only depend on the due date, so branch on that rather than the id
+        due_dates = {record.due_date for record in fined}
+        BorrowRecord.objects.filter(pk__in=returning).update(
+            is_returned=True,
+            return_date=today,
+            fine_amount=Case(
+                *[When(due_date=due_date, then=Value(overdue_fine(due_date, today))) for due_date in due_dates],
+                default=F('fine_amount'),
+                output_field=DecimalField(max_digits=8, decimal_places=2),
+            ),
+            updated_at=now,
+        )
+
+        copies = Counter(record.book_id for record in returning.values())
+        held = return_copies(copies, now)
+
+        if fined:
+            notify_many([
+                build(
+                    record.borrower_id, 'overdue_fine', record.pk,
+                    amount=f"{overdue_fine(record.due_date, today):.2f}", book=record.book.title
+                )
+                for record in fined
+            ])
+
+    for record in returning.values():
+        if record.due_date < today:
+            record.fine_amount = overdue_fine(record.due_date, today)
+        record.is_returned = True
+        record.return_date = today
+        record.updated_at = now
+        record.book.available_copies = min(
+            record.book.available_copies + copies[record.book_id] - held[record.book_id],
+            record.book.total_copies
+        )
+    # Book rows aren't locked here, so a concurrent checkout may already have
+    # moved these figures; its own event follows this one
+    publish_availability({record.book_id: record.book.available_copies for record in returning.values()})
+    return results
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+BOOKS_CHANNEL = 'books'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class InProcessBroker:
+    """
+    Pub/sub within one process. Publishers may run in any thread (sync views,
+    signals); every subscriber is an asyncio queue drained by its stream.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, event):
+        message = json.dumps(event)
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    async def subscribe(self, channels):
+        """Yield every message published to `channels`, as JSON strings"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscriber)
+        try:
+            while True:
+                yield await subscriber[1].get()
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(subscriber)
+
+
+class RedisBroker:
+    """Pub/sub over Redis, so events reach streams held by any worker"""
+
+    def __init__(self, url):
+        import redis
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+
+    def publish(self, channel, event):
+        self._client.publish(channel, json.dumps(event))
+
+    async def subscribe(self, channels):
+        from redis import asyncio as aioredis
+        client = aioredis.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*channels)
+        try:
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    yield message['data'].decode('utf-8')
+        finally:
+            await pubsub.unsubscribe(*channels)
+            await pubsub.close()
+            await client.close()
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        url = getattr(settings, 'EVENTS_BROKER_URL', '')
+        _broker = RedisBroker(url) if url else InProcessBroker()
+    return _broker
+
+
+def publish(channel, event):
+    """Send an event once the current transaction commits (now, outside one)"""
+    transaction.on_commit(lambda: get_broker().publish(channel, event))
+
+
+def publish_notification(notification):
+    from .notifications import render
+    title, message = render(notification)
+    publish(user_channel(notification.user_id), {
+        'type': 'notification',
+        'id': notification.pk,
+        'kind': notification.kind,
+        'subject': notification.subject,
+        'title': title,
+        'message': message,
+        'notification_type': notification.notification_type,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+    })
+
+
+def publish_availability(copies):
+    """Broadcast {book_id: available_copies} to every stream"""
+    if copies:
+        publish(BOOKS_CHANNEL, {
+            'type': 'availability',
+            'books': [{'id': book_id, 'available_copies': count} for book_id, count in copies.items()],
+        })
+
+
+async def sse_messages(channels, heartbeat=15):
+    """
+    Server-Sent Events for everything published to `channels`, with a
+    comment line every `heartbeat` seconds so proxies keep the stream open.
+    """
+    messages = get_broker().subscribe(channels)
+    queue = asyncio.Queue()
+
+    async def pump():
+        async for message in messages:
+            await queue.put(message)
+
+    task = asyncio.create_task(pump())
+    # Let the subscription register before the client is told it is connected
+    await asyncio.sleep(0)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield f"event: {json.loads(message)['type']}\ndata: {message}\n\n"
+    finally:
+        task.cancel()
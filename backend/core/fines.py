@@ -0,0 +1,251 @@
+import time
+
+from django.db import NotSupportedError, transaction
+from django.db.models import DecimalField, Func, IntegerField, Q, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .circulation import FINE_PER_DAY
+from .models import BorrowRecord, Fine, FineAccrualState
+from .notifications import build, notify_many
+
+CHUNK_SIZE = 2000
+
+
+class DaysOverdue(Func):
+    """Whole days between a date column and `today`, computed by the database"""
+    output_field = IntegerField()
+    templates = {
+        'sqlite': 'CAST(julianday({today}) - julianday({due}) AS INTEGER)',
+        'postgresql': '({today}::date - {due})',
+        'mysql': 'DATEDIFF({today}, {due})',
+    }
+
+    def __init__(self, expression, today, **extra):
+        super().__init__(expression, Value(today), **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        template = self.templates.get(connection.vendor)
+        if template is None:
+            raise NotSupportedError(f'DaysOverdue is not implemented for {connection.vendor}')
+        due_date, today = self.get_source_expressions()
+        due_sql, due_params = compiler.compile(due_date)
+        today_sql, today_params = compiler.compile(today)
+        return template.format(today=today_sql, due=due_sql), (*today_params, *due_params)
+
+
+def fine_expression(today):
+    """SQL for the fine BorrowRecord.calculate_fine() charges as of `today`"""
+    return Cast(
+        DaysOverdue('due_date', today) * Value(FINE_PER_DAY),
+        DecimalField(max_digits=8, decimal_places=2)
+    )
+
+
+FINE_COLUMNS = (
+    'pk', 'borrower_id', 'fine_amount', 'book__title',
+    'fine_record__amount', 'fine_record__is_paid'
+)
+
+
+def new_stats():
+    return {
+        'overdue_records': 0,
+        'records_updated': 0,
+        'fines_created': 0,
+        'fines_updated': 0,
+        'notifications': 0,
+    }
+
+
+def upsert_fines(rows, stats, timings):
+    """
+    Upsert Fine rows and notify borrowers for one chunk of `FINE_COLUMNS`
+    rows whose `fine_amount` is already current. A Fine is written only when
+    it is new or its amount changed, and is then unpaid again, as in
+    BorrowRecord.calculate_fine().
+    """
+    step = time.perf_counter()
+    fines = []
+    notifications = []
+    for record_id, borrower_id, fine_amount, book_title, previous_amount, previous_paid in rows:
+        if previous_amount is None:
+            stats['fines_created'] += 1
+        elif previous_amount != fine_amount:
+            stats['fines_updated'] += 1
+        else:
+            continue
+        fines.append(Fine(
+            user_id=borrower_id,
+            borrow_record_id=record_id,
+            amount=fine_amount,
+            is_paid=False,
+        ))
+        notifications.append(build(
+            borrower_id, 'overdue_fine', record_id, amount=f"{fine_amount:.2f}", book=book_title
+        ))
+
+    Fine.objects.bulk_create(
+        fines,
+        update_conflicts=True,
+        unique_fields=['borrow_record'],
+        update_fields=['amount', 'is_paid', 'updated_at'],
+    )
+    timings['upsert_fines'] += time.perf_counter() - step
+
+    step = time.perf_counter()
+    notify_many(notifications)
+    stats['notifications'] += len(notifications)
+    timings['notify'] += time.perf_counter() - step
+
+
+def id_chunks(queryset, chunk_size, after=0):
+    """Ids from `queryset` in ascending chunks of `chunk_size`, starting after `after`"""
+    while True:
+        ids = list(queryset.filter(pk__gt=after).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        after = ids[-1]
+
+
+def reprice_chunk(ids, amount, now, stats, timings):
+    """Set `fine_amount` on one chunk of records; returns the chunk's queryset"""
+    step = time.perf_counter()
+    chunk = BorrowRecord.objects.filter(pk__in=ids)
+    stats['records_updated'] += chunk.filter(~Q(fine_amount=amount)).update(fine_amount=amount, updated_at=now)
+    timings['update_records'] += time.perf_counter() - step
+    return chunk
+
+
+def finish(stats, timings, started):
+    timings['total'] = time.perf_counter() - started
+    stats['timings'] = {name: round(seconds, 3) for name, seconds in timings.items()}
+    return stats
+
+
+def apply_overdue_fines(today=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Bring fines on every unreturned overdue loan up to date, set-based.
+
+    Gives the same BorrowRecord.fine_amount and Fine rows as calling
+    calculate_fine() on each record (a paid fine is reopened only when its
+    amount changed), but per chunk of records with one UPDATE, one read and
+    one bulk upsert, and notifications only for fines that were created or
+    changed. Each chunk commits on its own; a run that stops part way is
+    completed by running it again. `progress`, if given, is called with the
+    counts so far before the first chunk and after every chunk, so a job's
+    heartbeat never waits on more than one chunk. Returns counts and timings.
+    """
+    today = today or timezone.now().date()
+    started = time.perf_counter()
+    stats = new_stats()
+    timings = {'update_records': 0.0, 'upsert_fines': 0.0, 'notify': 0.0}
+
+    overdue = BorrowRecord.objects.filter(is_returned=False, due_date__lt=today)
+    amount = fine_expression(today)
+    now = timezone.now()
+    total = overdue.count() if progress else None
+    if progress:
+        progress({**stats, 'total': total})
+
+    for ids in id_chunks(overdue, chunk_size):
+        with transaction.atomic():
+            rows = list(reprice_chunk(ids, amount, now, stats, timings).order_by('pk').values_list(*FINE_COLUMNS))
+            stats['overdue_records'] += len(rows)
+            upsert_fines(rows, stats, timings)
+        if progress:
+            progress({**stats, 'total': total})
+
+    return finish(stats, timings, started)
+
+
+def accrue_fines(today=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Incremental version of apply_overdue_fines() driven by FineAccrualState.
+
+    With fines current through the watermark W, a run up to T only:
+
+    1. re-prices loans that were already overdue before W and their
+       existing Fine rows, per chunk with one UPDATE of the records and one
+       read and upsert of their fines (see upsert_fines), which also brings
+       each borrower's overdue_fine notification up to the new amount,
+    2. fines the loans that fell due in [W, T), in chunks, each committed
+       together with a checkpoint so a crashed run resumes where it stopped.
+
+    The first run, with no watermark yet, is a full apply_overdue_fines().
+    `progress` is called as there, before the first and after every
+    committed chunk.
+    An interrupted run is always finished (up to its own target date)
+    before a new one starts. Loans that went overdue before W without ever
+    getting a Fine, e.g. because their due date was edited back, are left
+    to a full run.
+    """
+    today = today or timezone.now().date()
+    started = time.perf_counter()
+    state = FineAccrualState.load()
+
+    if state.accrued_through is None and state.target_date is None:
+        stats = apply_overdue_fines(today, chunk_size, progress)
+        state.accrued_through = today
+        state.save()
+        stats['mode'] = 'full'
+        return stats
+
+    stats = new_stats()
+    stats['mode'] = 'incremental'
+    stats['resumed'] = state.target_date is not None
+    timings = {'update_records': 0.0, 'upsert_fines': 0.0, 'notify': 0.0}
+
+    while state.target_date is not None or state.accrued_through < today:
+        if state.target_date is None:
+            state.target_date = today
+            state.existing_accrued = False
+            state.checkpoint = 0
+            state.save()
+        accrue_step(state, chunk_size, stats, timings, progress)
+
+    return finish(stats, timings, started)
+
+
+def accrue_step(state, chunk_size, stats, timings, progress=None):
+    """Carry fines from `state.accrued_through` to `state.target_date`"""
+    watermark, target = state.accrued_through, state.target_date
+    amount = fine_expression(target)
+    now = timezone.now()
+
+    if progress:
+        progress(dict(stats))
+
+    if not state.existing_accrued:
+        accruing = BorrowRecord.objects.filter(is_returned=False, due_date__lt=watermark)
+        # Repricing is idempotent, so a run interrupted here simply goes over these chunks again
+        for ids in id_chunks(accruing, chunk_size):
+            with transaction.atomic():
+                chunk = reprice_chunk(ids, amount, now, stats, timings)
+                rows = list(chunk.filter(fine_record__isnull=False).order_by('pk').values_list(*FINE_COLUMNS))
+                upsert_fines(rows, stats, timings)
+            if progress:
+                progress(dict(stats))
+        state.existing_accrued = True
+        state.save()
+
+    newly_overdue = BorrowRecord.objects.filter(
+        is_returned=False, due_date__gte=watermark, due_date__lt=target
+    )
+    for ids in id_chunks(newly_overdue, chunk_size, after=state.checkpoint):
+        with transaction.atomic():
+            rows = list(reprice_chunk(ids, amount, now, stats, timings).order_by('pk').values_list(*FINE_COLUMNS))
+            stats['overdue_records'] += len(rows)
+            upsert_fines(rows, stats, timings)
+
+            state.checkpoint = ids[-1]
+            state.save()
+        if progress:
+            progress(dict(stats))
+
+    state.accrued_through = target
+    state.target_date = None
+    state.existing_accrued = False
+    state.checkpoint = 0
+    state.save()
@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .background import task
+from .models import Job
+
+# A queued or running job whose heartbeat is older than this is presumed dead
+STALE_AFTER = timedelta(minutes=15)
+
+handlers = {}
+
+
+class JobAlreadyActive(Exception):
+    def __init__(self, job):
+        self.job = job
+        super().__init__(f'A {job.kind} job is already {job.status}.')
+
+
+def job_handler(kind):
+    """Register `func(job, progress)` as the code a job of `kind` runs"""
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+
+def expire_stale_jobs(kind, key=''):
+    return Job.objects.filter(
+        kind=kind,
+        key=key,
+        status__in=Job.ACTIVE_STATUSES,
+        heartbeat_at__lt=timezone.now() - STALE_AFTER
+    ).update(status='failed', error='Stopped responding', finished_at=timezone.now())
+
+
+def submit_job(kind, user=None, params=None, inline=False, key=''):
+    """
+    Create a queued job and hand it to the background workers once the
+    transaction commits, or run it here and now with `inline`. Raises
+    JobAlreadyActive if one of the same kind and `key` is still queued or
+    running, enforced by a partial unique index so it holds across workers.
+    """
+    if kind not in handlers:
+        raise ValueError(f'Unknown job kind: {kind}')
+    with transaction.atomic():
+        expire_stale_jobs(kind, key)
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(kind=kind, key=key, created_by=user, params=params or {})
+        except IntegrityError:
+            active = Job.objects.filter(kind=kind, key=key, status__in=Job.ACTIVE_STATUSES).first()
+            if active is None:
+                raise
+            raise JobAlreadyActive(active)
+        if not inline:
+            run_job.delay_on_commit(job.pk)
+    if inline:
+        run_job(job.pk)
+        job.refresh_from_db()
+    return job
+
+
+def report_progress(job_id, counts):
+    Job.objects.filter(pk=job_id).update(progress=counts, heartbeat_at=timezone.now())
+
+
+@task()
+def run_job(job_id):
+    claimed = Job.objects.filter(pk=job_id, status='queued').update(
+        status='running', started_at=timezone.now(), heartbeat_at=timezone.now()
+    )
+    if not claimed:
+        return None
+    job = Job.objects.get(pk=job_id)
+
+    try:
+        result = handlers[job.kind](job, lambda counts: report_progress(job.pk, counts))
+    except Exception as exc:
+        Job.objects.filter(pk=job.pk).update(
+            status='failed', error=f'{type(exc).__name__}: {exc}', finished_at=timezone.now()
+        )
+        raise
+    Job.objects.filter(pk=job.pk).update(
+        status='succeeded', result=result, finished_at=timezone.now(), heartbeat_at=timezone.now()
+    )
+    return result
+
+
+@job_handler('overdue_fines')
+def overdue_fines_job(job, progress):
+    from .fines import accrue_fines, apply_overdue_fines
+    run = accrue_fines if job.params.get('incremental') else apply_overdue_fines
+    options = {'chunk_size': job.params['chunk_size']} if job.params.get('chunk_size') else {}
+    return run(progress=progress, **options)
@@ -0,0 +1,115 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 60  # 1, 2, 4, 8, 16 minutes between attempts
+RETRY_MAX_SECONDS = 3600
+CLAIM_TIMEOUT = timedelta(minutes=10)  # A claimed batch not finished by then is sent again
+
+
+def queue_mail(subject, body, recipients, from_email=None):
+    """Put an email in the outbox; the request never talks to the mail server"""
+    recipients = [address for address in recipients if address]
+    if not recipients:
+        return None
+    email = OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=recipients,
+    )
+    # Send promptly in the background; the mailer loop picks up retries
+    from .tasks import send_queued_mail
+    send_queued_mail.delay_on_commit()
+    return email
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def claim_batch(batch_size, now):
+    """
+    Claim up to `batch_size` due emails for this sender: pending ones, and
+    ones whose sender stopped before finishing. The claim is a conditional
+    UPDATE that only matches rows still due, committed before anything is
+    sent, so two senders never get the same row even without SKIP LOCKED.
+    """
+    token = uuid.uuid4().hex
+    due = Q(status='pending') | Q(status='sending')
+    candidates = list(
+        OutboundEmail.objects.filter(due, next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'pk').values_list('pk', flat=True)[:batch_size]
+    )
+    if not candidates:
+        return []
+    OutboundEmail.objects.filter(due, pk__in=candidates, next_attempt_at__lte=now).update(
+        status='sending', claim=token, next_attempt_at=now + CLAIM_TIMEOUT
+    )
+    return list(
+        OutboundEmail.objects.filter(pk__in=candidates, claim=token, status='sending').order_by('pk')
+    )
+
+
+def deliver_outbox(batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+    """
+    Send one batch of due outbox emails over a single mail server connection.
+
+    The batch is claimed first (see claim_batch()) and sent outside any
+    transaction, recording each message's outcome as soon as it is known.
+    A message that fails is retried with exponential backoff and marked
+    failed after `max_attempts`; if the connection can't be opened at all,
+    the whole batch is rescheduled. Returns counts.
+    """
+    now = timezone.now()
+    stats = {'sent': 0, 'retrying': 0, 'failed': 0}
+    emails = claim_batch(batch_size, now)
+    if not emails:
+        return stats
+
+    def record_failure(email, error):
+        attempts = email.attempts + 1
+        if attempts >= max_attempts:
+            outcome = {'status': 'failed'}
+            stats['failed'] += 1
+        else:
+            outcome = {'status': 'pending', 'next_attempt_at': now + retry_delay(attempts)}
+            stats['retrying'] += 1
+        OutboundEmail.objects.filter(pk=email.pk, claim=email.claim).update(
+            attempts=attempts, last_error=error, claim='', **outcome
+        )
+
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+    except Exception as exc:
+        for email in emails:
+            record_failure(email, f'Could not connect: {exc}')
+        return stats
+
+    try:
+        for email in emails:
+            message = EmailMessage(
+                email.subject, email.body, email.from_email, email.recipients,
+                connection=mail_connection
+            )
+            try:
+                message.send()
+            except Exception as exc:
+                record_failure(email, str(exc))
+            else:
+                OutboundEmail.objects.filter(pk=email.pk, claim=email.claim).update(
+                    status='sent', sent_at=timezone.now(), last_error='', claim=''
+                )
+                stats['sent'] += 1
+    finally:
+        mail_connection.close()
+    return stats
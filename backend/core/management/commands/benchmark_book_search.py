@@ -0,0 +1,98 @@
+import random
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework import filters
+from rest_framework.request import Request
+
+from core.autocomplete import book_index
+from core.models import Book
+from core.search import BookSearchFilter
+
+BENCHMARK_PUBLISHER = 'LMS Benchmark Press'
+
+WORDS = (
+    'history', 'science', 'garden', 'shadow', 'river', 'empire', 'python', 'winter',
+    'ocean', 'machine', 'silent', 'kingdom', 'secret', 'journey', 'digital', 'mountain',
+    'midnight', 'crystal', 'theory', 'forest', 'engine', 'harbor', 'legacy', 'signal',
+)
+FIRST_NAMES = ('Anna', 'Ravi', 'Maria', 'John', 'Priya', 'Chen', 'Lucas', 'Sara', 'Omar', 'Elena')
+LAST_NAMES = ('Sharma', 'Smith', 'Garcia', 'Kumar', 'Nguyen', 'Rossi', 'Okafor', 'Novak', 'Silva', 'Ivanova')
+GENRES = [choice[0] for choice in Book.GENRE_CHOICES]
+
+
+class BenchmarkView:
+    search_fields = ['title', 'author', 'isbn', 'publisher']
+
+
+class Command(BaseCommand):
+    help = 'Compare the full-text book search against the icontains SearchFilter on a generated catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1_000_000, help='Size of the generated catalog')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query and backend')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated books afterwards')
+
+    def handle(self, *args, **options):
+        existing = Book.objects.filter(publisher=BENCHMARK_PUBLISHER).count()
+        if existing < options['books']:
+            self.generate(options['books'] - existing, existing, options['batch_size'])
+
+        queries = ['river', 'sec', 'Kumar', 'digital empire', 'midnight garden shadow', '9780000012']
+        backends = [('SearchFilter', filters.SearchFilter()), ('BookSearchFilter', BookSearchFilter())]
+        factory = RequestFactory()
+        view = BenchmarkView()
+
+        self.stdout.write(f"{'query':<26}{'backend':<18}{'hits':>8}{'avg ms':>10}{'min ms':>10}")
+        for term in queries:
+            request = Request(factory.get('/api/books/', {'search': term}))
+            for name, backend in backends:
+                timings = []
+                hits = 0
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    queryset = backend.filter_queryset(request, Book.objects.all(), view)
+                    # Fetch a first page the way the list endpoint does
+                    hits = queryset.count()
+                    list(queryset[:20])
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f"{term:<26}{name:<18}{hits:>8}"
+                    f"{sum(timings) / len(timings):>10.1f}{min(timings):>10.1f}"
+                )
+
+        if not options['keep']:
+            # A plain DELETE: the ORM would send post_delete and queue an
+            # on_commit callback per book. Generated books have no loans or
+            # reservations to cascade to.
+            generated = Book.objects.filter(publisher=BENCHMARK_PUBLISHER)
+            deleted = generated._raw_delete(generated.db)
+            book_index.invalidate()
+            self.stdout.write(f"Removed {deleted} generated books")
+
+    def generate(self, count, offset, batch_size):
+        self.stdout.write(f"Generating {count} books...")
+        rng = random.Random(offset)
+        started = time.perf_counter()
+        batch = []
+        for number in range(offset, offset + count):
+            batch.append(Book(
+                title=' '.join(rng.sample(WORDS, rng.randint(2, 4))).title(),
+                author=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                isbn=f"978{number:010d}",
+                genre=rng.choice(GENRES),
+                publication_date=date(rng.randint(1950, 2024), rng.randint(1, 12), 1),
+                publisher=BENCHMARK_PUBLISHER,
+                total_copies=1,
+                available_copies=1,
+            ))
+            if len(batch) >= batch_size:
+                Book.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Book.objects.bulk_create(batch)
+        book_index.invalidate()  # bulk_create sends no post_save
+        self.stdout.write(f"Generated {count} books in {time.perf_counter() - started:.1f}s")
@@ -1,32 +1,46 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from core.models import BorrowRecord, Fine
-from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from core.fines import CHUNK_SIZE
+from core.jobs import JobAlreadyActive, submit_job
 
 class Command(BaseCommand):
     help = 'Check for overdue books and impose fines'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Overdue records read and upserted per batch')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only accrue fines changed since the last run (resumes an interrupted run)')
+
     def handle(self, *args, **options):
-        # Find all overdue books that aren't returned
-        overdue_records = BorrowRecord.objects.filter(
-            is_returned=False,
-            due_date__lt=timezone.now().date()
+        # Runs as an overdue_fines job, so it never overlaps one started from the API
+        try:
+            job = submit_job(
+                'overdue_fines',
+                params={'incremental': options['incremental'], 'chunk_size': options['chunk_size']},
+                inline=True,
+            )
+        except JobAlreadyActive as e:
+            raise CommandError(f'{e} (job {e.job.pk}); not starting another run.')
+        stats = job.result
+        if options['incremental']:
+            self.stdout.write(f"Accrual mode: {stats['mode']}{' (resumed)' if stats.get('resumed') else ''}")
+        timings = stats['timings']
+
+        self.stdout.write(f"Checked {stats['overdue_records']} overdue records")
+        self.stdout.write(
+            f"Records updated: {stats['records_updated']}, "
+            f"fines created: {stats['fines_created']}, "
+            f"fines updated: {stats['fines_updated']}, "
+            f"notifications: {stats['notifications']}"
+        )
+        self.stdout.write(
+            f"Timings: update {timings['update_records']:.3f}s, "
+            f"fines {timings['upsert_fines']:.3f}s, "
+            f"notifications {timings['notify']:.3f}s, "
+            f"total {timings['total']:.3f}s"
         )
-        
-        self.stdout.write(f"Checking {overdue_records.count()} overdue records...")
-        
-        fines_imposed = 0
-        for record in overdue_records:
-            fine_amount = record.calculate_fine()
-            if fine_amount > 0:
-                fines_imposed += 1
-                self.stdout.write(
-                    f"Imposed ${fine_amount} fine on {record.borrower.username} "
-                    f"for '{record.book.title}' ({record.due_date})"
-                )
-        
         self.stdout.write(
             self.style.SUCCESS(
-                f"Successfully imposed fines on {fines_imposed} overdue records"
+                f"Successfully imposed fines on {stats['overdue_records']} overdue records"
             )
-        )
\ No newline at end of file
+        )
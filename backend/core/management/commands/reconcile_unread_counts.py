@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from core.notifications import reconcile_unread_counts
+
+class Command(BaseCommand):
+    help = 'Rewrite the cached unread-notification counters from the database'
+
+    def handle(self, *args, **options):
+        users = reconcile_unread_counts()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled unread counts for {users} users"))
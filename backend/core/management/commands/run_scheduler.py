@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from core.scheduler import SCHEDULE, run_pending
+
+class Command(BaseCommand):
+    help = 'Run the periodic maintenance jobs in core.scheduler as they come due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run whatever is due now, then exit')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between checks')
+
+    def handle(self, *args, **options):
+        for entry in SCHEDULE:
+            self.stdout.write(f"{entry.name}: {entry.cron.expression}")
+        while True:
+            close_old_connections()
+            for run in run_pending():
+                missed = f", {run.missed_runs} missed" if run.missed_runs else ''
+                self.stdout.write(f"{run.name} {run.status} in {run.duration_ms}ms{missed}")
+                if run.error:
+                    self.stderr.write(f"{run.name}: {run.error}")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core.mail import BATCH_SIZE, deliver_outbox
+
+class Command(BaseCommand):
+    help = 'Deliver queued outbox emails in batches over one mail server connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling the outbox')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            # Drain everything that is due before sleeping
+            while True:
+                stats = deliver_outbox(batch_size=options['batch_size'])
+                if any(stats.values()):
+                    self.stdout.write(
+                        f"Sent {stats['sent']}, retrying {stats['retrying']}, failed {stats['failed']}"
+                    )
+                if stats['sent'] + stats['retrying'] + stats['failed'] < options['batch_size'] or not stats['sent']:
+                    break
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_book_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FineAccrualState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('accrued_through', models.DateField(blank=True, null=True)),
+                ('target_date', models.DateField(blank=True, null=True)),
+                ('existing_accrued', models.BooleanField(default=False)),
+                ('checkpoint', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_fine_accrual_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='kind',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='params',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='subject',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='message',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='title',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(fields=('user', 'kind', 'subject'), name='unique_notification_subject'),
+        ),
+    ]
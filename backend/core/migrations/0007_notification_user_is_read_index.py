@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_notification_templates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read'], name='core_notifi_user_id_cb8f07_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_scheduler'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='reservation',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('book', 'user'), name='unique_pending_reservation'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+def number_queues(apps, schema_editor):
+    """Queue existing pending reservations in the order they were made"""
+    Reservation = apps.get_model('core', 'Reservation')
+    pending = Reservation.objects.filter(status='pending').order_by('book_id', 'reservation_date', 'pk')
+    queued = []
+    book_id, position = None, 0
+    for reservation in pending.only('pk', 'book_id').iterator():
+        position = position + 1 if reservation.book_id == book_id else 1
+        book_id = reservation.book_id
+        reservation.position = position
+        queued.append(reservation)
+    Reservation.objects.bulk_update(queued, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_reservation_pending_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='position',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready for pickup'), ('fulfilled', 'Fulfilled'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['book', 'status', 'position'], name='core_reserv_book_id_6d5aad_idx'),
+        ),
+        migrations.RunPython(number_queues, migrations.RunPython.noop),
+    ]
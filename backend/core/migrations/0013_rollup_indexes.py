@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_reservation_queue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['borrow_date'], name='core_borrow_borrow__438bd5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['return_date'], name='core_borrow_return__ed5aa1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(fields=['paid_date'], name='core_fine_paid_da_92a794_idx'),
+        ),
+    ]
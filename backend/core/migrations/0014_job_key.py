@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_rollup_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='job',
+            name='one_active_job_per_kind',
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['kind', 'key', 'status'], name='core_job_kind_23e966_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('kind', 'key'), name='one_active_job_per_kind_and_key'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:12
+
+from django.db import migrations, models
+
+
+def cancel_duplicate_holds(apps, schema_editor):
+    """Cancel pending reservations whose user already holds a copy of the book, closing their places"""
+    Reservation = apps.get_model('core', 'Reservation')
+    held = set(Reservation.objects.filter(status='ready').values_list('book_id', 'user_id'))
+    duplicates = [
+        reservation.pk for reservation in Reservation.objects.filter(status='pending').only('book_id', 'user_id')
+        if (reservation.book_id, reservation.user_id) in held
+    ]
+    if not duplicates:
+        return
+    books = set(Reservation.objects.filter(pk__in=duplicates).values_list('book_id', flat=True))
+    Reservation.objects.filter(pk__in=duplicates).update(status='cancelled', position=None)
+    queued = []
+    for book_id in books:
+        pending = Reservation.objects.filter(book_id=book_id, status='pending').order_by('position', 'pk')
+        for position, reservation in enumerate(pending.only('pk'), start=1):
+            reservation.position = position
+            queued.append(reservation)
+    Reservation.objects.bulk_update(queued, ['position'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_outbox_claim'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_holds, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='reservation',
+            name='unique_pending_reservation',
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'ready'])), fields=('book', 'user'), name='unique_active_reservation'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_reservation_active_constraint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['updated_at'], name='core_book_updated_9cef49_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['updated_at'], name='core_borrow_updated_23d1af_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(fields=['updated_at'], name='core_fine_updated_b3f4a1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['updated_at'], name='core_user_updated_4c12a0_idx'),
+        ),
+    ]
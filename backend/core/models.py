@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinLengthValidator, MinValueValidator
 from django.utils import timezone
@@ -24,6 +24,7 @@ class User(AbstractUser):
             models.Index(fields=['user_type']),
             models.Index(fields=['username']),
             models.Index(fields=['email']),
+            models.Index(fields=['updated_at']),  # Report fingerprints (reports.jobs)
         ]
     
     def __str__(self):
@@ -82,6 +83,7 @@ class Book(models.Model):
             models.Index(fields=['author']),
             models.Index(fields=['isbn']),
             models.Index(fields=['genre']),
+            models.Index(fields=['updated_at']),  # Report fingerprints (reports.jobs)
         ]
     
     def __str__(self):
@@ -114,6 +116,10 @@ class BorrowRecord(models.Model):
             models.Index(fields=['borrower', 'is_returned']),
             models.Index(fields=['due_date']),
             models.Index(fields=['is_returned']),
+            # Day-by-day rollups (reports.rollup)
+            models.Index(fields=['borrow_date']),
+            models.Index(fields=['return_date']),
+            models.Index(fields=['updated_at']),  # Report fingerprints (reports.jobs)
         ]
     
     def __str__(self):
@@ -162,21 +168,32 @@ class Reservation(models.Model):
     reservation_date = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=10, choices=(
         ('pending', 'Pending'),
+        ('ready', 'Ready for pickup'),
         ('fulfilled', 'Fulfilled'),
         ('cancelled', 'Cancelled'),
         ('expired', 'Expired')
     ), default='pending')
+    # 1-based place in the book's queue while pending, kept dense (see core.reservations)
+    position = models.PositiveIntegerField(null=True, blank=True)
     expiry_date = models.DateTimeField()
     notification_sent = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        unique_together = ['book', 'user', 'status']
         ordering = ['-reservation_date']
+        constraints = [
+            # Past reservations may repeat; only one can be pending or ready at a time
+            models.UniqueConstraint(
+                fields=['book', 'user'],
+                condition=models.Q(status__in=['pending', 'ready']),
+                name='unique_active_reservation'
+            ),
+        ]
         indexes = [
             models.Index(fields=['user', 'status']),
             models.Index(fields=['status']),
             models.Index(fields=['expiry_date']),
+            models.Index(fields=['book', 'status', 'position']),
         ]
     
     def __str__(self):
@@ -185,11 +202,21 @@ class Reservation(models.Model):
     def save(self, *args, **kwargs):
         if not self.expiry_date:
             self.expiry_date = timezone.now() + timedelta(days=3)  # 3 days to fulfill reservation
+        if self._state.adding and self.status == 'pending' and self.position is None:
+            with transaction.atomic():
+                # Lock the book so concurrent reservations take distinct places
+                Book.objects.select_for_update().filter(pk=self.book_id).exists()
+                last = Reservation.objects.filter(book_id=self.book_id, status='pending').aggregate(
+                    last=models.Max('position')
+                )['last']
+                self.position = (last or 0) + 1
+                super().save(*args, **kwargs)
+            return
         super().save(*args, **kwargs)
     
     @property
     def is_expired(self):
-        return self.expiry_date < timezone.now() and self.status == 'pending'
+        return self.expiry_date < timezone.now() and self.status in ('pending', 'ready')
 
 class Fine(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='fines')
@@ -210,14 +237,19 @@ class Fine(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user', 'is_paid']),
+            models.Index(fields=['paid_date']),
+            models.Index(fields=['updated_at']),  # Report fingerprints (reports.jobs)
         ]
     
     def __str__(self):
         return f"Fine of ${self.amount} for {self.user.username}"
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
-    title = models.CharField(max_length=200)
-    message = models.TextField()
+    kind = models.CharField(max_length=50, blank=True)  # Template id, see core.notifications.TEMPLATES
+    subject = models.PositiveBigIntegerField(null=True, blank=True)  # Id of the record it is about
+    params = models.JSONField(default=dict, blank=True)
+    title = models.CharField(max_length=200, blank=True)  # Only stored for free-text notifications
+    message = models.TextField(blank=True)
     is_read = models.BooleanField(default=False)
     notification_type = models.CharField(max_length=20, choices=(
         ('info', 'Information'),
@@ -229,6 +261,142 @@ class Notification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_read']),
+        ]
+        constraints = [
+            # One live notification per user and subject; NULL subjects never collide
+            models.UniqueConstraint(fields=['user', 'kind', 'subject'], name='unique_notification_subject'),
+        ]
     
     def __str__(self):
-        return f"{self.title} - {self.user.username}"
\ No newline at end of file
+        return f"{self.title or self.kind} - {self.user.username}"
+class FineAccrualState(models.Model):
+    """Watermark and checkpoint of the incremental fine accrual (a single row)"""
+    accrued_through = models.DateField(null=True, blank=True)  # Fines are current as of this date
+    target_date = models.DateField(null=True, blank=True)  # Date of the run in progress, if any
+    existing_accrued = models.BooleanField(default=False)  # Run in progress has updated already-accruing loans
+    checkpoint = models.PositiveIntegerField(default=0)  # Last newly overdue BorrowRecord id committed
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Fines accrued through {self.accrued_through}"
+
+    @classmethod
+    def load(cls):
+        state, _ = cls.objects.get_or_create(pk=1)
+        return state
+
+class OutboundEmail(models.Model):
+    """Email waiting in the outbox for the background sender (see core.mail)"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # While sending: when the claim lapses and another sender may retry it
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=32, blank=True)  # Sender that claimed it (see core.mail)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipients)} ({self.status})"
+
+class Job(models.Model):
+    """A background run started from the API, e.g. the overdue fine run (see core.jobs)"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    kind = models.CharField(max_length=50)
+    # Jobs of one kind with different keys may run side by side, e.g. reports over different parameters
+    key = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    params = models.JSONField(default=dict, blank=True)
+    progress = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # The cross-worker lock: one queued or running job per kind and key
+            models.UniqueConstraint(
+                fields=['kind', 'key'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='one_active_job_per_kind_and_key'
+            ),
+        ]
+        indexes = [
+            # Finished results looked up for reuse (see reports.jobs)
+            models.Index(fields=['kind', 'key', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+
+class ScheduledTask(models.Model):
+    """When a core.scheduler entry next runs, and which worker holds its lease"""
+    name = models.CharField(max_length=100, unique=True)
+    next_run_at = models.DateTimeField()
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} (next {self.next_run_at})"
+
+
+class ScheduledRun(models.Model):
+    """One run of a scheduled task"""
+    STATUS_CHOICES = (
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+        ('skipped', 'Skipped'),
+    )
+
+    name = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    scheduled_for = models.DateTimeField()
+    started_at = models.DateTimeField()
+    duration_ms = models.PositiveIntegerField(default=0)
+    # Occurrences folded into this run because the scheduler was behind
+    missed_runs = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['name', '-started_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} at {self.started_at} ({self.status})"
@@ -0,0 +1,197 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .events import publish_notification
+from .models import Notification, User
+
+UNREAD_KEY = 'notifications:unread:{}'
+
+# kind -> (title, message, notification_type). Messages are str.format()
+# templates filled from Notification.params when the notification is read.
+TEMPLATES = {
+    'overdue_fine': (
+        'Overdue Book Fine',
+        'You have been charged ${amount} for overdue book: {book}',
+        'warning',
+    ),
+    'reservation_pending': (
+        'Book Reservation',
+        'Your reservation for {book} is pending. It will expire on {expires}',
+        'info',
+    ),
+    'reservation_fulfilled': (
+        'Reservation Fulfilled',
+        'Your reservation for {book} is now available for pickup!',
+        'success',
+    ),
+    'reservation_ready': (
+        'Reservation Ready',
+        'A copy of {book} is being held for you until {expires}.',
+        'success',
+    ),
+    'reservation_expired': (
+        'Reservation Expired',
+        'Your reservation for {book} has expired.',
+        'warning',
+    ),
+}
+
+
+def build(user_id, kind, subject=None, **params):
+    """An unsaved templated notification, for notify_many()"""
+    return Notification(
+        user_id=user_id,
+        kind=kind,
+        subject=subject,
+        params=params,
+        notification_type=TEMPLATES[kind][2],
+    )
+
+
+def notify_many(notifications):
+    """
+    Insert notifications, coalescing on (user, kind, subject): an existing
+    one for the same subject whose params changed is updated in place,
+    marked unread again and moved back to the top, instead of adding another
+    row. One whose params are unchanged is left as it is, read or not.
+    Returns the saved notifications, with their ids, as published.
+    """
+    latest = {}
+    for notification in notifications:
+        key = (notification.user_id, notification.kind, notification.subject)
+        # Only notifications about a subject coalesce; keep the last per key
+        latest[key if notification.subject is not None else id(notification)] = notification
+    plain = [notification for key, notification in latest.items() if not isinstance(key, tuple)]
+    keyed = {key: notification for key, notification in latest.items() if isinstance(key, tuple)}
+
+    existing = {}
+    if keyed:
+        users, kinds, subjects = (set(values) for values in zip(*keyed))
+        for row in Notification.objects.filter(user_id__in=users, kind__in=kinds, subject__in=subjects):
+            key = (row.user_id, row.kind, row.subject)
+            if key in keyed:
+                existing[key] = row
+
+    now = timezone.now()
+    inserted, changed = [], []
+    for key, notification in keyed.items():
+        row = existing.get(key)
+        if row is None:
+            inserted.append(notification)
+        elif (row.params, row.notification_type) != (notification.params, notification.notification_type):
+            row.params = notification.params
+            row.notification_type = notification.notification_type
+            row.is_read = False
+            row.created_at = now
+            changed.append(row)
+
+    if plain:
+        Notification.objects.bulk_create(plain)
+    if inserted:
+        try:
+            with transaction.atomic():
+                Notification.objects.bulk_create(inserted)
+        except IntegrityError:
+            # Another worker inserted some of these subjects meanwhile
+            Notification.objects.bulk_create(
+                inserted,
+                update_conflicts=True,
+                unique_fields=['user', 'kind', 'subject'],
+                update_fields=['params', 'notification_type', 'is_read', 'created_at'],
+            )
+        if any(notification.pk is None for notification in inserted):
+            # Upserted rows come back without primary keys; read them back
+            inserted = saved_rows(inserted)
+    if changed:
+        Notification.objects.bulk_update(changed, ['params', 'notification_type', 'is_read', 'created_at'])
+
+    saved = [*plain, *inserted, *changed]
+
+    # New rows and ones that turned unread again change the unread counts
+    invalidate_unread_counts({notification.user_id for notification in saved})
+    for notification in saved:
+        publish_notification(notification)
+    return saved
+
+
+def saved_rows(notifications):
+    """The stored rows for unsaved notifications about a subject, matched on (user, kind, subject)"""
+    keys = {(notification.user_id, notification.kind, notification.subject) for notification in notifications}
+    return [
+        row for row in Notification.objects.filter(
+            user_id__in={key[0] for key in keys},
+            kind__in={key[1] for key in keys},
+            subject__in={key[2] for key in keys},
+        )
+        if (row.user_id, row.kind, row.subject) in keys
+    ]
+
+
+def notify(user, kind, subject=None, **params):
+    notify_many([build(user.pk, kind, subject, **params)])
+
+
+def render(notification):
+    """Return (title, message) for a notification, templated or free text"""
+    template = TEMPLATES.get(notification.kind)
+    if template is None:
+        return notification.title, notification.message
+    title, message, _ = template
+    try:
+        return title, message.format(**notification.params)
+    except (KeyError, IndexError):
+        return title, notification.message
+
+
+# Unread counters
+#
+# Each user's unread count is cached under UNREAD_KEY. Marking notifications
+# read adjusts it in place; anything that can't tell how the count changed
+# drops it instead, and the next read recounts from the database. Counters
+# also expire after UNREAD_COUNT_TTL, and reconcile_unread_counts() rewrites
+# them all from one grouped query.
+
+def unread_count(user_id):
+    key = UNREAD_KEY.format(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        cache.set(key, count, timeout=settings.UNREAD_COUNT_TTL)
+    return count
+
+
+def adjust_unread_count(user_id, delta):
+    key = UNREAD_KEY.format(user_id)
+    try:
+        count = cache.incr(key, delta)
+    except ValueError:
+        # Not cached: the next unread_count() reads it from the database
+        return
+    if count < 0:
+        cache.delete(key)
+
+
+def reset_unread_count(user_id):
+    cache.set(UNREAD_KEY.format(user_id), 0, timeout=settings.UNREAD_COUNT_TTL)
+
+
+def invalidate_unread_counts(user_ids):
+    cache.delete_many([UNREAD_KEY.format(user_id) for user_id in user_ids])
+
+
+def reconcile_unread_counts(batch_size=1000):
+    """Rewrite every user's cached counter from the database; returns users updated"""
+    unread = dict(
+        Notification.objects.filter(is_read=False).order_by()
+        .values('user_id').annotate(count=Count('id')).values_list('user_id', 'count')
+    )
+    user_ids = list(User.objects.values_list('id', flat=True))
+    for start in range(0, len(user_ids), batch_size):
+        cache.set_many(
+            {UNREAD_KEY.format(user_id): unread.get(user_id, 0) for user_id in user_ids[start:start + batch_size]},
+            timeout=settings.UNREAD_COUNT_TTL
+        )
+    return len(user_ids)
@@ -0,0 +1,217 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def positive_int(value, cutoff=None):
+    """Parse a strictly positive integer query parameter, capped at `cutoff`"""
+    value = int(value)
+    if value <= 0:
+        raise ValueError(value)
+    return min(value, cutoff) if cutoff else value
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder without the millisecond truncation of datetimes"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over the queryset's own ordering.
+
+    The ordering is taken from the queryset (OrderingFilter or Meta.ordering)
+    and made unique by appending the primary key. A cursor stores the
+    ordering values of the boundary row, so every page is one indexed range
+    query with no OFFSET and no COUNT(*).
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    @staticmethod
+    def get_ordering(queryset):
+        """
+        Return the ordering as [(field_name, descending)], or None when it
+        can't be paged by keyset (expressions, related or nullable fields).
+        """
+        model = queryset.model
+        terms = list(queryset.query.order_by or model._meta.ordering)
+        ordering = []
+        for term in terms:
+            if not isinstance(term, str):
+                return None
+            descending = term.startswith('-')
+            name = term.lstrip('-')
+            if name == 'pk':
+                name = model._meta.pk.name
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field.null or field.is_relation:
+                return None
+            ordering.append((field.name, descending))
+
+        pk_name = model._meta.pk.name
+        if pk_name not in [name for name, _ in ordering]:
+            ordering.append((pk_name, ordering[0][1] if ordering else False))
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+        if self.ordering is None:
+            raise ValueError('Queryset ordering is not supported by keyset pagination')
+
+        values, reverse = self.decode_cursor(request)
+        if values is not None:
+            queryset = queryset.filter(self.seek(values, reverse))
+
+        order_by = [
+            f"{'-' if descending != reverse else ''}{name}"
+            for name, descending in self.ordering
+        ]
+        rows = list(queryset.order_by(*order_by)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+
+        self.first_values = self.row_values(rows[0]) if rows else None
+        self.last_values = self.row_values(rows[-1]) if rows else None
+        if not rows and values is not None:
+            # Paged past either end: keep a way back
+            self.first_values = self.last_values = values
+        return rows
+
+    def seek(self, values, reverse):
+        """Rows strictly after `values` in the (possibly reversed) ordering"""
+        condition = Q()
+        for index, (name, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[index]})
+            for (previous, _), value in zip(self.ordering[:index], values):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    def row_values(self, row):
+        return [getattr(row, name) for name, _ in self.ordering]
+
+    def get_page_size(self, request):
+        try:
+            return positive_int(
+                request.query_params[self.page_size_query_param],
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def ordering_signature(self):
+        return ','.join(f"{'-' if descending else ''}{name}" for name, descending in self.ordering)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values, reverse, signature = payload['v'], bool(payload['r']), payload['o']
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if signature != self.ordering_signature() or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            # Values as the fields hold them, so a tampered cursor can't reach the query
+            values = [
+                self.model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(self.ordering, values)
+            ]
+        except ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps(
+            {'v': values, 'r': int(reverse), 'o': self.ordering_signature()},
+            cls=CursorEncoder, separators=(',', ':')
+        )
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.last_values, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.first_values, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class CursorOrPageNumberPagination(BasePagination):
+    """
+    Keyset pagination by default for the large list endpoints.
+
+    Requests that pass `?page=N` or `?pagination=page` keep the old
+    PageNumberPagination behaviour (with `count`), as do orderings that
+    keyset pagination can't seek on, such as full-text relevance.
+    """
+    mode_query_param = 'pagination'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        wants_pages = (
+            request.query_params.get(self.mode_query_param) == 'page'
+            or 'page' in request.query_params
+        )
+        if wants_pages or KeysetPagination.get_ordering(queryset) is None:
+            self.paginator = PageNumberPagination()
+        else:
+            self.paginator = KeysetPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
@@ -0,0 +1,176 @@
+"""
+Reservation queues.
+
+Pending reservations for a book form a FIFO queue numbered 1..n through
+`Reservation.position`, so a user's place is read straight off their row.
+Positions stay dense: whoever leaves the queue closes the gap behind them
+in the same UPDATE. A copy coming back goes to the head of the queue as a
+'ready' hold, kept out of `available_copies` until the holder borrows it or
+the hold expires.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, CharField, F, IntegerField, Subquery, Value, When
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from .events import publish_availability
+from .models import Book, Reservation
+from .notifications import build, notify_many
+
+HOLD_DAYS = 3  # Time a ready hold waits for pickup
+SWEEP_BATCH_SIZE = 1000
+
+
+def close_gaps(book_id, positions):
+    """
+    Renumber a book's queue after the reservations at `positions` left it,
+    in one UPDATE. Call with the book locked.
+    """
+    positions = sorted(position for position in positions if position)
+    if not positions:
+        return
+    # The first matching When wins, so test the furthest gap first
+    Reservation.objects.filter(
+        book_id=book_id, status='pending', position__gt=positions[0]
+    ).update(position=Case(
+        *[When(position__gt=position, then=F('position') - (index + 1))
+          for index, position in reversed(list(enumerate(positions)))],
+        default=F('position'),
+        output_field=IntegerField(),
+    ))
+
+
+def lock_books(book_ids):
+    """
+    Lock book rows, in id order, before touching their queues. This is the
+    lock Reservation.save() takes to hand out places, so positions never
+    change under a concurrent reserve, cancel, checkout or return.
+    """
+    list(Book.objects.select_for_update().filter(pk__in=list(book_ids)).order_by('pk').values_list('pk', flat=True))
+
+
+def leave_queue(reservation_id, book_id, new_status):
+    """
+    Move one reservation to `new_status` and close its gap, in one UPDATE,
+    if it is still pending; returns whether it was. Call with the book
+    locked (see lock_books).
+    """
+    position = Reservation.objects.filter(pk=reservation_id, status='pending').values('position')
+    return bool(Reservation.objects.filter(
+        book_id=book_id, status='pending', position__gte=Subquery(position)
+    ).update(
+        status=Case(When(pk=reservation_id, then=Value(new_status)), default=F('status'), output_field=CharField()),
+        position=Case(
+            When(pk=reservation_id, then=Value(None)),
+            default=F('position') - 1,
+            output_field=IntegerField(),
+        ),
+    ))
+
+
+def return_copies(copies, now=None):
+    """
+    Put returned copies back: each one is held for the next pending
+    reservation on its book, and the rest go back to `available_copies`.
+    `copies` maps book id -> copies returned; returns book id -> copies held.
+    Call inside the returning transaction; the books are locked here.
+    """
+    now = now or timezone.now()
+    expires = now + timedelta(days=HOLD_DAYS)
+    held = Counter()
+    notifications = []
+
+    lock_books(copies)
+
+    queued = set(
+        Reservation.objects.filter(book_id__in=list(copies), status='pending')
+        .order_by().values_list('book_id', flat=True).distinct()
+    )
+    for book_id in sorted(queued):
+        heads = list(
+            Reservation.objects.select_for_update(of=('self',))
+            .filter(book_id=book_id, status='pending')
+            .order_by('position')
+            .values_list('pk', 'user_id', 'book__title')[:copies[book_id]]
+        )
+        Reservation.objects.filter(pk__in=[pk for pk, _, _ in heads]).update(
+            status='ready', position=None, expiry_date=expires
+        )
+        Reservation.objects.filter(book_id=book_id, status='pending').update(
+            position=F('position') - len(heads)
+        )
+        held[book_id] = len(heads)
+        notifications.extend(
+            build(user_id, 'reservation_ready', pk, book=title, expires=expires.strftime('%Y-%m-%d %H:%M'))
+            for pk, user_id, title in heads
+        )
+
+    books_by_count = defaultdict(list)
+    for book_id, count in copies.items():
+        if count > held[book_id]:
+            books_by_count[count - held[book_id]].append(book_id)
+    for count, book_ids in books_by_count.items():
+        # Book.save() never lets availability exceed the stock; keep that here
+        Book.objects.filter(pk__in=book_ids).update(
+            available_copies=Least(F('available_copies') + count, F('total_copies')), updated_at=now
+        )
+
+    if notifications:
+        notify_many(notifications)
+    return held
+
+
+def expire_reservations(now=None, batch_size=SWEEP_BATCH_SIZE):
+    """
+    Expire every pending reservation and ready hold past its expiry date
+    and notify the users, in batches of one read (served by the status and
+    expiry_date indexes), one lock on the books involved, one locked read,
+    one UPDATE and one notification upsert, plus the queue bookkeeping for
+    those books: gaps left in queues are closed and copies from lapsed
+    holds go to the next in line. Books are locked before reservations, as
+    everywhere else that touches a queue; reservation rows another worker
+    still has locked are left for the next sweep. Returns the number expired.
+    """
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            due = Reservation.objects.filter(status__in=['pending', 'ready'], expiry_date__lt=now).order_by('expiry_date')
+            book_ids = set(due.values_list('book_id', flat=True)[:batch_size])
+            if not book_ids:
+                break
+            lock_books(book_ids)
+            batch = list(
+                due.select_for_update(skip_locked=True, of=('self',)).filter(book_id__in=book_ids)
+                .values_list('pk', 'user_id', 'book_id', 'book__title', 'status', 'position')[:batch_size]
+            )
+            if not batch:
+                break
+            Reservation.objects.filter(pk__in=[row[0] for row in batch]).update(status='expired', position=None)
+
+            gaps = defaultdict(list)
+            lapsed = Counter()
+            for _, _, book_id, _, status, position in batch:
+                if status == 'pending':
+                    gaps[book_id].append(position)
+                else:
+                    lapsed[book_id] += 1
+            for book_id, positions in gaps.items():
+                close_gaps(book_id, positions)
+            if lapsed:
+                return_copies(lapsed, now)
+                publish_availability(dict(
+                    Book.objects.filter(pk__in=list(lapsed)).values_list('pk', 'available_copies')
+                ))
+
+            notify_many([
+                build(user_id, 'reservation_expired', pk, book=title)
+                for pk, user_id, _, title, _, _ in batch
+            ])
+        expired += len(batch)
+        if len(batch) < batch_size:
+            break
+    return expired
@@ -0,0 +1,264 @@
+"""
+Periodic maintenance jobs, run from inside the project.
+
+SCHEDULE lists each job with a cron expression. Any number of processes
+may call run_pending() (every gunicorn worker via SCHEDULER_AUTOSTART, or
+the run_scheduler command): each job has a ScheduledTask row, and a worker
+only runs the job after taking a lease on that row with a conditional
+UPDATE, so each occurrence runs exactly once. A worker that dies mid-run
+loses its lease when it expires and the job is picked up again.
+
+A scheduler that falls behind runs a late job once and records how many
+occurrences were folded into that run, instead of replaying each of them.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from . import tasks
+from .background import registry
+from .jobs import JobAlreadyActive, submit_job
+from .models import ScheduledRun, ScheduledTask
+from .notifications import reconcile_unread_counts
+
+logger = logging.getLogger(__name__)
+
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),
+)
+
+# Beyond this a late job just reports that many missed occurrences
+MAX_MISSED = 1000
+
+
+class CronSchedule:
+    """
+    A standard five-field cron expression (minute hour day month weekday)
+    with `*`, lists, ranges and steps. Weekdays run 0-6 from Sunday, 7 is
+    Sunday too. As in cron, when both day and weekday are restricted a time
+    matching either one matches. Times are evaluated in settings.TIME_ZONE.
+    """
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != len(CRON_FIELDS):
+            raise ValueError(f'Expected {len(CRON_FIELDS)} cron fields, got {expression!r}')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(part, *field) for part, field in zip(parts, CRON_FIELDS)
+        )
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    def __repr__(self):
+        return f'<CronSchedule {self.expression}>'
+
+    @staticmethod
+    def _parse(part, name, low, high):
+        values = set()
+        for item in part.split(','):
+            spec, _, step = item.partition('/')
+            step = int(step) if step else 1
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, end = (int(bound) for bound in spec.split('-', 1))
+            else:
+                start = int(spec)
+                end = high if step > 1 else start
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f'Invalid cron {name}: {item!r}')
+            values.update(range(start, end + 1, step))
+        if name == 'weekday' and 7 in values:
+            values = (values - {7}) | {0}
+        return frozenset(values)
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment):
+        """The first matching minute strictly after `moment` (aware)"""
+        tz = timezone.get_current_timezone()
+        local = timezone.localtime(moment, tz).replace(tzinfo=None, second=0, microsecond=0)
+        candidate = local + timedelta(minutes=1)
+        limit = candidate.year + 5
+        while candidate.year <= limit:
+            if candidate.month not in self.months:
+                year, month = divmod(candidate.month, 12)
+                candidate = datetime(candidate.year + year, month + 1, 1)
+            elif not self._day_matches(candidate):
+                candidate = datetime.combine(candidate.date() + timedelta(days=1), datetime.min.time())
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return timezone.make_aware(candidate, tz)
+        raise ValueError(f'{self.expression!r} never matches')
+
+    def count_between(self, start, end, limit=MAX_MISSED):
+        """Occurrences after `start` up to and including `end`"""
+        count = 0
+        moment = self.next_after(start)
+        while moment <= end and count < limit:
+            count += 1
+            moment = self.next_after(moment)
+        return count
+
+
+class SkipRun(Exception):
+    """Raised by a scheduled job that had nothing to do this time"""
+
+
+class Entry:
+    def __init__(self, name, cron, func, lease=timedelta(minutes=30)):
+        self.name = name
+        self.cron = CronSchedule(cron)
+        # A callable, or the name of a core.background task in another app
+        self.func = func
+        # How long a worker may hold the job before others presume it dead
+        self.lease = lease
+
+    def __repr__(self):
+        return f'<Entry {self.name} {self.cron.expression}>'
+
+
+def run_overdue_fines():
+    try:
+        job = submit_job('overdue_fines', params={'incremental': True}, inline=True)
+    except JobAlreadyActive as exc:
+        raise SkipRun(str(exc))
+    return {'job_id': job.pk, 'status': job.status, **(job.result or {})}
+
+
+def run_unread_reconcile():
+    return {'users': reconcile_unread_counts()}
+
+
+SCHEDULE = [
+    Entry('overdue_fines', '0 1 * * *', run_overdue_fines, lease=timedelta(hours=2)),
+    Entry('expire_reservations', '*/15 * * * *', tasks.expire_reservations.run),
+    Entry('reconcile_unread_counts', '30 3 * * *', run_unread_reconcile),
+    Entry('cleanup', '0 4 * * *', tasks.cleanup.run),
+    Entry('daily_stats', '*/5 * * * *', 'reports.tasks.refresh_daily_stats'),
+    Entry('rebuild_daily_stats', '45 3 * * *', 'reports.tasks.rebuild_daily_stats'),
+]
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def run_pending(now=None, worker=None, schedule=None):
+    """Run every job that is due and not leased by another worker; returns the ScheduledRuns"""
+    now = now or timezone.now()
+    worker = worker or worker_id()
+    runs = []
+    for entry in schedule or SCHEDULE:
+        # A job seen for the first time waits for its next occurrence
+        state, _ = ScheduledTask.objects.get_or_create(
+            name=entry.name, defaults={'next_run_at': entry.cron.next_after(now)}
+        )
+        if state.next_run_at > now:
+            continue
+        claimed = ScheduledTask.objects.filter(
+            pk=state.pk, next_run_at=state.next_run_at
+        ).filter(
+            Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+        ).update(locked_by=worker, locked_until=now + entry.lease)
+        if claimed:
+            runs.append(run_entry(entry, state, now, worker))
+    return runs
+
+
+def run_entry(entry, state, now, worker):
+    started_at = timezone.now()
+    started = time.perf_counter()
+    status, result, error = 'succeeded', None, ''
+    try:
+        func = registry[entry.func].run if isinstance(entry.func, str) else entry.func
+        result = func()
+    except SkipRun as exc:
+        status, error = 'skipped', str(exc)
+    except Exception as exc:
+        logger.exception('Scheduled job %s failed', entry.name)
+        status, error = 'failed', f'{type(exc).__name__}: {exc}'
+
+    elapsed = time.perf_counter() - started
+    try:
+        run = ScheduledRun.objects.create(
+            name=entry.name,
+            status=status,
+            scheduled_for=state.next_run_at,
+            started_at=started_at,
+            duration_ms=int(elapsed * 1000),
+            missed_runs=entry.cron.count_between(state.next_run_at, now),
+            worker=worker,
+            result=storable(result),
+            error=error,
+        )
+    finally:
+        # Released even if the run can't be recorded, so the entry isn't stuck
+        # until the lease lapses. Occurrences that fell while this run was
+        # going are skipped, not queued up
+        ScheduledTask.objects.filter(pk=state.pk, locked_by=worker).update(
+            next_run_at=entry.cron.next_after(now + timedelta(seconds=elapsed)),
+            last_run_at=started_at,
+            locked_by='',
+            locked_until=None,
+        )
+    return run
+
+
+def storable(result):
+    """A task's return value as JSON the run history can store, or its str() if it has none"""
+    try:
+        return json.loads(json.dumps(result, cls=DjangoJSONEncoder))
+    except (TypeError, ValueError):
+        return str(result)
+
+
+def run_forever(interval=30, stop=None):
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            run_pending()
+        except Exception:
+            logger.exception('Scheduler tick failed')
+        stop.wait(interval)
+
+
+_thread = None
+
+
+def autostart():
+    """Start the scheduler in a daemon thread if settings.SCHEDULER_AUTOSTART is on"""
+    global _thread
+    if not getattr(settings, 'SCHEDULER_AUTOSTART', False) or _thread is not None:
+        return
+    _thread = threading.Thread(
+        target=run_forever,
+        kwargs={'interval': getattr(settings, 'SCHEDULER_INTERVAL', 30)},
+        name='lms-scheduler',
+        daemon=True
+    )
+    _thread.start()
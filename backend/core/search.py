@@ -0,0 +1,224 @@
+import re
+
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import BooleanField, Case, Count, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import Book
+
+BOOK_TABLE = Book._meta.db_table
+FTS_TABLE = f'{BOOK_TABLE}_fts'
+SEARCH_COLUMNS = ('title', 'author', 'isbn', 'publisher')
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Facet name -> column(s) selected for it. The first column is the bucket
+# value, the optional second one its display label.
+FACETS = {
+    'genre': ('genre',),
+    'category': ('category_id', 'category__name'),
+    'language': ('language',),
+    'available': ('facet_available',),
+}
+
+# PostgreSQL: a generated tsvector column kept up to date by the database itself.
+# Title and author carry the most weight, then ISBN, then publisher.
+POSTGRES_INSTALL = [
+    f"""
+    ALTER TABLE {BOOK_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(author, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(isbn, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(publisher, '')), 'C')
+    ) STORED
+    """,
+    f"CREATE INDEX IF NOT EXISTS {BOOK_TABLE}_search_vector_gin ON {BOOK_TABLE} USING gin (search_vector)",
+]
+
+POSTGRES_UNINSTALL = [
+    f"DROP INDEX IF EXISTS {BOOK_TABLE}_search_vector_gin",
+    f"ALTER TABLE {BOOK_TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+
+# SQLite: an external-content FTS5 table over core_book, maintained by triggers.
+_columns = ', '.join(SEARCH_COLUMNS)
+_new_values = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+_old_values = ', '.join(f'old.{column}' for column in SEARCH_COLUMNS)
+
+SQLITE_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{_columns}, content='{BOOK_TABLE}', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')"
+)
+
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {BOOK_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+        END
+    """,
+    f'{FTS_TABLE}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {BOOK_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        END
+    """,
+    f'{FTS_TABLE}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {_columns} ON {BOOK_TABLE} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+            INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+        END
+    """,
+}
+
+
+def install_search_index(conn=None):
+    """Create the full-text index for books on the current database, if it is supported"""
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            for statement in POSTGRES_INSTALL:
+                cursor.execute(statement)
+        elif conn.vendor == 'sqlite':
+            # Rebuilding a table on SQLite (any ALTER of core_book) drops its
+            # triggers, so this is also re-run after every migrate.
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+                [BOOK_TABLE]
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            if existing.issuperset(SQLITE_TRIGGERS):
+                return
+            cursor.execute(SQLITE_TABLE)
+            for statement in SQLITE_TRIGGERS.values():
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def uninstall_search_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            for statement in POSTGRES_UNINSTALL:
+                cursor.execute(statement)
+        elif conn.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def search_tokens(terms):
+    """Split raw search terms into lowercase word tokens"""
+    tokens = []
+    for term in terms:
+        tokens.extend(token.lower() for token in TOKEN_RE.findall(term))
+    return tokens
+
+
+def full_text_search(queryset, tokens):
+    """
+    Restrict a Book queryset to rows matching every token (as a prefix) and
+    annotate it with `search_rank`. Returns None when the database has no
+    full-text backend.
+    """
+    if connection.vendor == 'postgresql':
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        match = RawSQL(
+            f"{BOOK_TABLE}.search_vector @@ to_tsquery('simple', %s)",
+            [query], output_field=BooleanField()
+        )
+        rank = RawSQL(
+            f"ts_rank_cd({BOOK_TABLE}.search_vector, to_tsquery('simple', %s))",
+            [query], output_field=FloatField()
+        )
+        queryset = queryset.filter(match).annotate(search_rank=rank)
+    elif connection.vendor == 'sqlite':
+        query = ' '.join(f'"{token}"*' for token in tokens)
+        # The MATCH runs once in the IN subquery; ranking only probes the
+        # FTS table by rowid for the rows that matched. bm25() is
+        # lower-is-better and its weights follow SEARCH_COLUMNS.
+        match = RawSQL(
+            f"{BOOK_TABLE}.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)",
+            [query], output_field=BooleanField()
+        )
+        rank = RawSQL(
+            f"(SELECT -bm25({FTS_TABLE}, 10.0, 10.0, 5.0, 1.0) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {BOOK_TABLE}.id)",
+            [query], output_field=FloatField()
+        )
+        queryset = queryset.filter(match).annotate(search_rank=rank)
+    else:
+        return None
+
+    return queryset.order_by('-search_rank', 'title', 'id')
+
+
+class BookSearchFilter(filters.SearchFilter):
+    """
+    Full-text replacement for SearchFilter on the book catalog.
+
+    Uses the tsvector/GIN index on PostgreSQL and the FTS5 table on SQLite,
+    ordering results by relevance. Other databases fall back to the regular
+    icontains search over `search_fields`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        tokens = search_tokens(self.get_search_terms(request))
+        if not tokens:
+            return queryset
+
+        results = full_text_search(queryset, tokens)
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        return results
+
+
+def book_facets(queryset, names):
+    """
+    Count books per value of each requested facet in one grouped query.
+
+    The query groups by the combination of all requested facet columns, so it
+    returns at most (genres x categories x languages x 2) rows regardless of
+    how many books match; the per-facet totals are folded together here.
+    """
+    columns = []
+    for name in names:
+        columns.extend(FACETS[name])
+
+    rows = queryset.order_by()
+    if 'available' in names:
+        rows = rows.annotate(facet_available=Case(
+            When(Q(available_copies__gt=0), then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        ))
+    rows = rows.values(*columns).annotate(facet_count=Count('id'))
+
+    genre_labels = dict(Book.GENRE_CHOICES)
+    buckets = {name: defaultdict(int) for name in names}
+    labels = {}
+    for row in rows:
+        for name in names:
+            value_column = FACETS[name][0]
+            value = row[value_column]
+            buckets[name][value] += row['facet_count']
+            if name == 'category':
+                labels[(name, value)] = row['category__name']
+            elif name == 'genre':
+                labels[(name, value)] = genre_labels.get(value, value)
+            else:
+                labels[(name, value)] = value
+
+    return {
+        name: sorted(
+            (
+                {'value': value, 'label': labels[(name, value)], 'count': count}
+                for value, count in buckets[name].items()
+            ),
+            key=lambda bucket: (-bucket['count'], str(bucket['label']))
+        )
+        for name in names
+    }
@@ -4,8 +4,9 @@ from django.contrib.auth.hashers import make_password
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.utils import timezone
-from .models import User, Category, Book, BorrowRecord, Reservation, Fine, Notification
+from .models import User, Category, Book, BorrowRecord, Reservation, Fine, Notification, Job
 from core.models import BorrowRecord 
+from .notifications import render
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False, allow_blank=True)
     
@@ -92,6 +93,22 @@ class BorrowRecordSerializer(serializers.ModelSerializer):
 
         return super().create(validated_data)
 
+class BatchCheckoutSerializer(serializers.Serializer):
+    borrower = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=50
+    )
+    due_date = serializers.DateField(required=False)
+
+class BatchReturnSerializer(serializers.Serializer):
+    borrow_records = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=200
+    )
+
 class ReservationSerializer(serializers.ModelSerializer):
     book_title = serializers.CharField(source='book.title', read_only=True)
     user_name = serializers.CharField(source='user.get_full_name', read_only=True)
@@ -100,7 +117,7 @@ class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reservation
         fields = '__all__'
-        read_only_fields = ('user', 'reservation_date', 'expiry_date', 'created_at')
+        read_only_fields = ('user', 'reservation_date', 'expiry_date', 'position', 'created_at')
 class FineSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.get_full_name', read_only=True)
     book_title = serializers.CharField(
@@ -132,8 +149,23 @@ class FineSerializer(serializers.ModelSerializer):
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
-        fields = '__all__'
-        read_only_fields = ('created_at',)
+        fields = ('id', 'user', 'kind', 'subject', 'title', 'message', 'notification_type', 'is_read', 'created_at')
+        read_only_fields = ('created_at', 'kind', 'subject')
+
+    def to_representation(self, instance):
+        # Templated notifications only store params; render them on read
+        data = super().to_representation(instance)
+        data['title'], data['message'] = render(instance)
+        return data
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'key', 'status', 'params', 'progress', 'result', 'error',
+            'created_by', 'created_at', 'started_at', 'finished_at', 'heartbeat_at'
+        ]
+        read_only_fields = fields
 
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
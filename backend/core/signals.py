@@ -1,7 +1,42 @@
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
-from .models import BorrowRecord, Reservation, Notification
+from .autocomplete import book_index
+from .events import publish_availability, publish_notification
+from .models import Book, BorrowRecord, Notification, Reservation
+from .notifications import adjust_unread_count, invalidate_unread_counts, notify
+
+@receiver(post_save, sender=Book)
+def update_autocomplete_index(sender, instance, **kwargs):
+    # Only once the save is committed, so a rollback leaves no phantom entry
+    book_id, title, author = instance.pk, instance.title, instance.author
+    transaction.on_commit(lambda: book_index.update_book(book_id, title, author))
+
+@receiver(post_save, sender=Book)
+def broadcast_availability(sender, instance, **kwargs):
+    publish_availability({instance.pk: instance.available_copies})
+
+@receiver(post_delete, sender=Book)
+def remove_from_autocomplete_index(sender, instance, **kwargs):
+    book_id = instance.pk
+    transaction.on_commit(lambda: book_index.remove_book(book_id))
+
+@receiver(post_save, sender=Notification)
+def update_unread_count(sender, instance, created, **kwargs):
+    if created and not instance.is_read:
+        adjust_unread_count(instance.user_id, 1)
+    elif not created:
+        invalidate_unread_counts([instance.user_id])
+
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, **kwargs):
+    if created:
+        publish_notification(instance)
+
+@receiver(post_delete, sender=Notification)
+def forget_unread_count(sender, instance, **kwargs):
+    invalidate_unread_counts([instance.user_id])
 
 @receiver(pre_save, sender=BorrowRecord)
 def calculate_fine_before_save(sender, instance, **kwargs):
@@ -15,31 +50,24 @@ def calculate_fine_before_save(sender, instance, **kwargs):
 @receiver(post_save, sender=BorrowRecord)
 def create_notification_for_overdue(sender, instance, created, **kwargs):
     if not created and instance.is_overdue and instance.fine_amount > 0:
-        Notification.objects.create(
-            user=instance.borrower,
-            title="Overdue Book Fine",
-            message=f"You have been charged ${instance.fine_amount:.2f} for overdue book: {instance.book.title}",
-            notification_type="warning"
+        # Coalesced: repeated saves update the same notification
+        notify(
+            instance.borrower,
+            'overdue_fine',
+            subject=instance.pk,
+            amount=f"{instance.fine_amount:.2f}",
+            book=instance.book.title
         )
 
-@receiver(pre_save, sender=Reservation)
-def check_reservation_expiry(sender, instance, **kwargs):
-    if instance.is_expired and instance.status == 'pending':
-        instance.status = 'expired'
-
 @receiver(post_save, sender=Reservation)
 def create_notification_for_reservation(sender, instance, created, **kwargs):
     if created:
-        Notification.objects.create(
-            user=instance.user,
-            title="Book Reservation",
-            message=f"Your reservation for {instance.book.title} is pending. It will expire on {instance.expiry_date.strftime('%Y-%m-%d %H:%M')}",
-            notification_type="info"
+        notify(
+            instance.user,
+            'reservation_pending',
+            subject=instance.pk,
+            book=instance.book.title,
+            expires=instance.expiry_date.strftime('%Y-%m-%d %H:%M')
         )
     elif instance.status == 'fulfilled':
-        Notification.objects.create(
-            user=instance.user,
-            title="Reservation Fulfilled",
-            message=f"Your reservation for {instance.book.title} is now available for pickup!",
-            notification_type="success"
-        )
\ No newline at end of file
+        notify(instance.user, 'reservation_fulfilled', subject=instance.pk, book=instance.book.title)
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import reservations
+from .background import task
+from .mail import BATCH_SIZE, deliver_outbox
+from .models import Job, OutboundEmail, ScheduledRun
+
+
+@task()
+def expire_reservations():
+    """Mark pending reservations past their expiry date as expired (see core.reservations)"""
+    return {'expired': reservations.expire_reservations()}
+
+
+@task()
+def send_queued_mail(batch_size=BATCH_SIZE):
+    """Deliver everything due in the email outbox"""
+    totals = {'sent': 0, 'retrying': 0, 'failed': 0}
+    while True:
+        stats = deliver_outbox(batch_size=batch_size)
+        for name, count in stats.items():
+            totals[name] += count
+        if sum(stats.values()) < batch_size or not stats['sent']:
+            return totals
+
+
+@task()
+def cleanup(days=30):
+    """Delete delivered mail, finished jobs and scheduler history older than `days`"""
+    cutoff = timezone.now() - timedelta(days=days)
+    return {
+        'emails': OutboundEmail.objects.filter(status='sent', sent_at__lt=cutoff).delete()[0],
+        'jobs': Job.objects.filter(status__in=['succeeded', 'failed'], finished_at__lt=cutoff).delete()[0],
+        'scheduled_runs': ScheduledRun.objects.filter(started_at__lt=cutoff).delete()[0],
+    }
@@ -1,11 +1,41 @@
-from django.test import TestCase
+import asyncio
+import base64
+import itertools
+import json
+import random
+import threading
+import time
+from io import StringIO
+from smtplib import SMTPException
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework import status
 from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta
-from .models import Book, Category, BorrowRecord
+from datetime import date, timedelta
+from decimal import Decimal
+from .models import Book, Category, BorrowRecord, Fine, FineAccrualState, Job, Notification, OutboundEmail, Reservation, ScheduledRun, ScheduledTask
+from .circulation import CirculationError, checkout, checkout_many, return_many
+from .autocomplete import GENERATION_KEY, book_index
+from .fines import accrue_fines, apply_overdue_fines
+from .notifications import notify
+from .events import BOOKS_CHANNEL, get_broker, user_channel
+from .mail import CLAIM_TIMEOUT, claim_batch, deliver_outbox, queue_mail
+from .background import task, task_metrics
+from .jobs import STALE_AFTER
+from .scheduler import CronSchedule, Entry, SkipRun, run_pending
+from .tasks import expire_reservations
+from . import reservations
 
 User = get_user_model()
 
@@ -168,4 +198,1244 @@ class BorrowRecordAPITestCase(APITestCase):
         
         # Check that book availability increased
         self.book.refresh_from_db()
-        self.assertEqual(self.book.available_copies, 5)
\ No newline at end of file
+        self.assertEqual(self.book.available_copies, 5)
+
+class BookSearchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader',
+            password='testpass123',
+            user_type='student'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        books = [
+            ('Python Crash Course', 'Eric Matthes', '9781593279288', 'No Starch Press'),
+            ('Fluent Python', 'Luciano Ramalho', '9781491946008', "O'Reilly Media"),
+            ('The Pragmatic Programmer', 'David Thomas', '9780201616224', 'Addison-Wesley'),
+            ('Learning Rust', 'Anna Smith', '9781098105679', 'Python Press'),
+        ]
+        for title, author, isbn, publisher in books:
+            Book.objects.create(
+                title=title,
+                author=author,
+                isbn=isbn,
+                genre='technology',
+                publication_date='2020-01-01',
+                publisher=publisher,
+            )
+
+    def search(self, term):
+        response = self.client.get(reverse('book-list'), {'search': term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [book['title'] for book in response.data['results']]
+
+    def test_search_matches_prefixes_across_fields(self):
+        self.assertEqual(self.search('pragm'), ['The Pragmatic Programmer'])
+        self.assertEqual(self.search('ramalho'), ['Fluent Python'])
+        self.assertEqual(self.search('978159'), ['Python Crash Course'])
+        self.assertEqual(self.search('fluent pyth'), ['Fluent Python'])
+
+    def test_search_ranks_title_matches_above_publisher_matches(self):
+        results = self.search('python')
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1], 'Learning Rust')
+
+    def test_search_index_follows_saves_and_deletes(self):
+        book = Book.objects.get(title='Learning Rust')
+        book.title = 'Learning Go'
+        book.save()
+        self.assertEqual(self.search('rust'), [])
+        self.assertEqual(self.search('learning go'), ['Learning Go'])
+
+        book.delete()
+        self.assertEqual(self.search('learning'), [])
+
+
+class BookAutocompleteTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader',
+            password='testpass123',
+            user_type='student'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        for isbn, (title, author) in enumerate([
+            ('Harry Potter and the Philosopher\'s Stone', 'J. K. Rowling'),
+            ('The Hobbit', 'J. R. R. Tolkien'),
+            ('Crime and Punishment', 'Fyodor Dostoevsky'),
+            ('Les Misérables', 'Victor Hugo'),
+        ], start=1000000000):
+            Book.objects.create(
+                title=title,
+                author=author,
+                isbn=str(isbn),
+                genre='fiction',
+                publication_date='2000-01-01',
+                publisher='Publisher',
+            )
+        book_index.load()
+
+    def autocomplete(self, query):
+        response = self.client.get(reverse('book-autocomplete'), {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_prefix_matches_titles_and_authors(self):
+        self.assertEqual([hit['title'] for hit in self.autocomplete('harry p')], ["Harry Potter and the Philosopher's Stone"])
+        self.assertEqual([hit['title'] for hit in self.autocomplete('hobb')], ['The Hobbit'])
+        self.assertEqual([hit['title'] for hit in self.autocomplete('les mise')], ['Les Misérables'])
+
+        hits = self.autocomplete('fyodor')
+        self.assertEqual(hits[0]['match'], 'author')
+        self.assertEqual(set(hits[0]), {'id', 'title', 'author', 'match'})
+
+    def test_typos_fall_back_to_trigram_correction(self):
+        self.assertEqual([hit['title'] for hit in self.autocomplete('hary poter')], ["Harry Potter and the Philosopher's Stone"])
+        self.assertEqual([hit['title'] for hit in self.autocomplete('crme and punishmnt')], ['Crime and Punishment'])
+
+    def test_index_follows_saves_and_deletes(self):
+        book = Book.objects.get(title='The Hobbit')
+        book.title = 'The Silmarillion'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertEqual(self.autocomplete('hobbit'), [])
+        self.assertEqual([hit['title'] for hit in self.autocomplete('silm')], ['The Silmarillion'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertEqual(self.autocomplete('silm'), [])
+
+    def test_rolled_back_saves_leave_the_index_alone(self):
+        book = Book.objects.get(title='The Hobbit')
+        book.title = 'The Silmarillion'
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                book.save()
+                raise RuntimeError('rolled back')
+        self.assertEqual(self.autocomplete('silm'), [])
+        self.assertEqual([hit['title'] for hit in self.autocomplete('hobb')], ['The Hobbit'])
+
+    def test_missed_generation_marks_the_index_stale(self):
+        generation = book_index._generation
+        book_index.update_book(-1, 'Dune', 'Frank Herbert')
+        self.assertEqual(book_index._generation, generation + 1)
+
+        # Another worker's change lands between our two bumps
+        cache.incr(GENERATION_KEY)
+        book_index.update_book(-2, 'Emma', 'Jane Austen')
+        self.assertIsNone(book_index._generation)
+
+
+class CursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user(
+            username='librarian',
+            password='testpass123',
+            user_type='librarian'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.librarian)
+
+        # Duplicate titles make the id tie-breaker matter
+        for number, title in enumerate(['Alpha', 'Beta', 'Beta', 'Beta', 'Gamma', 'Delta', 'Epsilon']):
+            Book.objects.create(
+                title=title,
+                author='Author',
+                isbn=f'97800000000{number:02d}',
+                genre='fiction',
+                publication_date='2020-01-01',
+                publisher='Publisher',
+            )
+
+    def walk(self, url, params, link='next'):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(book['id'] for book in response.data['results'])
+            if not response.data[link]:
+                return ids, response
+            response = self.client.get(response.data[link])
+
+    def test_cursor_pages_follow_title_then_id(self):
+        expected = list(Book.objects.order_by('title', 'id').values_list('id', flat=True))
+        ids, last_page = self.walk(reverse('book-list'), {'page_size': 2})
+        self.assertEqual(ids, expected)
+
+        # Walking back from the last page visits every earlier page in order
+        previous_ids = []
+        response = last_page
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            previous_ids = [book['id'] for book in response.data['results']] + previous_ids
+        self.assertEqual(previous_ids + [book['id'] for book in last_page.data['results']], expected)
+
+    def test_cursor_respects_requested_ordering(self):
+        expected = list(Book.objects.order_by('-title', '-id').values_list('id', flat=True))
+        ids, _ = self.walk(reverse('book-list'), {'page_size': 3, 'ordering': '-title'})
+        self.assertEqual(ids, expected)
+
+    def test_page_number_mode_is_still_available(self):
+        response = self.client.get(reverse('book-list'), {'page': 1})
+        self.assertEqual(response.data['count'], 7)
+
+        response = self.client.get(reverse('book-list'), {'pagination': 'page'})
+        self.assertEqual(response.data['count'], 7)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('book-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tampered_cursor_is_rejected(self):
+        def cursor(values, ordering):
+            payload = json.dumps({'v': values, 'r': 0, 'o': ordering})
+            return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+        for url, values, ordering in [
+            (reverse('book-list'), ['Title', 'abc'], 'title,id'),
+            (reverse('book-list'), ['Title', [1]], 'title,id'),
+            (reverse('borrowrecord-list'), ['yesterday', 1], '-borrow_date,-id'),
+        ]:
+            response = self.client.get(url, {'cursor': cursor(values, ordering)})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_borrow_records_page_by_borrow_date(self):
+        book = Book.objects.first()
+        for days in range(5):
+            record = BorrowRecord.objects.create(
+                book=book,
+                borrower=self.librarian,
+                due_date=timezone.now().date() + timedelta(days=14)
+            )
+            BorrowRecord.objects.filter(pk=record.pk).update(
+                borrow_date=timezone.now().date() - timedelta(days=days % 2)
+            )
+        expected = list(BorrowRecord.objects.order_by('-borrow_date', '-id').values_list('id', flat=True))
+        ids, _ = self.walk(reverse('borrowrecord-list'), {'page_size': 2})
+        self.assertEqual(ids, expected)
+
+
+class BookFacetTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader',
+            password='testpass123',
+            user_type='student'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        fiction = Category.objects.create(name='Fiction')
+        science = Category.objects.create(name='Science')
+        books = [
+            ('Dune', 'science', science, 'English', 2),
+            ('Cosmos', 'science', science, 'English', 0),
+            ('Emma', 'romance', fiction, 'English', 1),
+            ('Madame Bovary', 'romance', fiction, 'French', 0),
+            ('Le Petit Prince', 'fantasy', None, 'French', 3),
+        ]
+        for number, (title, genre, category, language, available) in enumerate(books):
+            Book.objects.create(
+                title=title,
+                author='Author',
+                isbn=f'97811111111{number:02d}',
+                genre=genre,
+                category=category,
+                language=language,
+                publication_date='2020-01-01',
+                publisher='Publisher',
+                total_copies=3,
+                available_copies=available,
+            )
+
+    def buckets(self, facets, name):
+        return {bucket['label']: bucket['count'] for bucket in facets[name]}
+
+    def test_facets_are_counted_in_one_grouped_query(self):
+        # One query for the page of results, one for all facets
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('book-list'), {'facets': 'genre,category,language,available'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        facets = response.data['facets']
+        self.assertEqual(self.buckets(facets, 'genre'), {'Science': 2, 'Romance': 2, 'Fantasy': 1})
+        self.assertEqual(self.buckets(facets, 'category'), {'Fiction': 2, 'Science': 2, None: 1})
+        self.assertEqual(self.buckets(facets, 'language'), {'English': 3, 'French': 2})
+        self.assertEqual(self.buckets(facets, 'available'), {True: 3, False: 2})
+
+    def test_facets_follow_search_and_filters(self):
+        response = self.client.get(reverse('book-list'), {'facets': 'language,available', 'genre': 'romance'})
+        facets = response.data['facets']
+        self.assertEqual(self.buckets(facets, 'language'), {'English': 1, 'French': 1})
+
+        response = self.client.get(reverse('book-list'), {'facets': 'genre', 'search': 'madame'})
+        self.assertEqual(self.buckets(response.data['facets'], 'genre'), {'Romance': 1})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_unknown_facet_is_rejected(self):
+        response = self.client.get(reverse('book-list'), {'facets': 'genre,colour'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CheckoutTestCase(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user(
+            username='student',
+            password='testpass123',
+            user_type='student'
+        )
+        self.books = [
+            Book.objects.create(
+                title=f'Book {number}',
+                author='Author',
+                isbn=f'97822222222{number:02d}',
+                genre='fiction',
+                publication_date='2020-01-01',
+                publisher='Publisher',
+                total_copies=2,
+                available_copies=2,
+            )
+            for number in range(7)
+        ]
+
+    def assertStatements(self, expected, func, *args):
+        """Like assertNumQueries, ignoring the savepoints around transaction.atomic"""
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args)
+        statements = [
+            query['sql'] for query in context.captured_queries
+            if 'SAVEPOINT' not in query['sql']
+        ]
+        self.assertEqual(len(statements), expected, '\n'.join(statements))
+        return result
+
+    def test_checkout_runs_at_most_four_queries(self):
+        Reservation.objects.create(book=self.books[0], user=self.student)
+        record = self.assertStatements(4, checkout, self.books[0].pk, self.student)
+
+        self.assertEqual(record.borrower, self.student)
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].available_copies, 1)
+        self.assertEqual(Reservation.objects.get(book=self.books[0]).status, 'fulfilled')
+
+        self.assertStatements(3, checkout, self.books[1].pk, self.student)
+
+    def test_checkout_rules(self):
+        checkout(self.books[0].pk, self.student)
+        with self.assertRaisesMessage(CirculationError, 'already borrowed'):
+            checkout(self.books[0].pk, self.student)
+
+        for book in self.books[1:5]:
+            checkout(book.pk, self.student)
+        with self.assertRaisesMessage(CirculationError, 'only borrow 5 books'):
+            checkout(self.books[5].pk, self.student)
+
+        BorrowRecord.objects.filter(book=self.books[1]).update(is_returned=True)
+        BorrowRecord.objects.filter(book=self.books[2]).update(due_date=timezone.now().date() - timedelta(days=1))
+        with self.assertRaisesMessage(CirculationError, 'overdue books'):
+            checkout(self.books[5].pk, self.student)
+
+        Book.objects.filter(pk=self.books[6].pk).update(available_copies=0)
+        with self.assertRaisesMessage(CirculationError, 'No copies available'):
+            checkout(self.books[6].pk, self.student)
+
+    def test_librarian_can_check_out_for_a_user(self):
+        librarian = User.objects.create_user(
+            username='librarian',
+            password='testpass123',
+            user_type='librarian'
+        )
+        client = APIClient()
+        client.force_authenticate(user=librarian)
+
+        response = client.post(reverse('user-borrow', kwargs={'pk': self.student.pk}), {'book': self.books[0].pk})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = client.post(reverse('borrowrecord-list'), {'book': self.books[0].pk, 'borrower': self.student.pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'This user has already borrowed this book.')
+        self.assertEqual(BorrowRecord.objects.get().borrower, self.student)
+
+        url = reverse('user-borrow', kwargs={'pk': self.student.pk})
+        self.assertEqual(client.post(url, {'book': 'abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client.post(url, {'book': 999999}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_batch_checkout_reports_each_book(self):
+        checkout(self.books[0].pk, self.student)
+        Book.objects.filter(pk=self.books[1].pk).update(available_copies=0)
+        Reservation.objects.create(book=self.books[2], user=self.student)
+        requested = [self.books[0].pk, self.books[1].pk, 999999] + [book.pk for book in self.books[2:7]]
+
+        results = self.assertStatements(6, checkout_many, self.student, requested)
+
+        self.assertEqual([result['book'] for result in results], requested)
+        self.assertEqual(
+            [result.get('error') for result in results],
+            [
+                'This user has already borrowed this book.',
+                'No copies available for borrowing.',
+                'Book not found.',
+                None, None, None, None,
+                'User can only borrow 5 books at a time.',
+            ]
+        )
+        self.assertEqual(BorrowRecord.objects.filter(borrower=self.student, is_returned=False).count(), 5)
+        self.assertEqual(Reservation.objects.get(book=self.books[2]).status, 'fulfilled')
+        self.assertEqual(
+            list(Book.objects.filter(pk__in=requested).order_by('pk').values_list('available_copies', flat=True)),
+            [1, 0, 1, 1, 1, 1, 2]
+        )
+
+    def test_batch_checkout_endpoint(self):
+        librarian = User.objects.create_user(
+            username='librarian',
+            password='testpass123',
+            user_type='librarian'
+        )
+        client = APIClient()
+        url = reverse('borrowrecord-batch-checkout')
+        payload = {'borrower': self.student.pk, 'books': [self.books[0].pk, self.books[1].pk]}
+
+        client.force_authenticate(user=self.student)
+        self.assertEqual(client.post(url, payload, format='json').status_code, status.HTTP_403_FORBIDDEN)
+
+        client.force_authenticate(user=librarian)
+        response = client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['borrowed'], 2)
+        self.assertEqual(response.data['results'][0]['borrow_record']['book'], self.books[0].pk)
+
+        BorrowRecord.objects.filter(book=self.books[0]).update(due_date=timezone.now().date() - timedelta(days=1))
+        response = client.post(url, {'borrower': self.student.pk, 'books': [self.books[2].pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('overdue books', response.data['error'])
+
+    def test_batch_return_charges_fines_in_bulk(self):
+        today = timezone.now().date()
+        records = [checkout(book.pk, self.student) for book in self.books[:4]]
+        BorrowRecord.objects.filter(pk=records[0].pk).update(due_date=today - timedelta(days=3))
+        BorrowRecord.objects.filter(pk=records[1].pk).update(due_date=today - timedelta(days=2))
+        # A fine already paid at the current amount stays paid; a stale one is reopened
+        Fine.objects.create(user=self.student, borrow_record=records[0], amount=3, is_paid=True)
+        Fine.objects.create(user=self.student, borrow_record=records[1], amount=1, is_paid=True)
+        BorrowRecord.objects.filter(pk=records[3].pk).update(is_returned=True)
+
+        requested = [record.pk for record in records] + [records[2].pk, 999999]
+        # Besides the steps in return_many's docstring: the books are locked and
+        # searched for reservation queues, and existing notifications read
+        results = self.assertStatements(9, return_many, requested)
+
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['returned', 'returned', 'returned', 'failed', 'failed', 'failed']
+        )
+        self.assertEqual(results[5]['error'], 'Borrow record not found.')
+        fines = {fine.borrow_record_id: fine for fine in Fine.objects.all()}
+        self.assertEqual((fines[records[0].pk].amount, fines[records[0].pk].is_paid), (3, True))
+        self.assertEqual((fines[records[1].pk].amount, fines[records[1].pk].is_paid), (2, False))
+        self.assertEqual(
+            list(BorrowRecord.objects.filter(pk__in=requested[:3]).order_by('pk').values_list('is_returned', 'fine_amount')),
+            [(True, 3), (True, 2), (True, 0)]
+        )
+        self.assertEqual(
+            list(Book.objects.filter(pk__in=[book.pk for book in self.books[:4]]).order_by('pk').values_list('available_copies', flat=True)),
+            [2, 2, 2, 1]
+        )
+        self.assertEqual(Notification.objects.filter(user=self.student, kind='overdue_fine').count(), 2)
+
+    def test_batch_return_endpoint(self):
+        librarian = User.objects.create_user(
+            username='librarian',
+            password='testpass123',
+            user_type='librarian'
+        )
+        records = [checkout(book.pk, self.student) for book in self.books[:2]]
+        client = APIClient()
+        url = reverse('borrowrecord-batch-return')
+        payload = {'borrow_records': [record.pk for record in records]}
+
+        client.force_authenticate(user=self.student)
+        self.assertEqual(client.post(url, payload, format='json').status_code, status.HTTP_403_FORBIDDEN)
+        response = client.post(reverse('borrowrecord-return-book', kwargs={'pk': records[0].pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_returned'])
+
+        client.force_authenticate(user=librarian)
+        response = client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['returned'], response.data['failed']), (1, 1))
+        self.assertEqual(response.data['results'][0]['error'], 'This book has already been returned.')
+        self.assertTrue(response.data['results'][1]['record']['is_returned'])
+
+
+class ConcurrentCheckoutTestCase(TransactionTestCase):
+    borrowers = 50
+    copies = 3
+
+    def test_concurrent_borrowers_never_oversubscribe_a_book(self):
+        book = Book.objects.create(
+            title='Last Copies',
+            author='Author',
+            isbn='9783333333333',
+            genre='fiction',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=self.copies,
+            available_copies=self.copies,
+        )
+        users = [
+            User.objects.create(username=f'borrower{number}', user_type='student')
+            for number in range(self.borrowers)
+        ]
+        outcomes = []
+        start = threading.Barrier(self.borrowers)
+
+        def borrow(user):
+            start.wait()
+            try:
+                for attempt in itertools.count():
+                    try:
+                        checkout(book.pk, user)
+                        outcomes.append('borrowed')
+                        return
+                    except CirculationError:
+                        outcomes.append('refused')
+                        return
+                    except OperationalError:
+                        # SQLite has no row locks; writers retry on "database is locked",
+                        # backing off with jitter so the threads stop colliding in lockstep
+                        time.sleep(random.uniform(0, min(0.5, 0.005 * 2 ** attempt)))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=borrow, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(outcomes.count('borrowed'), self.copies)
+        self.assertEqual(outcomes.count('refused'), self.borrowers - self.copies)
+        self.assertEqual(book.available_copies, 0)
+        self.assertEqual(BorrowRecord.objects.filter(book=book).count(), self.copies)
+
+
+class OverdueFineEngineTestCase(TestCase):
+    def setUp(self):
+        self.today = timezone.now().date()
+        self.students = [
+            User.objects.create_user(username=f'student{number}', password='testpass123', user_type='student')
+            for number in range(2)
+        ]
+        book = Book.objects.create(
+            title='Overdue Book',
+            author='Author',
+            isbn='9784444444444',
+            genre='fiction',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=10,
+            available_copies=10,
+        )
+        self.records = {}
+        for days, student, returned in [(-1, 0, False), (-5, 0, False), (-30, 1, False), (3, 1, False), (-9, 1, True)]:
+            record = BorrowRecord.objects.create(book=book, borrower=self.students[student], due_date=self.today)
+            BorrowRecord.objects.filter(pk=record.pk).update(
+                due_date=self.today + timedelta(days=days), is_returned=returned
+            )
+            self.records[days] = record
+        Fine.objects.create(user=self.students[0], borrow_record=self.records[-5], amount=5, is_paid=True)
+        Fine.objects.create(user=self.students[1], borrow_record=self.records[-30], amount=10, is_paid=True)
+
+    def snapshot(self):
+        return (
+            list(BorrowRecord.objects.order_by('pk').values_list('pk', 'fine_amount')),
+            list(Fine.objects.order_by('borrow_record_id').values_list('borrow_record_id', 'user_id', 'amount', 'is_paid')),
+        )
+
+    def test_matches_per_row_calculate_fine(self):
+        with transaction.atomic():
+            for record in BorrowRecord.objects.filter(is_returned=False, due_date__lt=self.today):
+                record.calculate_fine()
+            expected = self.snapshot()
+            transaction.set_rollback(True)
+
+        stats = apply_overdue_fines(chunk_size=2)
+
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(
+            (stats['overdue_records'], stats['records_updated'], stats['fines_created'], stats['fines_updated']),
+            (3, 3, 1, 1)
+        )
+        self.assertEqual(Notification.objects.filter(kind='overdue_fine').count(), 2)
+
+        # Nothing changed since the last run, so nothing is written or notified
+        stats = apply_overdue_fines()
+        self.assertEqual((stats['records_updated'], stats['notifications']), (0, 0))
+
+    def test_progress_is_reported_around_every_chunk(self):
+        calls = []
+        apply_overdue_fines(chunk_size=1, progress=calls.append)
+        # Once before the first of the three chunks, then after each
+        self.assertEqual([call['overdue_records'] for call in calls], [0, 1, 2, 3])
+
+    def test_command_reports_counts(self):
+        output = StringIO()
+        call_command('check_overdue_fines', stdout=output)
+        self.assertIn('Checked 3 overdue records', output.getvalue())
+        self.assertIn('fines created: 1', output.getvalue())
+        self.assertEqual(Job.objects.get(kind='overdue_fines').status, 'succeeded')
+
+    def test_command_refuses_to_overlap_a_running_job(self):
+        fines = Fine.objects.count()
+        active = Job.objects.create(kind='overdue_fines', status='running')
+        with self.assertRaisesMessage(CommandError, f'(job {active.pk})'):
+            call_command('check_overdue_fines', stdout=StringIO())
+        self.assertEqual(Fine.objects.count(), fines)
+
+    def test_overdue_listing_is_read_only(self):
+        librarian = User.objects.create_user(username='librarian', password='testpass123', user_type='librarian')
+        client = APIClient()
+        client.force_authenticate(user=librarian)
+        notifications = Notification.objects.count()
+
+        with self.assertNumQueries(1):
+            response = client.get(reverse('overdue-books'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['id'], row['days_overdue'], row['fine_amount']) for row in response.data['results']],
+            [(self.records[-30].pk, 30, 30.0), (self.records[-5].pk, 5, 5.0), (self.records[-1].pk, 1, 1.0)]
+        )
+        self.assertEqual(Fine.objects.count(), 2)
+        self.assertEqual(Notification.objects.count(), notifications)
+        self.assertFalse(BorrowRecord.objects.filter(fine_amount__gt=0).exists())
+
+        client.force_authenticate(user=self.students[0])
+        response = client.get(reverse('overdue-books'))
+        self.assertEqual([row['id'] for row in response.data['results']], [self.records[-5].pk, self.records[-1].pk])
+
+
+class IncrementalFineAccrualTestCase(TestCase):
+    def setUp(self):
+        self.day = timezone.now().date()
+        self.student = User.objects.create_user(username='student', password='testpass123', user_type='student')
+        self.book = Book.objects.create(
+            title='Overdue Book',
+            author='Author',
+            isbn='9785555555555',
+            genre='fiction',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=10,
+            available_copies=10,
+        )
+        # Already overdue, falls due tomorrow, falls due the day after
+        for offset in [-3, -3, 1, 1, 1, 2]:
+            self.loan(offset)
+
+    def loan(self, offset):
+        record = BorrowRecord.objects.create(book=self.book, borrower=self.student, due_date=self.day)
+        BorrowRecord.objects.filter(pk=record.pk).update(due_date=self.day + timedelta(days=offset))
+        return record
+
+    def snapshot(self):
+        return (
+            list(BorrowRecord.objects.order_by('pk').values_list('pk', 'fine_amount')),
+            list(Fine.objects.order_by('borrow_record_id').values_list('borrow_record_id', 'amount', 'is_paid')),
+        )
+
+    def test_incremental_run_matches_full_run(self):
+        self.assertEqual(accrue_fines(today=self.day)['mode'], 'full')
+        Fine.objects.filter(amount=3).update(is_paid=True)
+        target = self.day + timedelta(days=3)
+
+        with transaction.atomic():
+            apply_overdue_fines(today=target)
+            expected = self.snapshot()
+            transaction.set_rollback(True)
+
+        stats = accrue_fines(today=target, chunk_size=2)
+
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual((stats['mode'], stats['overdue_records'], stats['fines_created']), ('incremental', 4, 4))
+        self.assertEqual(stats['fines_updated'], 2)
+        # The repriced fines' notifications show the new amount
+        amounts = {
+            notification.subject: notification.params['amount']
+            for notification in Notification.objects.filter(kind='overdue_fine')
+        }
+        repriced = Fine.objects.filter(amount=6).values_list('borrow_record_id', flat=True)
+        self.assertEqual([amounts[record_id] for record_id in repriced], ['6.00', '6.00'])
+        state = FineAccrualState.load()
+        self.assertEqual((state.accrued_through, state.target_date), (target, None))
+        self.assertEqual(accrue_fines(today=target)['records_updated'], 0)
+
+    def test_repricing_reports_progress_per_chunk(self):
+        accrue_fines(today=self.day)
+        calls = []
+        accrue_fines(today=self.day + timedelta(days=2), chunk_size=1, progress=calls.append)
+        # Before starting, after each of the two already overdue loans is
+        # repriced, then after each of the three loans that fell due
+        self.assertEqual(len(calls), 6)
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        accrue_fines(today=self.day)
+        target = self.day + timedelta(days=3)
+        create_notifications = Notification.objects.bulk_create
+        calls = []
+
+        def crash_on_second_chunk(objs, *args, **kwargs):
+            calls.append(len(objs))
+            if len(calls) == 2:
+                raise RuntimeError('worker killed')
+            return create_notifications(objs, *args, **kwargs)
+
+        with mock.patch.object(Notification.objects, 'bulk_create', side_effect=crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                accrue_fines(today=target, chunk_size=2)
+
+        state = FineAccrualState.load()
+        self.assertEqual(state.target_date, target)
+        self.assertTrue(state.existing_accrued)
+        self.assertEqual(Fine.objects.filter(amount__gt=0).count(), 4)
+
+        stats = accrue_fines(today=target, chunk_size=2)
+        self.assertTrue(stats['resumed'])
+        # Only the two chunks after the checkpoint are processed again
+        self.assertEqual((stats['overdue_records'], stats['fines_created']), (2, 2))
+        self.assertEqual(Fine.objects.count(), 6)
+        self.assertIsNone(FineAccrualState.load().target_date)
+
+
+class NotificationCoalescingTestCase(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user(username='student', password='testpass123', user_type='student')
+        book = Book.objects.create(
+            title='Late Book',
+            author='Author',
+            isbn='9786666666666',
+            genre='fiction',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=2,
+            available_copies=2,
+        )
+        self.record = BorrowRecord.objects.create(book=book, borrower=self.student, due_date=timezone.now().date())
+        BorrowRecord.objects.filter(pk=self.record.pk).update(due_date=timezone.now().date() - timedelta(days=4))
+        self.record.refresh_from_db()
+
+    def test_repeated_saves_update_one_notification(self):
+        for _ in range(3):
+            self.record.save()
+        Notification.objects.update(is_read=True)
+        created_at = Notification.objects.get().created_at
+        self.record.calculate_fine()
+
+        # Same fine again: the notification the user read stays read
+        notification = Notification.objects.get()
+        self.assertEqual((notification.kind, notification.subject), ('overdue_fine', self.record.pk))
+        self.assertEqual(notification.params, {'amount': '4.00', 'book': 'Late Book'})
+        self.assertTrue(notification.is_read)
+        self.assertEqual(notification.created_at, created_at)
+        self.assertEqual(notification.message, '')
+
+        apply_overdue_fines(today=timezone.now().date() + timedelta(days=2))
+        notification = Notification.objects.get()
+        self.assertEqual(notification.params['amount'], '6.00')
+        self.assertFalse(notification.is_read)
+        self.assertGreater(notification.created_at, created_at)
+
+    def test_published_notifications_carry_their_ids(self):
+        broker = mock.Mock()
+        with mock.patch('core.events.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                notify(self.student, 'reservation_ready', subject=5, book='Dune', expires='Monday')
+            with self.captureOnCommitCallbacks(execute=True):
+                notify(self.student, 'reservation_ready', subject=5, book='Dune', expires='Tuesday')
+
+        notification = Notification.objects.get(kind='reservation_ready')
+        events = [call.args[1] for call in broker.publish.call_args_list]
+        self.assertEqual([event['id'] for event in events], [notification.pk, notification.pk])
+        self.assertIn('Tuesday', events[1]['message'])
+
+    def test_templates_are_rendered_on_read(self):
+        self.record.save()
+        Notification.objects.create(user=self.student, title='Welcome', message='Hello there')
+        client = APIClient()
+        client.force_authenticate(user=self.student)
+
+        response = client.get(reverse('notification-unread'))
+
+        self.assertEqual(
+            sorted((row['title'], row['message']) for row in response.data),
+            [
+                ('Overdue Book Fine', 'You have been charged $4.00 for overdue book: Late Book'),
+                ('Welcome', 'Hello there'),
+            ]
+        )
+
+
+class UnreadCountTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user(username='student', password='testpass123', user_type='student')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.student)}')
+        self.url = reverse('notification-unread-count')
+        for number in range(2):
+            Notification.objects.create(user=self.student, title=f'Notice {number}', message='Hello')
+
+    def badge(self):
+        return self.client.get(self.url).data['unread_count']
+
+    def test_polling_a_cached_count_needs_no_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.badge(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.badge(), 2)
+
+        notification = Notification.objects.create(user=self.student, title='Another', message='Hello')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.badge(), 3)
+
+        self.client.post(reverse('notification-mark-read', kwargs={'pk': notification.pk}))
+        self.client.post(reverse('notification-mark-read', kwargs={'pk': notification.pk}))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.badge(), 2)
+
+        self.client.post(reverse('notification-mark-all-read'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.badge(), 0)
+
+        notify(self.student, 'reservation_fulfilled', subject=1, book='Dune')
+        self.assertEqual(self.badge(), 1)
+
+    def test_reconcile_rewrites_counters(self):
+        self.assertEqual(self.badge(), 2)
+        Notification.objects.filter(user=self.student).update(is_read=True)
+        self.assertEqual(self.badge(), 2)
+
+        call_command('reconcile_unread_counts', stdout=StringIO())
+        self.assertEqual(self.badge(), 0)
+
+
+class EventStreamTestCase(SimpleTestCase):
+    async def test_stream_pushes_events_for_the_user(self):
+        token = AccessToken.for_user(User(id=42))
+        response = await self.async_client.get(reverse('event-stream'), {'token': str(token)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream = response.streaming_content
+        try:
+            self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+            broker = get_broker()
+            broker.publish(user_channel(7), {'type': 'notification', 'id': 1})
+            broker.publish(user_channel(42), {'type': 'notification', 'id': 2})
+            broker.publish(BOOKS_CHANNEL, {'type': 'availability', 'books': []})
+
+            self.assertEqual(
+                await asyncio.wait_for(anext(stream), 1),
+                b'event: notification\ndata: {"type": "notification", "id": 2}\n\n'
+            )
+            self.assertEqual(
+                await asyncio.wait_for(anext(stream), 1),
+                b'event: availability\ndata: {"type": "availability", "books": []}\n\n'
+            )
+        finally:
+            await stream.aclose()
+
+    async def test_stream_requires_a_valid_token(self):
+        response = await self.async_client.get(reverse('event-stream'), {'token': 'not-a-token'})
+        self.assertEqual(response.status_code, 401)
+
+
+class EventPublishingTestCase(TestCase):
+    def test_changes_are_published_after_commit(self):
+        student = User.objects.create_user(username='student', password='testpass123', user_type='student')
+        book = Book.objects.create(
+            title='Streamed Book',
+            author='Author',
+            isbn='9787777777777',
+            genre='fiction',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=2,
+            available_copies=2,
+        )
+        broker = mock.Mock()
+        with mock.patch('core.events.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                record = checkout(book.pk, student)
+                notify(student, 'reservation_fulfilled', subject=1, book='Streamed Book')
+                self.assertFalse(broker.publish.called)
+            with self.captureOnCommitCallbacks(execute=True):
+                return_many([record.pk])
+
+        events = [(call.args[0], call.args[1]['type']) for call in broker.publish.call_args_list]
+        self.assertEqual(events, [('books', 'availability'), (f'user:{student.pk}', 'notification'), ('books', 'availability')])
+        self.assertEqual(broker.publish.call_args_list[0].args[1]['books'], [{'id': book.pk, 'available_copies': 1}])
+        self.assertEqual(broker.publish.call_args_list[2].args[1]['books'], [{'id': book.pk, 'available_copies': 2}])
+
+
+class EmailOutboxTestCase(TestCase):
+    def test_register_only_queues_the_welcome_email(self):
+        response = APIClient().post(reverse('register'), {
+            'username': 'newreader',
+            'email': 'newreader@library.com',
+            'password': 'Str0ng-passw0rd!',
+            'password_confirmation': 'Str0ng-passw0rd!',
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(deliver_outbox(), {'sent': 1, 'retrying': 0, 'failed': 0})
+        self.assertEqual(mail.outbox[0].to, ['newreader@library.com'])
+        self.assertEqual(OutboundEmail.objects.get().status, 'sent')
+
+    def test_batch_reuses_one_connection_and_retries_failures(self):
+        for number in range(3):
+            queue_mail(f'Notice {number}', 'Body', [f'reader{number}@library.com'])
+
+        send = EmailMessage.send
+        def flaky_send(message, *args, **kwargs):
+            if message.subject == 'Notice 1':
+                raise SMTPException('450 mailbox busy')
+            return send(message, *args, **kwargs)
+
+        with mock.patch('core.mail.get_connection', wraps=get_connection) as connect, \
+                mock.patch.object(EmailMessage, 'send', flaky_send):
+            stats = deliver_outbox()
+
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(stats, {'sent': 2, 'retrying': 1, 'failed': 0})
+        retry = OutboundEmail.objects.get(subject='Notice 1')
+        self.assertEqual((retry.status, retry.attempts, retry.last_error), ('pending', 1, '450 mailbox busy'))
+        self.assertGreater(retry.next_attempt_at, timezone.now())
+
+        # Not due yet; once due, the final failed attempt gives up
+        self.assertEqual(deliver_outbox(), {'sent': 0, 'retrying': 0, 'failed': 0})
+        OutboundEmail.objects.filter(pk=retry.pk).update(next_attempt_at=timezone.now())
+        with mock.patch.object(EmailMessage, 'send', side_effect=SMTPException('550 no such user')):
+            self.assertEqual(deliver_outbox(max_attempts=2), {'sent': 0, 'retrying': 0, 'failed': 1})
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_senders_never_claim_the_same_email(self):
+        for number in range(3):
+            queue_mail(f'Notice {number}', 'Body', [f'reader{number}@library.com'])
+        now = timezone.now()
+
+        first = claim_batch(2, now)
+        self.assertEqual([email.subject for email in first], ['Notice 0', 'Notice 1'])
+        self.assertEqual([email.subject for email in claim_batch(10, now)], ['Notice 2'])
+        self.assertEqual(claim_batch(10, now), [])
+
+        # A sender that died mid-batch loses its claim once it lapses
+        later = claim_batch(10, now + CLAIM_TIMEOUT + timedelta(seconds=1))
+        self.assertEqual(len(later), 3)
+        self.assertEqual(deliver_outbox(), {'sent': 0, 'retrying': 0, 'failed': 0})
+
+
+@task(name='core.tests.add')
+def add(left, right):
+    if left < 0:
+        raise ValueError('negative')
+    return left + right
+
+
+class BackgroundTaskTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(TASK_BACKEND='immediate')
+    def test_immediate_backend_runs_inline_and_records_metrics(self):
+        student = User.objects.create_user(username='student', password='testpass123', user_type='student')
+        book = Book.objects.create(
+            title='Reserved Book',
+            author='Author',
+            isbn='9788888888888',
+            genre='fiction',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=1,
+            available_copies=0,
+        )
+        reservation = Reservation.objects.create(book=book, user=student)
+        Reservation.objects.filter(pk=reservation.pk).update(expiry_date=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(expire_reservations.delay(), {'expired': 1})
+        self.assertEqual(Reservation.objects.get().status, 'expired')
+        self.assertEqual(task_metrics()['core.tasks.expire_reservations']['runs'], 1)
+
+    @override_settings(TASK_BACKEND='thread')
+    def test_thread_backend_runs_in_the_pool(self):
+        self.assertEqual(add.delay(2, 3).result(timeout=5), 5)
+        with self.assertRaises(ValueError), self.assertLogs('core.background', 'ERROR'):
+            add.delay(-1, 3).result(timeout=5)
+
+        metrics = task_metrics()['core.tests.add']
+        self.assertEqual((metrics['runs'], metrics['failures']), (2, 1))
+        self.assertEqual(metrics['last_error'], 'ValueError: negative')
+
+
+@override_settings(TASK_BACKEND='immediate')
+class OverdueFineJobTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.librarian = User.objects.create_user(
+            username='librarian', password='testpass123', user_type='librarian'
+        )
+        student = User.objects.create_user(username='student', password='testpass123', user_type='student')
+        book = Book.objects.create(
+            title='Overdue Book',
+            author='Author',
+            isbn='9789999999999',
+            genre='fiction',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=5,
+            available_copies=5,
+        )
+        for days in (3, 7):
+            record = BorrowRecord.objects.create(book=book, borrower=student, due_date=timezone.now().date())
+            BorrowRecord.objects.filter(pk=record.pk).update(due_date=timezone.now().date() - timedelta(days=days))
+        self.client.force_authenticate(self.librarian)
+
+    def test_submission_returns_job_and_reports_progress(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('impose-overdue-fines'))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'queued')
+
+        response = self.client.get(reverse('job-detail', args=[response.data['id']]))
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertEqual(response.data['progress']['total'], 2)
+        self.assertEqual(response.data['progress']['overdue_records'], 2)
+        self.assertEqual(response.data['result']['fines_created'], 2)
+        self.assertEqual(Fine.objects.count(), 2)
+
+    def test_only_one_active_run(self):
+        active = Job.objects.create(kind='overdue_fines', status='running')
+        response = self.client.post(reverse('impose-overdue-fines'))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['job']['id'], active.pk)
+
+        # A run that stopped sending heartbeats no longer holds the lock
+        Job.objects.filter(pk=active.pk).update(heartbeat_at=timezone.now() - STALE_AFTER - timedelta(minutes=1))
+        response = self.client.post(reverse('impose-overdue-fines'), {'incremental': True})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Job.objects.get(pk=active.pk).status, 'failed')
+
+
+class SchedulerTestCase(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.entry = Entry('tick', '*/15 * * * *', lambda: self.calls.append(1) or {'ok': True})
+        self.start = timezone.make_aware(timezone.datetime(2024, 1, 1, 9, 5))
+
+    def test_cron_next_after(self):
+        def after(expression, moment):
+            return CronSchedule(expression).next_after(timezone.make_aware(timezone.datetime(*moment)))
+
+        self.assertEqual(after('*/15 * * * *', (2024, 1, 1, 9, 5)).minute, 15)
+        self.assertEqual(after('0 1 * * *', (2024, 1, 1, 9, 5)).date().isoformat(), '2024-01-02')
+        # 2024-01-06 is a Saturday; the next Monday is the 8th
+        self.assertEqual(after('30 8 * * 1-5', (2024, 1, 6, 0, 0)).isoformat(), '2024-01-08T08:30:00+00:00')
+        self.assertEqual(after('0 0 1 */3 *', (2024, 2, 10, 0, 0)).date().isoformat(), '2024-04-01')
+        self.assertEqual(after('0 0 * * 7', (2024, 1, 1, 0, 0)).date().isoformat(), '2024-01-07')
+        with self.assertRaises(ValueError):
+            CronSchedule('61 * * * *')
+
+    def test_runs_once_per_occurrence_across_workers(self):
+        self.assertEqual(run_pending(self.start, 'a', [self.entry]), [])
+        due = self.start + timedelta(minutes=10)
+        runs = run_pending(due, 'a', [self.entry]) + run_pending(due, 'b', [self.entry])
+        self.assertEqual(len(runs), 1)
+        self.assertEqual((runs[0].status, runs[0].result, runs[0].worker), ('succeeded', {'ok': True}, 'a'))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_leased_job_is_left_alone_until_the_lease_expires(self):
+        run_pending(self.start, 'a', [self.entry])
+        due = self.start + timedelta(minutes=10)
+        ScheduledTask.objects.update(locked_by='a', locked_until=due + timedelta(minutes=30))
+        self.assertEqual(run_pending(due, 'b', [self.entry]), [])
+        self.assertEqual(len(run_pending(due + timedelta(hours=1), 'b', [self.entry])), 1)
+
+    def test_late_runs_catch_up_once(self):
+        run_pending(self.start, 'a', [self.entry])
+        runs = run_pending(self.start + timedelta(hours=2), 'a', [self.entry])
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0].missed_runs, 7)
+        self.assertEqual(ScheduledTask.objects.get().next_run_at, self.start + timedelta(hours=2, minutes=10))
+
+    def test_failures_and_skips_are_recorded(self):
+        def fail():
+            raise RuntimeError('boom')
+
+        def skip():
+            raise SkipRun('nothing to do')
+
+        entries = [Entry('fail', '* * * * *', fail), Entry('skip', '* * * * *', skip)]
+        run_pending(self.start, 'a', entries)
+        with self.assertLogs('core.scheduler', 'ERROR'):
+            run_pending(self.start + timedelta(minutes=1), 'a', entries)
+        self.assertEqual(
+            dict(ScheduledRun.objects.values_list('name', 'status')),
+            {'fail': 'failed', 'skip': 'skipped'}
+        )
+        self.assertEqual(ScheduledRun.objects.get(name='fail').error, 'RuntimeError: boom')
+
+    def test_results_are_stored_as_json_and_the_lease_is_always_released(self):
+        entries = [
+            Entry('dated', '* * * * *', lambda: {'day': date(2024, 1, 1), 'amount': Decimal('1.50')}),
+            Entry('opaque', '* * * * *', lambda: {'handle': object()}),
+        ]
+        run_pending(self.start, 'a', entries)
+        run_pending(self.start + timedelta(minutes=1), 'a', entries)
+        self.assertEqual(ScheduledRun.objects.get(name='dated').result, {'day': '2024-01-01', 'amount': '1.50'})
+        self.assertTrue(ScheduledRun.objects.get(name='opaque').result.startswith("{'handle': <object"))
+
+        run_pending(self.start, 'a', [self.entry])
+        with mock.patch.object(ScheduledRun.objects, 'create', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                run_pending(self.start + timedelta(minutes=10), 'a', [self.entry])
+        self.assertEqual(ScheduledTask.objects.get(name='tick').locked_by, '')
+
+
+class ReservationSweepTestCase(APITestCase):
+    def setUp(self):
+        self.students = [
+            User.objects.create_user(username=f'student{number}', password='testpass123', user_type='student')
+            for number in range(3)
+        ]
+        self.book = Book.objects.create(
+            title='Popular Book',
+            author='Author',
+            isbn='9781212121212',
+            genre='fiction',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=1,
+            available_copies=0,
+        )
+        self.reservations = [Reservation.objects.create(book=self.book, user=student) for student in self.students]
+        Reservation.objects.filter(pk__in=[r.pk for r in self.reservations[:2]]).update(
+            expiry_date=timezone.now() - timedelta(hours=1)
+        )
+
+    def test_sweep_expires_in_batches_and_notifies(self):
+        self.assertEqual(reservations.expire_reservations(batch_size=1), 2)
+        self.assertEqual(
+            list(Reservation.objects.order_by('pk').values_list('status', flat=True)),
+            ['expired', 'expired', 'pending']
+        )
+        expired = Notification.objects.filter(kind='reservation_expired').order_by('user_id')
+        self.assertEqual([n.user_id for n in expired], [s.pk for s in self.students[:2]])
+        self.assertEqual(reservations.expire_reservations(), 0)
+
+    def test_expired_reservations_do_not_block_reserving_again(self):
+        reservations.expire_reservations()
+        self.client.force_authenticate(self.students[0])
+        response = self.client.post(reverse('book-reserve', args=[self.book.pk]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        reservations.expire_reservations(now=timezone.now() + timedelta(days=4))
+        self.assertEqual(Reservation.objects.filter(user=self.students[0], status='expired').count(), 2)
+
+        self.client.force_authenticate(self.students[2])
+        response = self.client.post(reverse('book-reserve', args=[self.book.pk]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('book-reserve', args=[self.book.pk]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReservationQueueTestCase(APITestCase):
+    def setUp(self):
+        self.students = [
+            User.objects.create_user(username=f'student{number}', password='testpass123', user_type='student')
+            for number in range(5)
+        ]
+        self.book = Book.objects.create(
+            title='Popular Textbook',
+            author='Author',
+            isbn='9781313131313',
+            genre='education',
+            publication_date='2020-01-01',
+            publisher='Publisher',
+            total_copies=1,
+            available_copies=1,
+        )
+        self.loan = checkout(self.book.pk, self.students[0])
+        self.queue = [Reservation.objects.create(book=self.book, user=student) for student in self.students[1:]]
+
+    def positions(self):
+        return list(
+            Reservation.objects.filter(book=self.book, status='pending').order_by('position')
+            .values_list('user__username', 'position')
+        )
+
+    def test_positions_are_dense_and_gaps_close(self):
+        self.assertEqual(self.positions(), [('student1', 1), ('student2', 2), ('student3', 3), ('student4', 4)])
+        self.client.force_authenticate(self.students[2])
+        response = self.client.post(reverse('reservation-cancel', args=[self.queue[1].pk]))
+        self.assertEqual(response.data['status'], 'cancelled')
+        self.assertEqual(self.positions(), [('student1', 1), ('student3', 2), ('student4', 3)])
+
+        Reservation.objects.filter(pk__in=[self.queue[0].pk, self.queue[3].pk]).update(
+            expiry_date=timezone.now() - timedelta(minutes=1)
+        )
+        reservations.expire_reservations()
+        self.assertEqual(self.positions(), [('student3', 1)])
+
+    def test_leaving_twice_does_not_shift_the_queue(self):
+        # A cancel that read the reservation before a checkout fulfilled it
+        self.assertTrue(reservations.leave_queue(self.queue[0].pk, self.book.pk, 'fulfilled'))
+        self.assertFalse(reservations.leave_queue(self.queue[0].pk, self.book.pk, 'cancelled'))
+        self.assertEqual(Reservation.objects.get(pk=self.queue[0].pk).status, 'fulfilled')
+        self.assertEqual(self.positions(), [('student2', 1), ('student3', 2), ('student4', 3)])
+
+    def test_return_promotes_the_head_to_a_hold(self):
+        return_many([self.loan.pk])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+        head = Reservation.objects.get(pk=self.queue[0].pk)
+        self.assertEqual((head.status, head.position), ('ready', None))
+        self.assertEqual(self.positions()[0], ('student2', 1))
+        self.assertTrue(Notification.objects.filter(user=self.students[1], kind='reservation_ready').exists())
+
+        # Only the holder can take the held copy
+        with self.assertRaises(CirculationError):
+            checkout(self.book.pk, self.students[2])
+        checkout(self.book.pk, self.students[1])
+        self.assertEqual(Reservation.objects.get(pk=head.pk).status, 'fulfilled')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+
+    def test_holder_cannot_queue_again(self):
+        return_many([self.loan.pk])
+        self.client.force_authenticate(self.students[1])
+        response = self.client.post(reverse('book-reserve', args=[self.book.pk]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.positions(), [('student2', 1), ('student3', 2), ('student4', 3)])
+
+    def test_lapsed_hold_passes_to_the_next_in_line(self):
+        return_many([self.loan.pk])
+        Reservation.objects.filter(status='ready').update(expiry_date=timezone.now() - timedelta(minutes=1))
+        reservations.expire_reservations()
+        self.assertEqual(Reservation.objects.get(pk=self.queue[1].pk).status, 'ready')
+        self.assertEqual(self.positions(), [('student3', 1), ('student4', 2)])
+
+    def test_my_position(self):
+        self.client.force_authenticate(self.students[3])
+        url = reverse('book-my-position', args=[self.book.pk])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual((response.data['status'], response.data['position']), ('pending', 3))
+
+        self.client.force_authenticate(self.students[0])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
@@ -11,6 +11,7 @@ router.register(r'borrow-records', views.BorrowRecordViewSet, basename='borrowre
 router.register(r'reservations', views.ReservationViewSet, basename='reservation')
 router.register(r'fines', views.FineViewSet, basename='fine')
 router.register(r'notifications', views.NotificationViewSet, basename='notification')
+router.register(r'jobs', views.JobViewSet, basename='job')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -22,6 +23,8 @@ urlpatterns = [
     path('dashboard-stats/', views.dashboard_stats, name='dashboard-stats'),
     path('impose-overdue-fines/', views.impose_overdue_fines, name='impose-overdue-fines'),
     path('overdue-books/', views.get_overdue_books, name='overdue-books'),
+    path('events/', views.event_stream, name='event-stream'),
+    path('task-metrics/', views.task_metrics_view, name='task-metrics'),
     
     # Add users endpoints
 ]
\ No newline at end of file
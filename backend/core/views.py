@@ -1,24 +1,41 @@
-from .models import User, Book, BorrowRecord, Reservation, Fine, Notification, Category
+from .models import User, Book, BorrowRecord, Reservation, Fine, Notification, Category, Job
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework import permissions, viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
+from django.db import IntegrityError, transaction
 from django.db.models import Q, Count, Sum
 from django.utils import timezone
 from datetime import timedelta
 from .serializers import (
     BookSerializer, BorrowRecordSerializer, ReservationSerializer, 
     FineSerializer, NotificationSerializer, CategorySerializer,
-    ChangePasswordSerializer, UserSerializer
+    ChangePasswordSerializer, UserSerializer, BatchCheckoutSerializer,
+    BatchReturnSerializer, JobSerializer
 )
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from .models import Reservation
 from .permissions import IsLibrarian, IsAdmin, IsOwner
+from .search import FACETS, BookSearchFilter, book_facets
+from .pagination import CursorOrPageNumberPagination
+from .circulation import CirculationError, checkout, checkout_many, return_many
+from .reservations import leave_queue, lock_books, return_copies
+from .autocomplete import book_index
+from .fines import DaysOverdue, fine_expression
+from .background import task_metrics
+from .jobs import JobAlreadyActive, submit_job
+from .notifications import adjust_unread_count, reset_unread_count, unread_count
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .events import BOOKS_CHANNEL, sse_messages, user_channel
+from reports.rollup import dashboard_stats as dashboard_rollup
 # Add this import at the top
-from django.http import JsonResponse, HttpResponseNotFound
+from django.http import Http404, JsonResponse, HttpResponseNotFound, StreamingHttpResponse
 import json
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -38,7 +55,8 @@ class BookViewSet(viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = CursorOrPageNumberPagination
+    filter_backends = [DjangoFilterBackend, BookSearchFilter, filters.OrderingFilter]
     filterset_fields = ['genre', 'category']
     search_fields = ['title', 'author', 'isbn', 'publisher']
     ordering_fields = ['title', 'author', 'publication_date', 'created_at']
@@ -60,104 +78,84 @@ class BookViewSet(viewsets.ModelViewSet):
             return [permissions.IsAuthenticated(), IsLibrarian()]
         return super().get_permissions()
 
+    def list(self, request, *args, **kwargs):
+        # ?facets=genre,category,language,available adds bucket counts for
+        # the filtered catalog next to the page of results
+        facets = [name for name in request.query_params.get('facets', '').split(',') if name]
+        unknown = [name for name in facets if name not in FACETS]
+        if unknown:
+            return Response(
+                {'error': f"Unknown facets: {', '.join(unknown)}. Choose from {', '.join(FACETS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = super().list(request, *args, **kwargs)
+        if facets:
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data['facets'] = book_facets(queryset, facets)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Title/author suggestions for the search box, served from the in-process index"""
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 25)
+        except ValueError:
+            limit = 10
+        return Response(book_index.search(query, limit))
+
     @action(detail=True, methods=['post'])
     def reserve(self, request, pk=None):
         book = self.get_object()
         user = request.user
 
-        # Check if user already has pending reservation
-        if Reservation.objects.filter(book=book, user=user, status='pending').exists():
+        # Create reservation with expiry date 3 days from now; the
+        # unique_active_reservation index rejects a second pending or ready one
+        expiry_date = timezone.now() + timedelta(days=3)
+        try:
+            with transaction.atomic():
+                reservation = Reservation.objects.create(
+                    book=book,
+                    user=user,
+                    expiry_date=expiry_date
+                )
+        except IntegrityError:
             return Response(
-                {"error": "You already have a pending reservation for this book."},
+                {"error": "You already have an active reservation for this book."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Create reservation with expiry date 3 days from now
-        expiry_date = timezone.now() + timedelta(days=3)
-        reservation = Reservation.objects.create(
-            book=book,
-            user=user,
-            expiry_date=expiry_date
-        )
-
         return Response(
             {"message": "Book reserved successfully", "reservation_id": reservation.id},
             status=status.HTTP_201_CREATED
         )
 
-    # ADD THIS BORROW ACTION TO BOOKVIEWSET
-    @action(detail=True, methods=['post'])
-    def borrow(self, request, pk=None):
-        book = self.get_object()
-        user = request.user
-        
-        if book.available_copies <= 0:
-            return Response(
-                {'error': 'No copies available for borrowing.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Check if user already has this book borrowed
-        existing_borrow = BorrowRecord.objects.filter(
-            book=book, 
-            borrower=user, 
-            is_returned=False
-        ).exists()
-        
-        if existing_borrow:
-            return Response(
-                {'error': 'You have already borrowed this book.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Check if user has too many borrowed books
-        max_books = 5  # Maximum books a user can borrow
-        current_borrows = BorrowRecord.objects.filter(
-            borrower=user, 
-            is_returned=False
-        ).count()
-        
-        if current_borrows >= max_books:
-            return Response(
-                {'error': f'You can only borrow {max_books} books at a time.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Check for overdue books
-        overdue_books = BorrowRecord.objects.filter(
-            borrower=user, 
-            is_returned=False,
-            due_date__lt=timezone.now().date()
-        ).exists()
-        
-        if overdue_books:
+    @action(detail=True, methods=['get'], url_path='my-position')
+    def my_position(self, request, pk=None):
+        """The user's place in this book's reservation queue, from one indexed row"""
+        reservation = Reservation.objects.filter(
+            book_id=pk, user=request.user, status__in=['pending', 'ready']
+        ).values('id', 'status', 'position', 'expiry_date').first()
+        if reservation is None:
             return Response(
-                {'error': 'You have overdue books. Please return them before borrowing new ones.'},
-                status=status.HTTP_400_BAD_REQUEST
+                {'error': 'You have no active reservation for this book.'},
+                status=status.HTTP_404_NOT_FOUND
             )
-        
-        # Create borrow record
-        borrow_record = BorrowRecord.objects.create(
-            book=book,
-            borrower=user,
-            due_date=timezone.now().date() + timedelta(days=14)  # 2 weeks
-        )
-        
-        # Update book availability
-        book.available_copies -= 1
-        book.save()
-        
-        # Check for reservations and update if any
-        reservation = Reservation.objects.filter(
-            book=book, 
-            user=user, 
-            status='pending'
-        ).first()
-        
-        if reservation:
-            reservation.status = 'fulfilled'
-            reservation.save()
-        
+        return Response(reservation)
+
+    @action(detail=True, methods=['post'])
+    def borrow(self, request, pk=None):
+        if not str(pk).isdigit():
+            raise Http404
+
+        try:
+            borrow_record = checkout(int(pk), request.user)
+        except Book.DoesNotExist:
+            raise Http404
+        except CirculationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         serializer = BorrowRecordSerializer(borrow_record)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     # ... rest of your BookViewSet code ...
@@ -247,76 +245,22 @@ class UserViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def borrow(self, request, pk=None):
-        book = self.get_object()
-        user = request.user
-        
-        if book.available_copies <= 0:
+        """Check a book out to this user on their behalf"""
+        borrower = self.get_object()
+        book_id = str(request.data.get('book') or '')
+        if not book_id.isdigit():
             return Response(
-                {'error': 'No copies available for borrowing.'},
+                {'error': 'Book ID is required.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Check if user already has this book borrowed
-        existing_borrow = BorrowRecord.objects.filter(
-            book=book, 
-            borrower=user, 
-            is_returned=False
-        ).exists()
-        
-        if existing_borrow:
-            return Response(
-                {'error': 'You have already borrowed this book.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Check if user has too many borrowed books
-        max_books = 5  # Maximum books a user can borrow
-        current_borrows = BorrowRecord.objects.filter(
-            borrower=user, 
-            is_returned=False
-        ).count()
-        
-        if current_borrows >= max_books:
-            return Response(
-                {'error': f'You can only borrow {max_books} books at a time.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Check for overdue books
-        overdue_books = BorrowRecord.objects.filter(
-            borrower=user, 
-            is_returned=False,
-            due_date__lt=timezone.now().date()
-        ).exists()
-        
-        if overdue_books:
-            return Response(
-                {'error': 'You have overdue books. Please return them before borrowing new ones.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Create borrow record
-        borrow_record = BorrowRecord.objects.create(
-            book=book,
-            borrower=user,
-            due_date=timezone.now().date() + timedelta(days=14)  # 2 weeks
-        )
-        
-        # Update book availability
-        book.available_copies -= 1
-        book.save()
-        
-        # Check for reservations and update if any
-        reservation = Reservation.objects.filter(
-            book=book, 
-            user=user, 
-            status='pending'
-        ).first()
-        
-        if reservation:
-            reservation.status = 'fulfilled'
-            reservation.save()
-        
+
+        try:
+            borrow_record = checkout(int(book_id), borrower, on_behalf=True)
+        except Book.DoesNotExist:
+            raise Http404
+        except CirculationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         serializer = BorrowRecordSerializer(borrow_record)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -331,32 +275,28 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check if user already has a pending reservation for this book
-        existing_reservation = Reservation.objects.filter(
-            book=book, 
-            user=user, 
-            status='pending'
-        ).exists()
-        
-        if existing_reservation:
+        # Create reservation; a second pending or ready one for the same
+        # book violates unique_active_reservation
+        try:
+            with transaction.atomic():
+                reservation = Reservation.objects.create(
+                    book=book,
+                    user=user,
+                    expiry_date=timezone.now() + timedelta(days=3)  # 3 days to fulfill
+                )
+        except IntegrityError:
             return Response(
-                {'error': 'You already have a pending reservation for this book.'},
+                {'error': 'You already have an active reservation for this book.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create reservation
-        reservation = Reservation.objects.create(
-            book=book,
-            user=user,
-            expiry_date=timezone.now() + timedelta(days=3)  # 3 days to fulfill
-        )
-        
         serializer = ReservationSerializer(reservation)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 class BorrowRecordViewSet(viewsets.ModelViewSet):
     serializer_class = BorrowRecordSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorOrPageNumberPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['is_returned', 'book', 'borrower']
     ordering_fields = ['borrow_date', 'due_date', 'return_date']
@@ -370,7 +310,7 @@ class BorrowRecordViewSet(viewsets.ModelViewSet):
         return BorrowRecord.objects.filter(borrower=user)
     
     def get_permissions(self):
-        if self.action in ['update', 'partial_update', 'destroy']:
+        if self.action in ['update', 'partial_update', 'destroy', 'batch_checkout', 'batch_return']:
             return [permissions.IsAuthenticated(), IsLibrarian()]
         return super().get_permissions()
     
@@ -392,113 +332,90 @@ class BorrowRecordViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
-        
-        # Check if book is available
-        book_id = data.get('book')
-        book = get_object_or_404(Book, id=book_id)
-        
-        if book.available_copies <= 0:
-            return Response(
-                {'error': 'No copies available for borrowing.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Check if user already has this book borrowed
-        borrower_id = data.get('borrower', request.user.id)
-        existing_borrow = BorrowRecord.objects.filter(
-            book=book, 
-            borrower_id=borrower_id, 
-            is_returned=False
-        ).exists()
-        
-        if existing_borrow:
-            return Response(
-                {'error': 'This user has already borrowed this book.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Check if user has too many borrowed books
-        max_books = 5
-        current_borrows = BorrowRecord.objects.filter(
-            borrower_id=borrower_id, 
-            is_returned=False
-        ).count()
-        
-        if current_borrows >= max_books:
-            return Response(
-                {'error': f'User can only borrow {max_books} books at a time.'},
-                status=status.HTTP_400_BAD_REQUEST
+
+        if request.user.user_type == 'student':
+            borrower = request.user
+        else:
+            borrower = get_object_or_404(User, pk=data['borrower'])
+
+        try:
+            borrow_record = checkout(
+                serializer.validated_data['book'].pk,
+                borrower,
+                due_date=serializer.validated_data.get('due_date'),
+                notes=serializer.validated_data.get('notes', ''),
+                on_behalf=borrower != request.user
             )
-        
-        # Check for overdue books
-        overdue_books = BorrowRecord.objects.filter(
-            borrower_id=borrower_id, 
-            is_returned=False,
-            due_date__lt=timezone.now().date()
-        ).exists()
-        
-        if overdue_books:
-            return Response(
-                {'error': 'User has overdue books. Please return them before borrowing new ones.'},
-                status=status.HTTP_400_BAD_REQUEST
+        except CirculationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = self.get_serializer(borrow_record).data
+        headers = self.get_success_headers(data)
+        return Response(data, status=status.HTTP_201_CREATED, headers=headers)
+        
+    @action(detail=False, methods=['post'], url_path='batch-checkout')
+    def batch_checkout(self, request):
+        """Check out a stack of books to one borrower in a single request"""
+        serializer = BatchCheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            results = checkout_many(
+                serializer.validated_data['borrower'],
+                serializer.validated_data['books'],
+                due_date=serializer.validated_data.get('due_date')
             )
-        
-        # Create borrow record
-        borrow_record = serializer.save()
-        
-        # Update book availability
-        book.available_copies -= 1
-        book.save()
-        
-        # Check for reservations and update if any
-        reservation = Reservation.objects.filter(
-            book=book, 
-            user_id=borrower_id, 
-            status='pending'
-        ).first()
-        
-        if reservation:
-            reservation.status = 'fulfilled'
-            reservation.save()
-        
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
-        
+        except CirculationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        for result in results:
+            if 'borrow_record' in result:
+                result['borrow_record'] = self.get_serializer(result['borrow_record']).data
+        borrowed = sum(1 for result in results if result['status'] == 'borrowed')
+
+        return Response({
+            'borrowed': borrowed,
+            'failed': len(results) - borrowed,
+            'results': results
+        }, status=status.HTTP_201_CREATED if borrowed else status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'])
     def return_book(self, request, pk=None):
-      borrow_record = self.get_object()
-      user = request.user
-    
-    # Check permissions
-      if user.user_type not in ['librarian', 'admin'] and borrow_record.borrower != user:
-        return Response(
-            {'error': 'You can only return your own books.'},
-            status=status.HTTP_403_FORBIDDEN
-        )
-    
-      if borrow_record.is_returned:
-        return Response(
-            {'error': 'This book has already been returned.'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    # Calculate fine before returning
-      borrow_record.calculate_fine()
-    
-    # Update borrow record
-      borrow_record.is_returned = True
-      borrow_record.return_date = timezone.now().date()
-      borrow_record.save()
-    
-    # Update book availability
-      book = borrow_record.book
-      book.available_copies += 1
-      book.save()
-    
-    # Fine record is already created by calculate_fine() if applicable
-    
-      serializer = self.get_serializer(borrow_record)
-      return Response(serializer.data)
+        borrow_record = self.get_object()
+        user = request.user
+
+        # Check permissions
+        if user.user_type not in ['librarian', 'admin'] and borrow_record.borrower != user:
+            return Response(
+                {'error': 'You can only return your own books.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        # Fine, record and availability are all updated by the return service
+        result, = return_many([borrow_record.pk])
+        if result['status'] != 'returned':
+            return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(result['record'])
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post'], url_path='batch-return')
+    def batch_return(self, request):
+        """Check in a batch of borrow records, e.g. when emptying the book drop"""
+        serializer = BatchReturnSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = return_many(serializer.validated_data['borrow_records'])
+        for result in results:
+            if 'record' in result:
+                result['record'] = self.get_serializer(result['record']).data
+        returned = sum(1 for result in results if result['status'] == 'returned')
+
+        return Response({
+            'returned': returned,
+            'failed': len(results) - returned,
+            'results': results
+        })
 
     
     @action(detail=False, methods=['get'])
@@ -555,14 +472,24 @@ class ReservationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if reservation.status != 'pending':
+        if reservation.status not in ('pending', 'ready'):
             return Response(
-                {'error': 'Only pending reservations can be cancelled.'},
+                {'error': 'Only pending or ready reservations can be cancelled.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        reservation.status = 'cancelled'
-        reservation.save()
+        with transaction.atomic():
+            # The status may have changed since it was read; decide again under the book's lock
+            lock_books([reservation.book_id])
+            if not leave_queue(reservation.pk, reservation.book_id, 'cancelled'):
+                if not Reservation.objects.filter(pk=reservation.pk, status='ready').update(status='cancelled'):
+                    return Response(
+                        {'error': 'Only pending or ready reservations can be cancelled.'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                # The held copy goes to the next in line, or back on the shelf
+                return_copies({reservation.book_id: 1})
+        reservation.refresh_from_db()
         
         serializer = self.get_serializer(reservation)
         return Response(serializer.data)
@@ -570,6 +497,7 @@ class ReservationViewSet(viewsets.ModelViewSet):
 class FineViewSet(viewsets.ModelViewSet):
     serializer_class = FineSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorOrPageNumberPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['is_paid', 'user']
     ordering_fields = ['amount', 'created_at']
@@ -621,6 +549,14 @@ class FineViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(fine)
         return Response(serializer.data)
 
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Status and progress of background jobs"""
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated, IsLibrarian]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['kind', 'status']
+
 class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -638,11 +574,23 @@ class NotificationViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(unread_notifications, many=True)
         return Response(serializer.data)
     
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path='unread-count',
+        # Trust the token's user id instead of loading the user: a cached
+        # count is then served without touching the database
+        authentication_classes=[JWTStatelessUserAuthentication]
+    )
+    def unread_count(self, request):
+        return Response({'unread_count': unread_count(request.user.id)})
+
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         notification = self.get_object()
+        if Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True):
+            adjust_unread_count(request.user.id, -1)
         notification.is_read = True
-        notification.save()
         
         serializer = self.get_serializer(notification)
         return Response(serializer.data)
@@ -653,6 +601,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
             user=request.user, 
             is_read=False
         ).update(is_read=True)
+        reset_unread_count(request.user.id)
         
         return Response({'status': 'all notifications marked as read'})
 
@@ -724,28 +673,16 @@ def dashboard_stats(request):
             status=status.HTTP_403_FORBIDDEN
         )
     
-    # Calculate statistics
-    total_books = Book.objects.count()
-    available_books = Book.objects.filter(available_copies__gt=0).count()
-    active_borrows = BorrowRecord.objects.filter(is_returned=False).count()
-    overdue_books = BorrowRecord.objects.filter(
-        is_returned=False, 
-        due_date__lt=timezone.now().date()
-    ).count()
-    total_users = User.objects.count()
-    
-    # Calculate pending fines
-    pending_fines = Fine.objects.filter(is_paid=False).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
-    
+    # Read from the cached DailyStats rollup instead of counting every table
+    figures = dashboard_rollup()
     stats = {
-        'totalBooks': total_books,
-        'activeBorrows': active_borrows,
-        'availableBooks': available_books,
-        'overdueBooks': overdue_books,
-        'totalUsers': total_users,
-        'pendingFines': float(pending_fines)
+        'totalBooks': figures['totalBooks'],
+        'activeBorrows': figures['activeBorrows'],
+        'availableBooks': figures['availableBooks'],
+        'overdueBooks': figures['overdueBooks'],
+        'totalUsers': figures['totalUsers'],
+        'pendingFines': figures['pendingFines'],
+        'as_of': figures['as_of']
     }
     
     return Response(stats)
@@ -848,55 +785,51 @@ def personal_stats(request):
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated, IsLibrarian])
 def impose_overdue_fines(request):
-    """Manually trigger overdue fines check"""
+    """Start an overdue fines run in the background; poll /jobs/<id>/ for progress"""
+    incremental = str(request.data.get('incremental', '')).lower() in ('1', 'true', 'yes')
     try:
-        from django.core.management import call_command
-        from io import StringIO
-        import sys
-        
-        # Capture command output
-        old_stdout = sys.stdout
-        sys.stdout = StringIO()
-        
-        call_command('check_overdue_fines')
-        
-        output = sys.stdout.getvalue()
-        sys.stdout = old_stdout
-        
-        return Response({
-            'message': 'Overdue fines check completed',
-            'output': output
-        }, status=status.HTTP_200_OK)
-        
-    except Exception as e:
+        job = submit_job('overdue_fines', user=request.user, params={'incremental': incremental})
+    except JobAlreadyActive as e:
         return Response(
-            {'error': f'Error checking overdue fines: {str(e)}'},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {'error': str(e), 'job': JobSerializer(e.job).data},
+            status=status.HTTP_409_CONFLICT
         )
+    return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated, IsAdmin])
+def task_metrics_view(request):
+    """Runs, failures and timings of the background tasks"""
+    return Response(task_metrics())
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def get_overdue_books(request):
-    """Get list of overdue books with fines"""
+    """
+    Get list of overdue books with their current fines.
+
+    Read-only: days overdue and the fine as of today are computed in SQL.
+    Fines are only persisted by the fine engine (check_overdue_fines).
+    """
     user = request.user
-    
-    if user.user_type in ['librarian', 'admin']:
-        overdue_records = BorrowRecord.objects.filter(
-            is_returned=False,
-            due_date__lt=timezone.now().date()
-        ).select_related('book', 'borrower')
-    else:
-        overdue_records = BorrowRecord.objects.filter(
-            borrower=user,
-            is_returned=False,
-            due_date__lt=timezone.now().date()
-        ).select_related('book')
-    
+    today = timezone.now().date()
+
+    overdue_records = BorrowRecord.objects.filter(
+        is_returned=False,
+        due_date__lt=today
+    ).select_related('book', 'borrower').annotate(
+        days_overdue=DaysOverdue('due_date', today),
+        current_fine=fine_expression(today)
+    ).order_by('due_date', 'id')
+
+    if user.user_type not in ['librarian', 'admin']:
+        overdue_records = overdue_records.filter(borrower=user)
+
+    paginator = CursorOrPageNumberPagination()
+    page = paginator.paginate_queryset(overdue_records, request)
+
     result = []
-    for record in overdue_records:
-        # Ensure fine is calculated
-        record.calculate_fine()
-        
+    for record in page:
         result.append({
             'id': record.id,
             'book_title': record.book.title,
@@ -904,9 +837,31 @@ def get_overdue_books(request):
             'borrower_name': record.borrower.username,
             'borrow_date': record.borrow_date,
             'due_date': record.due_date,
-            'days_overdue': (timezone.now().date() - record.due_date).days,
-            'fine_amount': float(record.fine_amount),
+            'days_overdue': record.days_overdue,
+            'fine_amount': float(record.current_fine),
             'is_returned': record.is_returned
         })
     
-    return Response(result)
\ No newline at end of file
+    return paginator.get_paginated_response(result)
+
+
+async def event_stream(request):
+    """
+    Server-Sent Events: the user's new notifications and book availability
+    changes. Needs the ASGI server (lms_api.asgi). EventSource can't send
+    headers, so the access token may also come as `?token=`.
+    """
+    header = request.headers.get('Authorization', '')
+    raw_token = request.GET.get('token') or (header[7:] if header.startswith('Bearer ') else '')
+    try:
+        user_id = AccessToken(raw_token)[jwt_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return JsonResponse({'error': 'Invalid or expired token'}, status=401)
+
+    response = StreamingHttpResponse(
+        sse_messages([user_channel(user_id), BOOKS_CHANNEL]),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
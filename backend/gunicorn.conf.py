@@ -27,6 +27,14 @@ user = None
 group = None
 tmp_upload_dir = None
 
+# Load in-process indexes once per worker instead of on the first request
+def post_worker_init(worker):
+    from core.autocomplete import book_index
+    book_index.load()
+
+    from core.scheduler import autostart
+    autostart()
+
 # SSL (uncomment if using SSL)
 # keyfile = "/path/to/your/ssl/key.pem"
 # certfile = "/path/to/your/ssl/cert.pem"
\ No newline at end of file
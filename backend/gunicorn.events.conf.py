@@ -0,0 +1,19 @@
+# Server-Sent Events (/api/events/), served by async workers; see docker-compose.prod.yml.
+# Kept apart from gunicorn.conf.py so these workers don't load the autocomplete
+# index or start the scheduler, which only the API workers need.
+
+# Server socket
+bind = "0.0.0.0:8001"
+
+# Worker processes
+workers = 2
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 0  # Streams stay open indefinitely
+
+# Logging
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+# Process naming
+proc_name = "lms_api_events"
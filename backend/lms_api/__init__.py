@@ -1 +1,4 @@
-# Empty file - indicates this is a Python package
\ No newline at end of file
+# Load the Celery app whenever Django starts so @task functions register with it
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -0,0 +1,13 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lms_api.settings')
+
+app = Celery('lms_api')
+
+# All CELERY_* settings in settings.py configure the app
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Loads tasks.py from every installed app
+app.autodiscover_tasks()
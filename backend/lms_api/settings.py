@@ -193,9 +193,48 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@library.com')
 
+# Cache - shared Redis cache in production, per-process memory otherwise
+CACHE_URL = config('CACHE_URL', default='')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# How often each worker checks whether another worker changed the autocomplete index
+AUTOCOMPLETE_SYNC_SECONDS = config('AUTOCOMPLETE_SYNC_SECONDS', default=5, cast=int)
+
+# Pub/sub for the /api/events/ stream: Redis when set, otherwise in-process (single worker only)
+EVENTS_BROKER_URL = config('EVENTS_BROKER_URL', default='')
+
+# Cached unread-notification counters expire after this long and are recounted from the database
+UNREAD_COUNT_TTL = config('UNREAD_COUNT_TTL', default=900, cast=int)
+
 # Celery configuration
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://localhost:6379/0')
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Where core.background tasks run: 'celery', 'thread' (in-process pool) or 'immediate' (inline)
+TASK_BACKEND = config('TASK_BACKEND', default='thread')
+TASK_THREAD_WORKERS = config('TASK_THREAD_WORKERS', default=4, cast=int)
+
+# Periodic jobs (core.scheduler). Either run `manage.py run_scheduler` or let
+# every gunicorn worker run the loop; a lease per job keeps runs single
+SCHEDULER_AUTOSTART = config('SCHEDULER_AUTOSTART', default=False, cast=bool)
+SCHEDULER_INTERVAL = config('SCHEDULER_INTERVAL', default=30, cast=int)
+
+# Dashboard figures are shared through the cache for this long (seconds)
+DASHBOARD_CACHE_TTL = config('DASHBOARD_CACHE_TTL', default=30, cast=int)
 
 # Logging configuration for production
 LOGGING = {
@@ -0,0 +1,79 @@
+from django.db.models import (
+    Count, DecimalField, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value
+)
+from django.db.models.functions import Coalesce, NullIf
+from rest_framework.pagination import PageNumberPagination
+
+from core.models import Book, BorrowRecord, Fine, Reservation, User
+
+USER_ACTIVITY_COLUMNS = (
+    'id', 'username', 'email', 'user_type', 'date_joined',
+    'total_borrows', 'active_borrows', 'total_fines', 'total_reservations'
+)
+BOOK_UTILIZATION_COLUMNS = (
+    'id', 'title', 'author', 'total_copies', 'available_copies',
+    'total_borrows', 'current_borrows', 'utilization_rate'
+)
+USER_ACTIVITY_ORDERING = (
+    'total_borrows', 'active_borrows', 'total_fines', 'total_reservations', 'username', 'date_joined'
+)
+BOOK_UTILIZATION_ORDERING = (
+    'utilization_rate', 'total_borrows', 'current_borrows', 'title', 'author', 'total_copies'
+)
+
+
+class ReportPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+def per_row(queryset, key, aggregate, output_field):
+    """
+    Correlated subquery of `aggregate` over `queryset` rows whose `key` is
+    the outer row, 0 when there are none. Each one is an indexed lookup on
+    the foreign key, so the report never joins two one-to-many relations
+    into the same row set.
+    """
+    subquery = (
+        queryset.filter(**{key: OuterRef('pk')}).order_by().values(key)
+        .annotate(total=aggregate).values('total')[:1]
+    )
+    return Coalesce(Subquery(subquery), Value(0), output_field=output_field)
+
+
+def user_activity():
+    return User.objects.annotate(
+        total_borrows=per_row(BorrowRecord.objects, 'borrower', Count('pk'), IntegerField()),
+        active_borrows=per_row(BorrowRecord.objects.filter(is_returned=False), 'borrower', Count('pk'), IntegerField()),
+        total_fines=per_row(
+            Fine.objects.filter(is_paid=False), 'user', Sum('amount'), DecimalField(max_digits=10, decimal_places=2)
+        ),
+        total_reservations=per_row(Reservation.objects, 'user', Count('pk'), IntegerField()),
+    ).values(*USER_ACTIVITY_COLUMNS)
+
+
+def book_utilization():
+    return Book.objects.annotate(
+        total_borrows=per_row(BorrowRecord.objects, 'book', Count('pk'), IntegerField()),
+        current_borrows=per_row(BorrowRecord.objects.filter(is_returned=False), 'book', Count('pk'), IntegerField()),
+    ).annotate(
+        # Borrows per copy, as a percentage; null for a book with no copies
+        utilization_rate=ExpressionWrapper(
+            F('total_borrows') * Value(100.0) / NullIf(F('total_copies'), 0), output_field=FloatField()
+        ),
+    ).values(*BOOK_UTILIZATION_COLUMNS)
+
+
+def ordered(queryset, ordering, allowed, default):
+    """
+    Sort by `ordering` (a field, '-' for descending) if it is in `allowed`,
+    else by `default`; the id breaks ties so pages don't overlap. Returns
+    None for an ordering that isn't allowed.
+    """
+    ordering = ordering or default
+    if ordering.lstrip('-') not in allowed:
+        return None
+    field = ordering.lstrip('-')
+    if ordering.startswith('-'):
+        return queryset.order_by(F(field).desc(nulls_last=True), '-id')
+    return queryset.order_by(F(field).asc(nulls_last=True), 'id')
@@ -0,0 +1,138 @@
+import csv
+import json
+import zlib
+from datetime import date
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.text import slugify
+
+from core.models import Book, BorrowRecord, User
+
+# report type -> (queryset factory, exported columns)
+EXPORTS = {
+    'users': (
+        lambda: User.objects.all(),
+        ('username', 'email', 'user_type', 'date_joined', 'is_active'),
+    ),
+    'books': (
+        lambda: Book.objects.all(),
+        ('title', 'author', 'isbn', 'genre', 'total_copies', 'available_copies'),
+    ),
+    'transactions': (
+        lambda: BorrowRecord.objects.all(),
+        ('book__title', 'borrower__username', 'borrow_date', 'due_date', 'return_date', 'is_returned', 'fine_amount'),
+    ),
+}
+
+# report type -> (date field for ?since= / ?until=, fields matched exactly)
+FILTERS = {
+    'users': ('date_joined__date', ('user_type', 'is_active')),
+    'books': ('created_at__date', ('genre',)),
+    'transactions': ('borrow_date', ('is_returned',)),
+}
+BOOLEAN_VALUES = {'true': True, '1': True, 'false': False, '0': False}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+CHUNK_SIZE = 2000  # Rows fetched per round trip
+FLUSH_BYTES = 64 * 1024  # Output buffered before each chunk is sent
+
+
+class ExportFilterError(ValueError):
+    """A filter an export doesn't support, or a value it can't use"""
+
+
+def export_filters(report_type, params):
+    """
+    The queryset filters for an export from request parameters: `since`
+    and `until` (ISO dates, inclusive) on the report's date field, and the
+    report's exact-match fields. Unknown parameters are ignored.
+    """
+    date_field, exact_fields = FILTERS[report_type]
+    filters = {}
+    for param, lookup in (('since', 'gte'), ('until', 'lte')):
+        if params.get(param):
+            try:
+                filters[f'{date_field}__{lookup}'] = date.fromisoformat(params[param])
+            except ValueError:
+                raise ExportFilterError(f'{param} must be a date (YYYY-MM-DD).')
+    for field in exact_fields:
+        value = params.get(field)
+        if value in (None, ''):
+            continue
+        if field.startswith('is_'):
+            if value.lower() not in BOOLEAN_VALUES:
+                raise ExportFilterError(f'{field} must be true or false.')
+            value = BOOLEAN_VALUES[value.lower()]
+        filters[field] = value
+    return filters
+
+
+def export_rows(report_type, filters=None):
+    """Values queryset for an export, or None for an unknown report type"""
+    if report_type not in EXPORTS:
+        return None
+    queryset, columns = EXPORTS[report_type]
+    return queryset().filter(**(filters or {})).order_by('pk').values(*columns)
+
+
+def export_filename(report_type, params, fmt, compress=False, names=None):
+    """
+    Download name naming the filters in `params` (already validated by
+    export_filters), e.g. transactions_since-2024-01-01_is_returned-false_20240301.csv.gz.
+    `names` lists the parameters to include, by default the export's filters.
+    """
+    parts = [report_type]
+    for param in names or ('since', 'until', *FILTERS[report_type][1]):
+        value = params.get(param)
+        if value not in (None, ''):
+            parts.append(f'{param}-{slugify(value)}')
+    parts.append(f'{timezone.localdate():%Y%m%d}')
+    name = '_'.join(parts) + '.' + FORMATS[fmt][1]
+    return name + '.gz' if compress else name
+
+
+class Line:
+    """File-like target for csv.writer that hands back what was written"""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(rows, columns, fmt):
+    """Encode rows one line at a time, as CSV (with a header) or JSON Lines"""
+    if fmt == 'csv':
+        writer = csv.writer(Line())
+        yield writer.writerow(columns)
+        for row in rows.iterator(chunk_size=CHUNK_SIZE):
+            yield writer.writerow([row[column] for column in columns])
+    else:
+        for row in rows.iterator(chunk_size=CHUNK_SIZE):
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_chunks(rows, columns, fmt, compress=False):
+    """
+    The encoded export as byte chunks of about FLUSH_BYTES, gzipped on the
+    fly if `compress`. Rows are fetched CHUNK_SIZE at a time, so memory
+    stays flat however many there are.
+    """
+    gzip = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+    buffer = []
+    size = 0
+    for line in export_lines(rows, columns, fmt):
+        data = line.encode('utf-8')
+        if gzip:
+            data = gzip.compress(data)
+        buffer.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if gzip:
+        buffer.append(gzip.flush())
+    if buffer:
+        yield b''.join(buffer)
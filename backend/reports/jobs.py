@@ -0,0 +1,145 @@
+"""
+Report jobs.
+
+A report too heavy for a request is submitted as a core.jobs Job of kind
+'report' and written by a background worker as a gzipped CSV or JSON Lines
+file to media storage. The job key is a digest of the report, its
+parameters and a fingerprint of the tables it reads, so a request for the
+same report over unchanged data gets the finished file back, and identical
+requests made while it is still running share that one job.
+"""
+import hashlib
+import json
+import tempfile
+import time
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max
+
+from core.jobs import JobAlreadyActive, job_handler, submit_job
+from core.models import Book, BorrowRecord, Fine, Job, Reservation, User
+from . import activity, exports
+
+JOB_KIND = 'report'
+HEARTBEAT_SECONDS = 5  # Progress is reported at most this often while writing
+
+# Per table, the newest row and the latest change, both read from the end
+# of an index, so fingerprinting a report costs the same however large the
+# tables grow. Writes that skip save() set updated_at themselves.
+TABLE_FINGERPRINTS = {
+    'users': lambda: User.objects.aggregate(last=Max('pk'), updated=Max('updated_at')),
+    'books': lambda: Book.objects.aggregate(last=Max('pk'), updated=Max('updated_at')),
+    'loans': lambda: BorrowRecord.objects.aggregate(last=Max('pk'), updated=Max('updated_at')),
+    'fines': lambda: Fine.objects.aggregate(last=Max('pk'), updated=Max('updated_at')),
+    'reservations': lambda: Reservation.objects.aggregate(last=Max('pk')),
+}
+
+
+def activity_source(queryset, columns, allowed, default):
+    def rows(params):
+        ordered = activity.ordered(queryset(), params.get('ordering'), allowed, default)
+        if ordered is None:
+            raise exports.ExportFilterError(f"ordering must be one of: {', '.join(allowed)}")
+        return ordered
+    return rows, columns, ('ordering',)
+
+
+def export_source(report_type):
+    def rows(params):
+        return exports.export_rows(report_type, exports.export_filters(report_type, params))
+    return rows, exports.EXPORTS[report_type][1], ('since', 'until', *exports.FILTERS[report_type][1])
+
+
+# report -> (rows from params, columns, accepted params, tables read)
+REPORTS = {
+    'user_activity': (
+        *activity_source(
+            activity.user_activity, activity.USER_ACTIVITY_COLUMNS,
+            activity.USER_ACTIVITY_ORDERING, '-total_borrows'
+        ),
+        ('users', 'loans', 'fines', 'reservations'),
+    ),
+    'book_utilization': (
+        *activity_source(
+            activity.book_utilization, activity.BOOK_UTILIZATION_COLUMNS,
+            activity.BOOK_UTILIZATION_ORDERING, '-utilization_rate'
+        ),
+        ('books', 'loans'),
+    ),
+    'users': (*export_source('users'), ('users',)),
+    'books': (*export_source('books'), ('books',)),
+    'transactions': (*export_source('transactions'), ('loans', 'books', 'users')),
+}
+
+
+def clean_params(report, params):
+    """The parameters `report` accepts, as strings, checked by building its queryset"""
+    rows, _, accepted, _ = REPORTS[report]
+    cleaned = {}
+    for name in accepted:
+        value = params.get(name)
+        if value in (None, ''):
+            continue
+        cleaned[name] = str(value).lower() if isinstance(value, bool) else str(value)
+    rows(cleaned)
+    return cleaned
+
+
+def result_key(report, fmt, params):
+    tables = REPORTS[report][3]
+    payload = {
+        'report': report,
+        'output': fmt,
+        'params': params,
+        'data': {table: TABLE_FINGERPRINTS[table]() for table in tables},
+    }
+    return hashlib.sha256(
+        json.dumps(payload, cls=DjangoJSONEncoder, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def submit_report(report, fmt='csv', params=None, user=None):
+    """
+    Start a report job, or find one that already covers the request.
+    Returns (job, reused): a finished job whose file is still there is
+    reused as is, and a queued or running job for the same key is shared.
+    Raises ValueError for an unknown report or output format and
+    ExportFilterError for parameters the report can't use.
+    """
+    if report not in REPORTS:
+        raise ValueError(f"report must be one of: {', '.join(REPORTS)}")
+    if fmt not in exports.FORMATS:
+        raise ValueError(f"output must be one of: {', '.join(exports.FORMATS)}")
+    params = clean_params(report, params or {})
+    key = result_key(report, fmt, params)
+
+    finished = Job.objects.filter(kind=JOB_KIND, key=key, status='succeeded').order_by('-finished_at').first()
+    if finished and default_storage.exists(finished.result['path']):
+        return finished, True
+    try:
+        job = submit_job(JOB_KIND, user=user, params={'report': report, 'output': fmt, 'filters': params}, key=key)
+    except JobAlreadyActive as e:
+        return e.job, True
+    return job, False
+
+
+@job_handler(JOB_KIND)
+def report_job(job, progress):
+    report, fmt = job.params['report'], job.params['output']
+    rows, columns, accepted, _ = REPORTS[report]
+    written = 0
+    reported_at = time.monotonic()
+    with tempfile.TemporaryFile() as output:
+        for chunk in exports.export_chunks(rows(job.params['filters']), columns, fmt, compress=True):
+            output.write(chunk)
+            written += len(chunk)
+            if time.monotonic() - reported_at >= HEARTBEAT_SECONDS:
+                progress({'bytes': written})
+                reported_at = time.monotonic()
+        output.seek(0)
+        path = default_storage.save(f'reports/{job.key}.{exports.FORMATS[fmt][1]}.gz', File(output))
+
+    filename = exports.export_filename(report, job.params['filters'], fmt, compress=True, names=accepted)
+    return {'path': path, 'size': written, 'filename': filename}
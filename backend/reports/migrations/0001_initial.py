@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('borrows', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('new_users', models.PositiveIntegerField(default=0)),
+                ('new_books', models.PositiveIntegerField(default=0)),
+                ('reservations', models.PositiveIntegerField(default=0)),
+                ('fines_paid', models.PositiveIntegerField(default=0)),
+                ('fines_paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_users', models.PositiveIntegerField(default=0)),
+                ('total_books', models.PositiveIntegerField(default=0)),
+                ('active_loans', models.IntegerField(default=0)),
+                ('available_books', models.PositiveIntegerField(blank=True, null=True)),
+                ('overdue_loans', models.PositiveIntegerField(blank=True, null=True)),
+                ('pending_reservations', models.PositiveIntegerField(blank=True, null=True)),
+                ('unpaid_fines', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'daily stats',
+                'ordering': ['date'],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import models
+
+
+class DailyStats(models.Model):
+    """
+    One day of library activity, rolled up by reports.rollup so dashboards
+    and trend reports read a handful of rows instead of scanning loans.
+
+    The activity columns count what happened that day. The running totals
+    are carried forward from the previous day. The snapshot columns hold
+    the open figures as of `updated_at`; days filled in by a backfill leave
+    them empty.
+    """
+    date = models.DateField(unique=True)
+
+    # Activity that day
+    borrows = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    new_users = models.PositiveIntegerField(default=0)
+    new_books = models.PositiveIntegerField(default=0)
+    reservations = models.PositiveIntegerField(default=0)
+    fines_paid = models.PositiveIntegerField(default=0)
+    fines_paid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    # Running totals at the end of the day
+    total_users = models.PositiveIntegerField(default=0)
+    total_books = models.PositiveIntegerField(default=0)
+    active_loans = models.IntegerField(default=0)
+
+    # Snapshot of the open figures when the row was last refreshed
+    available_books = models.PositiveIntegerField(null=True, blank=True)
+    overdue_loans = models.PositiveIntegerField(null=True, blank=True)
+    pending_reservations = models.PositiveIntegerField(null=True, blank=True)
+    unpaid_fines = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        verbose_name_plural = 'daily stats'
+
+    def __str__(self):
+        return f"Stats for {self.date}"
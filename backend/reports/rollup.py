@@ -0,0 +1,216 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Sum, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.caching import cached
+from core.models import Book, BorrowRecord, Fine, Reservation, User
+from .models import DailyStats
+
+ACTIVITY_COLUMNS = (
+    'borrows', 'returns', 'new_users', 'new_books', 'reservations', 'fines_paid', 'fines_paid_amount'
+)
+TOTAL_COLUMNS = ('total_users', 'total_books', 'active_loans')
+SNAPSHOT_COLUMNS = ('available_books', 'overdue_loans', 'pending_reservations', 'unpaid_fines')
+DASHBOARD_CACHE_KEY = 'reports:dashboard'
+REFRESH_LOCK_KEY = 'reports:rollup:refreshing'
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def daily_activity(start, end):
+    """
+    Activity per day from `start` to `end` inclusive, as {date: {column:
+    value}}. Every query is a range on an indexed date or datetime column
+    grouped by day, so its cost follows the activity in the range, not the
+    size of the tables.
+    """
+    days = defaultdict(dict)
+
+    def fold(column, rows):
+        for day, value in rows:
+            days[day][column] = value
+
+    def by_date(queryset, field):
+        return (
+            queryset.filter(**{f'{field}__gte': start, f'{field}__lte': end})
+            .order_by().values(field).annotate(n=Count('pk')).values_list(field, 'n')
+        )
+
+    def by_timestamp(queryset, field, value=Count('pk')):
+        return (
+            queryset.filter(**{f'{field}__gte': day_start(start), f'{field}__lt': day_start(end + timedelta(days=1))})
+            .annotate(day=TruncDate(field)).order_by().values('day').annotate(n=value).values_list('day', 'n')
+        )
+
+    fold('borrows', by_date(BorrowRecord.objects, 'borrow_date'))
+    fold('returns', by_date(BorrowRecord.objects.filter(is_returned=True), 'return_date'))
+    fold('new_users', by_timestamp(User.objects, 'date_joined'))
+    fold('new_books', by_timestamp(Book.objects, 'created_at'))
+    fold('reservations', by_timestamp(Reservation.objects, 'reservation_date'))
+    paid = Fine.objects.filter(is_paid=True)
+    fold('fines_paid', by_timestamp(paid, 'paid_date'))
+    fold('fines_paid_amount', by_timestamp(paid, 'paid_date', Sum('amount')))
+    return days
+
+
+def snapshot():
+    """
+    Today's open figures, which can't be summed from the day's activity, in
+    one statement: a UNION of one aggregate per table, each reading only
+    the open rows (unreturned loans past due, pending reservations, unpaid
+    fines) through their indexes, plus one count of the catalogue.
+    """
+    today = timezone.localdate()
+
+    def figure(name, queryset, value=Count('pk')):
+        # A constant isn't grouped by, so each part is one row over the whole set
+        return queryset.order_by().values(name=Value(name)).annotate(value=value).values_list('name', 'value')
+
+    figures = dict(
+        figure('available_books', Book.objects.filter(available_copies__gt=0)).union(
+            figure('overdue_loans', BorrowRecord.objects.filter(is_returned=False, due_date__lt=today)),
+            figure('pending_reservations', Reservation.objects.filter(status='pending')),
+            figure('unpaid_fines', Fine.objects.filter(is_paid=False), Sum('amount')),
+            all=True,
+        )
+    )
+    return {
+        'available_books': int(figures['available_books']),
+        'overdue_loans': int(figures['overdue_loans']),
+        'pending_reservations': int(figures['pending_reservations']),
+        'unpaid_fines': Decimal(str(figures['unpaid_fines'] or 0)),
+    }
+
+
+def first_activity_date():
+    dates = [
+        BorrowRecord.objects.aggregate(first=Min('borrow_date'))['first'],
+        *(
+            timezone.localtime(moment).date() if moment else None
+            for moment in (
+                User.objects.aggregate(first=Min('date_joined'))['first'],
+                Book.objects.aggregate(first=Min('created_at'))['first'],
+            )
+        ),
+    ]
+    return min((date for date in dates if date), default=None)
+
+
+def refresh_daily_stats(today=None, rebuild=False):
+    """
+    Fold new activity into DailyStats.
+
+    Each run starts at the last stored day, which may have been refreshed
+    part-way through, and recomputes it and every day since, carrying the
+    running totals forward from the day before by that day's activity, so
+    its cost follows the new activity rather than the size of the tables.
+    Today's row also gets a fresh snapshot of the open figures. With no
+    rows yet (or `rebuild`) every day since the first recorded activity is
+    rebuilt, which also corrects totals that drifted through deletions.
+    Returns the first day refreshed and the number of days written.
+    """
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        last = DailyStats.objects.order_by('-date').first()
+        if rebuild or last is None:
+            if rebuild:
+                DailyStats.objects.all().delete()
+            start = min(first_activity_date() or today, today)
+            previous = None
+        else:
+            start = min(last.date, today)
+            previous = DailyStats.objects.filter(date__lt=start).order_by('-date').first()
+
+        totals = {column: getattr(previous, column) if previous else 0 for column in TOTAL_COLUMNS}
+        activity = daily_activity(start, today)
+
+        rows = []
+        day = start
+        while day <= today:
+            counts = {column: activity[day].get(column) or 0 for column in ACTIVITY_COLUMNS}
+            totals['total_users'] += counts['new_users']
+            totals['total_books'] += counts['new_books']
+            totals['active_loans'] += counts['borrows'] - counts['returns']
+            rows.append(DailyStats(date=day, **counts, **totals))
+            day += timedelta(days=1)
+
+        now = timezone.now()
+        for row in rows:
+            row.updated_at = now
+        for key, value in snapshot().items():
+            setattr(rows[-1], key, value)
+
+        # Past days keep the snapshot they were last refreshed with
+        columns = [*ACTIVITY_COLUMNS, *TOTAL_COLUMNS, 'updated_at']
+        DailyStats.objects.bulk_create(
+            rows[:-1], update_conflicts=True, unique_fields=['date'], update_fields=columns
+        )
+        DailyStats.objects.bulk_create(
+            rows[-1:], update_conflicts=True, unique_fields=['date'], update_fields=[*columns, *SNAPSHOT_COLUMNS]
+        )
+    return {'start': start.isoformat(), 'days': len(rows)}
+
+
+def refresh_if_behind(latest):
+    """
+    Refresh the rollup when its `latest` row isn't today's: a fresh install,
+    no scheduler running, or the first read of a new day. Only one caller
+    at a time refreshes, the others read the rows as they are; returns
+    whether this one did.
+    """
+    if latest == timezone.localdate() or not cache.add(REFRESH_LOCK_KEY, 1, timeout=60):
+        return False
+    try:
+        refresh_daily_stats()
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+    return True
+
+
+def dashboard_stats(recent_days=7):
+    """
+    Figures for the dashboards, shared through the cache for
+    settings.DASHBOARD_CACHE_TTL seconds so a room full of admins
+    refreshing at once computes them once (see core.caching.cached).
+    """
+    return cached(
+        DASHBOARD_CACHE_KEY,
+        lambda: compute_dashboard_stats(recent_days),
+        ttl=getattr(settings, 'DASHBOARD_CACHE_TTL', 30),
+    )
+
+
+def compute_dashboard_stats(recent_days=7):
+    """
+    Figures for the dashboards from the latest DailyStats row and the
+    `recent_days` days before it. The scheduler keeps the rollup current;
+    when today's row is missing it is refreshed here once (see
+    refresh_if_behind), so a fresh install shows real figures rather than
+    zeros. `as_of` is when that row was last refreshed.
+    """
+    rows = list(DailyStats.objects.order_by('-date')[:recent_days + 1])
+    if refresh_if_behind(rows[0].date if rows else None):
+        rows = list(DailyStats.objects.order_by('-date')[:recent_days + 1])
+    current = rows[0] if rows else DailyStats(date=timezone.localdate())
+    recent = [row for row in rows if row.date >= current.date - timedelta(days=recent_days)]
+    return {
+        'totalUsers': current.total_users,
+        'totalBooks': current.total_books,
+        'activeBorrows': current.active_loans,
+        'availableBooks': current.available_books or 0,
+        'overdueBooks': current.overdue_loans or 0,
+        'pendingReservations': current.pending_reservations or 0,
+        'pendingFines': float(current.unpaid_fines or 0),
+        'recentBorrows': sum(row.borrows for row in recent),
+        'recentReturns': sum(row.returns for row in recent),
+        'as_of': current.updated_at.isoformat() if current.updated_at else None,
+    }
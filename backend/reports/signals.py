@@ -0,0 +1,12 @@
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from core.models import Job
+from .jobs import JOB_KIND
+
+
+@receiver(post_delete, sender=Job)
+def delete_report_file(sender, instance, **kwargs):
+    if instance.kind == JOB_KIND and instance.result and instance.result.get('path'):
+        default_storage.delete(instance.result['path'])
@@ -0,0 +1,14 @@
+from core.background import task
+from .rollup import refresh_daily_stats as refresh_rollup
+
+
+@task()
+def refresh_daily_stats(rebuild=False):
+    """Fold new activity into the DailyStats rollup (see reports.rollup)"""
+    return refresh_rollup(rebuild=rebuild)
+
+
+@task()
+def rebuild_daily_stats():
+    """Rebuild the DailyStats rollup, correcting running totals that drifted through deletions"""
+    return refresh_rollup(rebuild=True)
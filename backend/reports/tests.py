@@ -0,0 +1,424 @@
+import gzip
+import json
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from core.circulation import checkout, return_many
+from core.models import Book, BorrowRecord, Fine, Job, Reservation
+from .models import DailyStats
+from .rollup import DASHBOARD_CACHE_KEY, dashboard_stats, refresh_daily_stats, snapshot
+
+User = get_user_model()
+
+
+class DailyStatsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.localdate()
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123', user_type='librarian')
+        self.student = User.objects.create_user(username='student', password='testpass123', user_type='student')
+        self.books = [
+            Book.objects.create(
+                title=f'Book {number}',
+                author='Author',
+                isbn=f'978500000000{number}',
+                genre='fiction',
+                publication_date='2020-01-01',
+                publisher='Publisher',
+                total_copies=2,
+                available_copies=2,
+            )
+            for number in range(3)
+        ]
+        # Borrowed three days ago and returned yesterday; borrowed two days ago, now overdue
+        returned = checkout(self.books[0].pk, self.student)
+        return_many([returned.pk])
+        BorrowRecord.objects.filter(pk=returned.pk).update(
+            borrow_date=self.today - timedelta(days=3), return_date=self.today - timedelta(days=1)
+        )
+        overdue = checkout(self.books[1].pk, self.student)
+        BorrowRecord.objects.filter(pk=overdue.pk).update(
+            borrow_date=self.today - timedelta(days=2), due_date=self.today - timedelta(days=1)
+        )
+        Fine.objects.create(user=self.student, borrow_record=overdue, amount=1)
+
+    def test_backfill_then_incremental_refresh(self):
+        self.assertEqual(refresh_daily_stats(), {'start': (self.today - timedelta(days=3)).isoformat(), 'days': 4})
+        rows = list(DailyStats.objects.values_list('borrows', 'returns', 'active_loans'))
+        self.assertEqual(rows, [(1, 0, 1), (1, 0, 2), (0, 1, 1), (0, 0, 1)])
+        current = DailyStats.objects.get(date=self.today)
+        self.assertEqual((current.total_users, current.total_books), (2, 3))
+        self.assertEqual((current.overdue_loans, current.unpaid_fines), (1, 1))
+        self.assertIsNone(DailyStats.objects.get(date=self.today - timedelta(days=1)).overdue_loans)
+        with self.assertNumQueries(1):
+            self.assertEqual(snapshot(), {
+                'available_books': 3, 'overdue_loans': 1, 'pending_reservations': 0, 'unpaid_fines': Decimal('1'),
+            })
+
+        checkout(self.books[2].pk, self.librarian)
+        self.assertEqual(refresh_daily_stats(), {'start': self.today.isoformat(), 'days': 1})
+        current = DailyStats.objects.get(date=self.today)
+        self.assertEqual((current.borrows, current.active_loans, current.available_books), (1, 2, 3))
+
+    def test_running_totals_follow_the_activity(self):
+        Book.objects.filter(pk=self.books[2].pk).update(created_at=timezone.now() - timedelta(days=2))
+        refresh_daily_stats()
+        # Totals are carried forward by each day's activity, not recounted,
+        # until a rebuild picks up the deletion
+        self.books[2].delete()
+        refresh_daily_stats()
+        self.assertEqual(DailyStats.objects.get(date=self.today).total_books, 3)
+        refresh_daily_stats(rebuild=True)
+        self.assertEqual(DailyStats.objects.get(date=self.today).total_books, 2)
+
+    def test_dashboards_read_the_rollup(self):
+        refresh_daily_stats()
+        self.client.force_authenticate(self.librarian)
+        response = self.client.get(reverse('dashboard-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        as_of = response.data.pop('as_of')
+        self.assertEqual(response.data, {
+            'totalBooks': 3,
+            'activeBorrows': 1,
+            'availableBooks': 3,
+            'overdueBooks': 1,
+            'totalUsers': 2,
+            'pendingFines': 1.0,
+        })
+
+        # Served from the cache until it expires, then from the rollup rows
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('dashboard-stats')).data['as_of'], as_of)
+        cache.delete(DASHBOARD_CACHE_KEY)
+        with self.assertNumQueries(1):
+            self.client.get(reverse('dashboard-stats'))
+
+    def test_fresh_install_shows_real_figures(self):
+        self.client.force_authenticate(self.librarian)
+        response = self.client.get(reverse('dashboard-stats'))
+        self.assertEqual((response.data['totalBooks'], response.data['overdueBooks']), (3, 1))
+        self.assertTrue(DailyStats.objects.filter(date=self.today).exists())
+
+        DailyStats.objects.all().delete()
+        self.client.force_authenticate(User.objects.create_user(
+            username='admin', password='testpass123', user_type='admin', is_staff=True
+        ))
+        response = self.client.get(reverse('borrowing_trends'), {'start': (self.today - timedelta(days=3)).isoformat()})
+        self.assertEqual([row['borrows'] for row in response.data], [1, 1, 0, 0])
+
+    def test_dashboards_refresh_only_a_rollup_that_is_behind(self):
+        # Last refreshed yesterday: today's row is filled in once
+        refresh_daily_stats(today=self.today - timedelta(days=1))
+        self.assertEqual(dashboard_stats()['totalBooks'], 3)
+        self.assertTrue(DailyStats.objects.filter(date=self.today).exists())
+
+        # Up to date: the rows are read as they are
+        cache.delete(DASHBOARD_CACHE_KEY)
+        with self.assertNumQueries(1):
+            dashboard_stats()
+
+    def test_one_refresh_while_the_cache_is_being_filled(self):
+        stale = {'value': {'as_of': 'stale'}, 'fresh_until': 0}
+        cache.set(DASHBOARD_CACHE_KEY, stale)
+        cache.add(DASHBOARD_CACHE_KEY + ':refreshing', 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(dashboard_stats()['as_of'], 'stale')
+
+        cache.delete(DASHBOARD_CACHE_KEY + ':refreshing')
+        self.assertNotEqual(dashboard_stats()['as_of'], 'stale')
+
+
+class BorrowingTrendsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(
+            username='admin', password='testpass123', user_type='admin', is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        self.today = timezone.localdate()
+        # Activity on 2024-01-30 (Tue), 2024-02-01 (Thu) and 2024-02-12 (Mon), then today
+        for day, borrows in [(date(2024, 1, 30), 2), (date(2024, 2, 1), 3), (date(2024, 2, 12), 4), (self.today, 1)]:
+            DailyStats.objects.create(date=day, borrows=borrows, returns=1)
+
+    def trend(self, **params):
+        response = self.client.get(reverse('borrowing_trends'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(row['date'], row['borrows']) for row in response.data]
+
+    def test_granularities_are_gap_filled(self):
+        self.assertEqual(
+            self.trend(start='2024-01-30', end='2024-02-02'),
+            [('2024-01-30', 2), ('2024-01-31', 0), ('2024-02-01', 3), ('2024-02-02', 0)]
+        )
+        self.assertEqual(
+            self.trend(granularity='week', start='2024-01-31', end='2024-02-18'),
+            [('2024-01-29', 5), ('2024-02-05', 0), ('2024-02-12', 4)]
+        )
+        self.assertEqual(
+            self.trend(granularity='month', start='2023-12-15', end='2024-02-29'),
+            [('2023-12-01', 0), ('2024-01-01', 2), ('2024-02-01', 7)]
+        )
+
+    def test_closed_periods_are_cached(self):
+        params = {'granularity': 'month', 'start': '2024-01-01', 'end': self.today.isoformat()}
+        first = self.trend(**params)
+        self.assertEqual(first[-1], (self.today.replace(day=1).isoformat(), 1))
+
+        DailyStats.objects.filter(date=date(2024, 2, 12)).update(borrows=40)
+        DailyStats.objects.filter(date=self.today).update(borrows=5)
+        second = self.trend(**params)
+        self.assertEqual(second[1], ('2024-02-01', 7))
+        self.assertEqual(second[-1][1], 5)
+
+    def test_invalid_parameters(self):
+        url = reverse('borrowing_trends')
+        for params in ({'granularity': 'year'}, {'start': 'soon'}, {'start': '2024-02-01', 'end': '2024-01-01'}):
+            self.assertEqual(self.client.get(url, params).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityReportsTestCase(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='admin', password='testpass123', user_type='admin', is_staff=True
+        )
+        self.reader = User.objects.create_user(username='reader', password='testpass123', user_type='student')
+        self.client.force_authenticate(self.admin)
+        self.books = [
+            Book.objects.create(
+                title=f'Book {number}',
+                author='Author',
+                isbn=f'978600000000{number}',
+                genre='fiction',
+                publication_date='2020-01-01',
+                publisher='Publisher',
+                total_copies=number + 1,
+                available_copies=number + 1,
+            )
+            for number in range(3)
+        ]
+        due = timezone.localdate() + timedelta(days=14)
+        # Three loans, two fines and two reservations for one reader, which
+        # a three-way join would multiply into 12 rows
+        records = BorrowRecord.objects.bulk_create([
+            BorrowRecord(book=self.books[0], borrower=self.reader, due_date=due, is_returned=True),
+            BorrowRecord(book=self.books[0], borrower=self.reader, due_date=due, is_returned=True),
+            BorrowRecord(book=self.books[1], borrower=self.reader, due_date=due),
+        ])
+        Fine.objects.create(user=self.reader, borrow_record=records[0], amount='2.00')
+        Fine.objects.create(user=self.reader, borrow_record=records[1], amount='3.50')
+        Fine.objects.create(user=self.reader, amount='10.00', is_paid=True)
+        Reservation.objects.create(user=self.reader, book=self.books[1])
+        Reservation.objects.create(user=self.reader, book=self.books[2])
+
+    def test_user_activity_totals(self):
+        response = self.client.get(reverse('user_activity_report'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        reader, admin = response.data['results']
+        self.assertEqual(reader['username'], 'reader')
+        self.assertEqual(
+            (reader['total_borrows'], reader['active_borrows'], reader['total_fines'], reader['total_reservations']),
+            (3, 1, Decimal('5.50'), 2)
+        )
+        self.assertEqual((admin['total_borrows'], admin['total_fines'], admin['total_reservations']), (0, 0, 0))
+
+    def test_book_utilization_totals(self):
+        response = self.client.get(reverse('book_utilization_report'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = {row['title']: row for row in response.data['results']}
+        self.assertEqual(
+            [row['title'] for row in response.data['results']], ['Book 0', 'Book 1', 'Book 2']
+        )
+        self.assertEqual((rows['Book 0']['total_borrows'], rows['Book 0']['current_borrows']), (2, 0))
+        self.assertAlmostEqual(rows['Book 0']['utilization_rate'], 200.0)
+        self.assertAlmostEqual(rows['Book 1']['utilization_rate'], 50.0)
+        self.assertEqual(rows['Book 1']['current_borrows'], 1)
+        self.assertEqual(rows['Book 2']['utilization_rate'], 0)
+
+    def test_sorting_and_paging(self):
+        url = reverse('book_utilization_report')
+        response = self.client.get(url, {'ordering': 'total_copies', 'page_size': 2})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([row['title'] for row in response.data['results']], ['Book 0', 'Book 1'])
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(url, {'ordering': 'total_copies', 'page_size': 2, 'page': 2})
+        self.assertEqual([row['title'] for row in response.data['results']], ['Book 2'])
+
+        response = self.client.get(url, {'ordering': 'isbn'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StreamingExportTestCase(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='admin', password='testpass123', user_type='admin', is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        reader = User.objects.create_user(username='reader', password='testpass123', user_type='student')
+        book = Book.objects.create(
+            title='Dune, Part One', author='Herbert', isbn='9787000000000', genre='fiction',
+            publication_date='2020-01-01', publisher='Publisher', total_copies=3, available_copies=3,
+        )
+        due = timezone.localdate() + timedelta(days=14)
+        BorrowRecord.objects.bulk_create([
+            BorrowRecord(book=book, borrower=reader, due_date=due, is_returned=True),
+            BorrowRecord(book=book, borrower=self.admin, due_date=due),
+        ])
+
+    def export(self, report_type, **params):
+        response = self.client.get(reverse('export_report', args=[report_type]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_with_filters(self):
+        response, body = self.export('transactions', is_returned='false', since='2020-01-01')
+        lines = body.decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'book__title,borrower__username,borrow_date,due_date,return_date,is_returned,fine_amount')
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('"Dune, Part One",admin,'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="transactions_since-2020-01-01_is_returned-false_{timezone.localdate():%Y%m%d}.csv"'
+        )
+
+    def test_ndjson_gzipped_in_small_chunks(self):
+        with patch('reports.exports.FLUSH_BYTES', 1), patch('reports.exports.CHUNK_SIZE', 1):
+            response, body = self.export('users', output='ndjson', gzip='1')
+            chunks = list(self.client.get(
+                reverse('export_report', args=['users']), {'output': 'ndjson'}
+            ).streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.ndjson.gz"'))
+        rows = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        self.assertEqual([row['username'] for row in rows], ['admin', 'reader'])
+        self.assertEqual(len(chunks), 2)
+
+    def test_invalid_parameters(self):
+        for report_type, params in (
+            ('loans', {}), ('users', {'output': 'xlsx'}), ('users', {'since': 'soon'}),
+            ('transactions', {'is_returned': 'maybe'}),
+        ):
+            response = self.client.get(reverse('export_report', args=[report_type]), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(TASK_BACKEND='immediate')
+class ReportJobTestCase(APITestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.admin = User.objects.create_user(
+            username='admin', password='testpass123', user_type='admin', is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        for number in range(3):
+            User.objects.create_user(username=f'reader{number}', password='testpass123', user_type='student')
+
+    def submit(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('submit_report_job'), data, format='json')
+
+    def test_job_result_is_downloaded_with_ranges(self):
+        response = self.submit(report='users', output='ndjson', user_type='student')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = self.client.get(reverse('report_job_detail', args=[response.data['id']])).data
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertTrue(job['download'].endswith(reverse('report_job_download', args=[job['id']])))
+
+        download = self.client.get(reverse('report_job_download', args=[job['id']]))
+        self.assertEqual(download['Accept-Ranges'], 'bytes')
+        self.assertTrue(download['Content-Disposition'].endswith('user_type-student_%s.ndjson.gz"' % f'{timezone.localdate():%Y%m%d}'))
+        body = b''.join(download.streaming_content)
+        rows = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        self.assertEqual([row['username'] for row in rows], ['reader0', 'reader1', 'reader2'])
+
+        url = reverse('report_job_download', args=[job['id']])
+        partial = self.client.get(url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(partial.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(partial['Content-Range'], f'bytes 0-9/{len(body)}')
+        self.assertEqual(b''.join(partial.streaming_content), body[:10])
+        tail = self.client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(b''.join(tail.streaming_content), body[10:])
+        suffix = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(suffix.streaming_content), body[-5:])
+        outside = self.client.get(url, HTTP_RANGE=f'bytes={len(body)}-')
+        self.assertEqual(outside.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(outside['Content-Range'], f'bytes */{len(body)}')
+
+    def test_csv_export_is_written_to_media_storage(self):
+        User.objects.create_user(username='reader', email='reader@library.com', password='testpass123')
+        response = self.submit(report='users', since='2000-01-01')
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertTrue(job.result['path'].startswith('reports/'))
+        with default_storage.open(job.result['path']) as export:
+            lines = gzip.decompress(export.read()).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'username,email,user_type,date_joined,is_active')
+        self.assertIn('reader,reader@library.com,student,', '\n'.join(lines))
+
+    def test_results_are_reused_until_the_data_changes(self):
+        first = self.submit(report='user_activity', ordering='username')
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+
+        again = self.submit(report='user_activity', ordering='username')
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertEqual(again.data['id'], first.data['id'])
+
+        other = self.submit(report='user_activity', ordering='-username')
+        self.assertNotEqual(other.data['id'], first.data['id'])
+
+        User.objects.create_user(username='newcomer', password='testpass123')
+        changed = self.submit(report='user_activity', ordering='username')
+        self.assertEqual(changed.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(changed.data['id'], first.data['id'])
+
+        # Editing a user changes the fingerprint as well
+        users = self.submit(report='users', user_type='student')
+        User.objects.filter(username='reader0').update(user_type='librarian', updated_at=timezone.now())
+        edited = self.submit(report='users', user_type='student')
+        self.assertEqual(edited.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(edited.data['id'], users.data['id'])
+
+        # So does a checkout, which changes availability without save()
+        book = Book.objects.create(
+            title='Book', author='Author', isbn='9787000000000', genre='fiction',
+            publication_date='2020-01-01', publisher='Publisher', total_copies=2, available_copies=2,
+        )
+        books = self.submit(report='books')
+        checkout(book.pk, User.objects.get(username='reader1'))
+        borrowed = self.submit(report='books')
+        self.assertEqual(borrowed.status_code, status.HTTP_202_ACCEPTED)
+        self.assertNotEqual(borrowed.data['id'], books.data['id'])
+
+        path = Job.objects.get(pk=first.data['id']).result['path']
+        self.assertTrue(default_storage.exists(path))
+        Job.objects.filter(pk=first.data['id']).delete()
+        self.assertFalse(default_storage.exists(path))
+
+    def test_identical_requests_share_the_running_job(self):
+        response = self.client.post(reverse('submit_report_job'), {'report': 'books'}, format='json')
+        again = self.client.post(reverse('submit_report_job'), {'report': 'books'}, format='json')
+        self.assertEqual(again.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(again.data['id'], response.data['id'])
+        self.assertEqual(Job.objects.filter(kind='report').count(), 1)
+
+    def test_invalid_requests(self):
+        for data in ({'report': 'loans'}, {'report': 'users', 'output': 'xlsx'},
+                     {'report': 'book_utilization', 'ordering': 'isbn'}, {'report': 'users', 'since': 'soon'}):
+            self.assertEqual(self.submit(**data).status_code, status.HTTP_400_BAD_REQUEST)
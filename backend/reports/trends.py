@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import DailyStats
+from .rollup import refresh_if_behind
+
+GRANULARITIES = ('day', 'week', 'month')
+MAX_DAYS = 20 * 366
+DEFAULT_DAYS = 180
+CLOSED_PERIODS_TTL = 24 * 60 * 60
+CACHE_KEY = 'reports:trends:{}:{}:{}'
+
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_period(day, granularity):
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    return day + timedelta(days=1)
+
+
+def periods(start, end, granularity):
+    day = period_start(start, granularity)
+    while day <= end:
+        yield day
+        day = next_period(day, granularity)
+
+
+def totals(start, end, granularity):
+    """{period start: (borrows, returns)} from the DailyStats rows in [start, end]"""
+    rows = (
+        DailyStats.objects.filter(date__gte=start, date__lte=end)
+        .annotate(period=Trunc('date', granularity))
+        .order_by().values('period')
+        .annotate(borrows=Sum('borrows'), returns=Sum('returns'))
+        .values_list('period', 'borrows', 'returns')
+    )
+    return {period: (borrows, returns) for period, borrows, returns in rows}
+
+
+def borrowing_trend(start, end, granularity='day'):
+    """
+    Borrows and returns per day, week (from Monday) or month between two
+    dates, every period present even without activity.
+
+    Grouping happens in the database over DailyStats, one row per day
+    rather than one per loan; the scheduler keeps those rows up to date,
+    and a missing row for today is filled in first (see refresh_if_behind).
+    Periods that closed before the latest row never change, so their
+    totals are cached for a day; only the periods since are read each time.
+    """
+    start = period_start(start, granularity)
+    latest = DailyStats.objects.order_by('-date').values_list('date', flat=True).first()
+    if refresh_if_behind(latest):
+        latest = timezone.localdate()
+    current = period_start(min(latest or start, timezone.localdate()), granularity)
+
+    counts = {}
+    closed_end = min(end, current - timedelta(days=1))
+    if start <= closed_end:
+        counts.update(cache.get_or_set(
+            CACHE_KEY.format(granularity, start.isoformat(), closed_end.isoformat()),
+            lambda: totals(start, closed_end, granularity),
+            CLOSED_PERIODS_TTL,
+        ))
+    if end >= current:
+        counts.update(totals(max(start, current), end, granularity))
+
+    return [
+        {'date': period.isoformat(), 'borrows': counts.get(period, (0, 0))[0], 'returns': counts.get(period, (0, 0))[1]}
+        for period in periods(start, end, granularity)
+    ]
@@ -12,4 +12,7 @@ urlpatterns = [
     path('fine-collection/', views.fine_collection_report, name='fine_collection_report'),
     path('personal-stats/', views.personal_stats, name='personal_stats'),
     path('export/<str:report_type>/', views.export_report, name='export_report'),
+    path('jobs/', views.submit_report_job, name='submit_report_job'),
+    path('jobs/<int:job_id>/', views.report_job_detail, name='report_job_detail'),
+    path('jobs/<int:job_id>/download/', views.report_job_download, name='report_job_download'),
 ]
\ No newline at end of file
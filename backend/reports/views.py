@@ -3,55 +3,22 @@ from rest_framework.response import Response
 from rest_framework import permissions, status
 from django.db.models import Count, Sum, Q, F
 from django.utils import timezone
-from datetime import timedelta, datetime
-from django.http import JsonResponse
-from core.models import Book, BorrowRecord, User, Reservation, Fine
-from core.serializers import BookSerializer, BorrowRecordSerializer
+from datetime import date, timedelta, datetime
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from core.models import Book, BorrowRecord, User, Reservation, Fine, Job
+from core.serializers import BookSerializer, BorrowRecordSerializer, JobSerializer
+from . import activity, exports, rollup, trends
+from . import jobs as report_jobs
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def dashboard_stats(request):
     try:
-        total_users = User.objects.count()
-        total_books = Book.objects.count()
-        active_borrows = BorrowRecord.objects.filter(is_returned=False).count()
-        pending_reservations = Reservation.objects.filter(status='pending').count()
-        
-        # Calculate pending fines
-        pending_fines = Fine.objects.filter(is_paid=False).aggregate(
-            total_fines=Sum('amount')
-        )['total_fines'] or 0
-        
-        # Calculate overdue books
-        overdue_books = BorrowRecord.objects.filter(
-            is_returned=False, 
-            due_date__lt=timezone.now().date()
-        ).count()
-        
-        # Recent activities (last 7 days)
-        seven_days_ago = timezone.now() - timedelta(days=7)
-        recent_borrows = BorrowRecord.objects.filter(
-            borrow_date__gte=seven_days_ago
-        ).count()
-        
-        recent_returns = BorrowRecord.objects.filter(
-            return_date__gte=seven_days_ago
-        ).count()
-
-        # Calculate available books
-        available_books = Book.objects.filter(available_copies__gt=0).count()
-        
-        return Response({
-            'totalUsers': total_users,
-            'totalBooks': total_books,
-            'activeBorrows': active_borrows,
-            'pendingReservations': pending_reservations,
-            'pendingFines': float(pending_fines),
-            'overdueBooks': overdue_books,
-            'recentBorrows': recent_borrows,
-            'recentReturns': recent_returns,
-            'availableBooks': available_books
-        })
+        # Pre-aggregated by reports.rollup; a few rows however many loans there are
+        return Response(rollup.dashboard_stats())
     except Exception as e:
         return Response(
             {'error': f'Failed to fetch dashboard stats: {str(e)}'},
@@ -124,66 +91,56 @@ def user_reading_history(request, user_id=None):
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def borrowing_trends(request):
-    # Get borrowing trends for the last 6 months
-    end_date = timezone.now().date()
-    start_date = end_date - timedelta(days=180)  # 6 months
-    
-    # Generate dates for the period
-    dates = []
-    current_date = start_date
-    while current_date <= end_date:
-        dates.append(current_date)
-        current_date += timedelta(days=1)
-    
-    # Get daily borrow counts
-    daily_borrows = BorrowRecord.objects.filter(
-        borrow_date__gte=start_date,
-        borrow_date__lte=end_date
-    ).values('borrow_date').annotate(count=Count('id')).order_by('borrow_date')
-    
-    # Convert to dictionary for easy lookup
-    borrow_dict = {item['borrow_date']: item['count'] for item in daily_borrows}
-    
-    # Prepare data for response
-    trend_data = []
-    for date in dates:
-        trend_data.append({
-            'date': date.isoformat(),
-            'borrows': borrow_dict.get(date, 0)
-        })
-    
-    return Response(trend_data)
+    """Borrows and returns per ?granularity=day|week|month between ?start= and ?end= (ISO dates)"""
+    granularity = request.GET.get('granularity', 'day')
+    if granularity not in trends.GRANULARITIES:
+        return Response(
+            {'error': f"granularity must be one of: {', '.join(trends.GRANULARITIES)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        end_date = date.fromisoformat(request.GET['end']) if 'end' in request.GET else timezone.now().date()
+        start_date = (
+            date.fromisoformat(request.GET['start']) if 'start' in request.GET
+            else end_date - timedelta(days=trends.DEFAULT_DAYS)
+        )
+    except ValueError:
+        return Response({'error': 'start and end must be dates (YYYY-MM-DD).'}, status=status.HTTP_400_BAD_REQUEST)
+    if start_date > end_date:
+        return Response({'error': 'start must not be after end.'}, status=status.HTTP_400_BAD_REQUEST)
+    if (end_date - start_date).days > trends.MAX_DAYS:
+        return Response({'error': 'Date range is too long.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(trends.borrowing_trend(start_date, end_date, granularity))
+
+
+def paginated_report(request, queryset, allowed, default):
+    queryset = activity.ordered(queryset, request.GET.get('ordering'), allowed, default)
+    if queryset is None:
+        return Response(
+            {'error': f"ordering must be one of: {', '.join(allowed)} (prefix '-' for descending)"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    paginator = activity.ReportPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(page)
+
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def user_activity_report(request):
-    # Get user activity statistics
-    user_activity = User.objects.annotate(
-        total_borrows=Count('borrowrecord'),
-        active_borrows=Count('borrowrecord', filter=Q(borrowrecord__is_returned=False)),
-        total_fines=Sum('fines__amount', filter=Q(fines__is_paid=False)),
-        total_reservations=Count('reservations')
-    ).values(
-        'id', 'username', 'email', 'user_type', 'date_joined',
-        'total_borrows', 'active_borrows', 'total_fines', 'total_reservations'
-    ).order_by('-total_borrows')
-    
-    return Response(list(user_activity))
+    """Borrows, reservations and unpaid fines per user, paged and sorted by ?ordering="""
+    return paginated_report(
+        request, activity.user_activity(), activity.USER_ACTIVITY_ORDERING, '-total_borrows'
+    )
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def book_utilization_report(request):
-    # Get book utilization statistics
-    book_utilization = Book.objects.annotate(
-        total_borrows=Count('borrowrecord'),
-        current_borrows=Count('borrowrecord', filter=Q(borrowrecord__is_returned=False)),
-        utilization_rate=(Count('borrowrecord') * 100.0) / F('total_copies')
-    ).values(
-        'id', 'title', 'author', 'total_copies', 'available_copies',
-        'total_borrows', 'current_borrows', 'utilization_rate'
-    ).order_by('-utilization_rate')
-    
-    return Response(list(book_utilization))
+    """Borrows per copy of each book, paged and sorted by ?ordering="""
+    return paginated_report(
+        request, activity.book_utilization(), activity.BOOK_UTILIZATION_ORDERING, '-utilization_rate'
+    )
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
@@ -244,21 +201,141 @@ def personal_stats(request):
 @api_view(['GET'])
 @permission_classes([permissions.IsAdminUser])
 def export_report(request, report_type):
-    # This would typically generate and return a file (CSV, PDF, etc.)
-    # For now, we'll return JSON data that can be used to generate reports
-    
-    if report_type == 'users':
-        data = User.objects.all().values('username', 'email', 'user_type', 'date_joined', 'is_active')
-    elif report_type == 'books':
-        data = Book.objects.all().values('title', 'author', 'isbn', 'genre', 'total_copies', 'available_copies')
-    elif report_type == 'transactions':
-        data = BorrowRecord.objects.all().values(
-            'book__title', 'borrower__username', 'borrow_date', 
-            'due_date', 'return_date', 'is_returned', 'fine_amount'
+    """
+    Stream a report as ?output=csv (default) or ndjson, gzipped with
+    ?gzip=1, filtered by ?since=, ?until= and the report's own fields
+    (see reports.exports.FILTERS).
+    """
+    if report_type not in exports.EXPORTS:
+        return Response({'error': 'Invalid report type'}, status=status.HTTP_400_BAD_REQUEST)
+    fmt = request.GET.get('output', 'csv')
+    if fmt not in exports.FORMATS:
+        return Response(
+            {'error': f"output must be one of: {', '.join(exports.FORMATS)}"},
+            status=status.HTTP_400_BAD_REQUEST
         )
+    try:
+        filters = exports.export_filters(report_type, request.GET)
+    except exports.ExportFilterError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    compress = request.GET.get('gzip', '').lower() in ('1', 'true')
+
+    columns = exports.EXPORTS[report_type][1]
+    response = StreamingHttpResponse(
+        exports.export_chunks(exports.export_rows(report_type, filters), columns, fmt, compress),
+        content_type='application/gzip' if compress else exports.FORMATS[fmt][0],
+    )
+    filename = exports.export_filename(report_type, request.GET, fmt, compress)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+
+def job_data(request, job):
+    data = JobSerializer(job).data
+    data['download'] = (
+        request.build_absolute_uri(reverse('report_job_download', args=[job.pk]))
+        if job.status == 'succeeded' else None
+    )
+    return data
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def submit_report_job(request):
+    """
+    Compute a report in the background as a gzipped ?output= file, e.g.
+    {"report": "transactions", "output": "ndjson", "since": "2024-01-01"}.
+    A finished result for the same report, parameters and data comes back
+    at once (200); otherwise poll the job (202) until it has a download link.
+    """
+    params = dict(request.data.items())
+    try:
+        job, reused = report_jobs.submit_report(
+            params.pop('report', None), params.pop('output', 'csv'), params, user=request.user
+        )
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(
+        job_data(request, job),
+        status=status.HTTP_200_OK if job.status == 'succeeded' else status.HTTP_202_ACCEPTED
+    )
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def report_job_detail(request, job_id):
+    job = get_object_or_404(Job, pk=job_id, kind=report_jobs.JOB_KIND)
+    return Response(job_data(request, job))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def report_job_download(request, job_id):
+    """The finished report file; a single `Range: bytes=` range is answered with 206"""
+    job = get_object_or_404(Job, pk=job_id, kind=report_jobs.JOB_KIND, status='succeeded')
+    try:
+        report_file = default_storage.open(job.result['path'], 'rb')
+    except FileNotFoundError:
+        return Response({'error': 'Report file has expired; submit the report again.'}, status=status.HTTP_410_GONE)
+    return ranged_file_response(request, report_file, job.result['filename'], 'application/gzip')
+
+
+def ranged_file_response(request, file, filename, content_type):
+    size = file.size
+    byte_range = parse_range(request.headers.get('Range', ''), size)
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type, as_attachment=True, filename=filename)
+    elif byte_range is False:
+        file.close()
+        response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
     else:
-        return Response({'error': 'Invalid report type'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    return Response(list(data))
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(file, start, end - start + 1), status=status.HTTP_206_PARTIAL_CONTENT, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def parse_range(header, size):
+    """
+    (first, last) byte of a single `bytes=` range, None to send the whole
+    file (no header, several ranges, or a unit we don't serve) and False
+    when the range lies outside the file.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if first >= size or first > last:
+        return False
+    return first, last
+
 
-    
\ No newline at end of file
+def read_range(file, start, length, block_size=64 * 1024):
+    with file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data